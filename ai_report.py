@@ -1,15 +1,77 @@
-from openai import OpenAI
+import threading
+import time
+import metrics
+from config import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL
+
+SYSTEM_PROMPT = "你是一位專業的環境感測數據分析專家，請使用繁體中文回答。"
+
+_client = None
+_client_lock = threading.Lock()
+
+LLM_SECONDS = metrics.histogram(
+    "llm_request_seconds", "LLM call time until the full reply (complete / stream)", ["mode"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+)
+LLM_FIRST_TOKEN_SECONDS = metrics.histogram(
+    "llm_first_token_seconds", "Streaming LLM call time until the first token",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+LLM_REQUESTS = metrics.counter("llm_requests_total", "LLM calls by mode and result (ok / error)", ["mode", "result"])
+
+
+def get_client():
+    """共用同一個 OpenAI client（連線池可重複使用），第一次呼叫時才匯入並建立"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI  # 匯入要數百毫秒，不產生報告的行程不需要
+                _client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+    return _client
+
+
+def build_messages(sensor_context):
+    """sensor_context 為 summarize.py 產生的統計摘要文字"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"以下是感測資料的統計摘要：\n{sensor_context}\n請用繁體中文分析溫度、濕度、光度的趨勢與異常。"
+        }
+    ]
+
+
+def complete(messages, model=OPENAI_MODEL):
+    start = time.perf_counter()
+    try:
+        response = get_client().chat.completions.create(model=model, messages=messages)
+        content = response.choices[0].message.content
+    except Exception:
+        LLM_REQUESTS.labels("complete", "error").inc()
+        raise
+    LLM_SECONDS.labels("complete").observe(time.perf_counter() - start)
+    LLM_REQUESTS.labels("complete", "ok").inc()
+    return content
+
+
+def stream(messages, model=OPENAI_MODEL):
+    """逐段產生回覆文字（LLM 串流模式）"""
+    start = time.perf_counter()
+    first = True
+    try:
+        response = get_client().chat.completions.create(model=model, messages=messages, stream=True)
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first:
+                    LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                    first = False
+                yield chunk.choices[0].delta.content
+    except Exception:
+        LLM_REQUESTS.labels("stream", "error").inc()
+        raise
+    LLM_SECONDS.labels("stream").observe(time.perf_counter() - start)
+    LLM_REQUESTS.labels("stream", "ok").inc()
+
 
 def generate_ai_report(sensor_context):
-    client = OpenAI(
-        api_key="YOUR_API_KEY",
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-    )
-    response = client.chat.completions.create(
-        model="gemini-2.0-flash",
-        messages=[
-            {"role": "system", "content": "你是一位環境感測數據分析專家，請使用繁體中文回答。"},
-            {"role": "user", "content": f"分析以下資料: {sensor_context}"}
-        ]
-    )
-    return response.choices[0].message.content
+    return complete(build_messages(sensor_context))
@@ -1,14 +1,32 @@
-import RPi.GPIO as GPIO, time, logging
+import RPi.GPIO as GPIO, logging
 from config import BUZZER_PIN, LED_PIN
+from drivers import ActuatorDriver
 
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(BUZZER_PIN, GPIO.OUT)
-GPIO.setup(LED_PIN, GPIO.OUT)
-buzzer_pwm = GPIO.PWM(BUZZER_PIN, 1000)
-buzzer_pwm.stop()
-
-def stop_buzzer_immediate():
-    buzzer_pwm.stop()
-    GPIO.output(BUZZER_PIN, GPIO.HIGH)
-    logging.info("蜂鳴器已靜音")
+
+class GPIOActuator(ActuatorDriver):
+    """蜂鳴器（低電平觸發）與 LED；建立時才設定 GPIO"""
+
+    def __init__(self):
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(BUZZER_PIN, GPIO.OUT)
+        GPIO.output(BUZZER_PIN, GPIO.HIGH)  # 低電平觸發，先保持靜音
+        GPIO.setup(LED_PIN, GPIO.OUT)
+        self.buzzer_pwm = GPIO.PWM(BUZZER_PIN, 1000)
+        self.buzzer_pwm.stop()
+
+    def buzzer_on(self):
+        GPIO.output(BUZZER_PIN, GPIO.LOW)  # 低電平啟動蜂鳴器
+        self.buzzer_pwm.start(50)
+
+    def buzzer_off(self):
+        self.buzzer_pwm.ChangeDutyCycle(0)
+        self.buzzer_pwm.stop()
+        GPIO.output(BUZZER_PIN, GPIO.HIGH)
+        logging.info("蜂鳴器已靜音")
+
+    def led(self, on):
+        GPIO.output(LED_PIN, GPIO.HIGH if on else GPIO.LOW)
+
+    def cleanup(self):
+        GPIO.cleanup()
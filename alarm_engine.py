@@ -0,0 +1,284 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+_RESET = object()
+_STOP = object()
+
+
+class AlarmRule:
+    """單一通道的警報規則
+
+    超過門檻或變化率過快，且持續 min_duration 秒才觸發；
+    觸發後需回到門檻內側 hysteresis 以外、並持續 clear_duration 秒才解除，
+    避免數值在門檻附近來回跳動時蜂鳴器不停切換。
+    """
+
+    kind = "threshold"  # 同一通道可同時有門檻與異常兩種警報，事件紀錄以 (channel, kind) 區分
+    uses_threshold = True
+
+    def __init__(self, channel, direction, hysteresis=0.0, min_duration=0.0,
+                 clear_duration=None, max_rate=None, rate_window=60.0):
+        self.channel = channel
+        self.direction = direction  # ">" 高於門檻警報，"<" 低於門檻警報
+        self.hysteresis = hysteresis
+        self.min_duration = min_duration
+        self.clear_duration = min_duration if clear_duration is None else clear_duration
+        self.max_rate = max_rate  # 每分鐘最大變化量，None 表示不檢查
+        self.rate_window = rate_window
+        self._history = deque()
+        self.reset()
+
+    def reset(self):
+        self.active = False
+        self.reason = None
+        self.started = None
+        self.peak = None
+        self._since = None
+
+    def rate(self, ts, value):
+        """以 rate_window 秒前的讀數估計每分鐘變化量；資料不足時回傳 None"""
+        history = self._history
+        history.append((ts, value))
+        while len(history) > 1 and ts - history[1][0] >= self.rate_window:
+            history.popleft()
+        first_ts, first_value = history[0]
+        if ts - first_ts < self.rate_window / 2:
+            return None
+        return (value - first_value) / (ts - first_ts) * 60.0
+
+    def _beyond(self, value, threshold):
+        if self.active:
+            # 遲滯：已觸發時以較寬鬆的門檻判斷是否仍在警報區
+            if self.direction == ">":
+                return value > threshold - self.hysteresis
+            return value < threshold + self.hysteresis
+        if self.direction == ">":
+            return value > threshold
+        return value < threshold
+
+    def evaluate(self, ts, value, threshold):
+        """加入一筆讀數，狀態改變時回傳 True"""
+        rate = self.rate(ts, value)
+        too_fast = self.max_rate is not None and rate is not None and abs(rate) > self.max_rate
+        beyond = self._beyond(value, threshold)
+        want = beyond or too_fast
+
+        if self.active and (self.peak is None or (value > self.peak if self.direction == ">" else value < self.peak)):
+            self.peak = value
+
+        if want == self.active:
+            self._since = None
+            return False
+        if self._since is None:
+            self._since = ts
+        if ts - self._since < (self.min_duration if want else self.clear_duration):
+            return False
+
+        self._since = None
+        self.active = want
+        if want:
+            self.reason = "threshold" if beyond else "rate"
+            self.started = ts
+            self.peak = value
+        return True
+
+
+class AnomalyRule:
+    """異常偵測（anomaly.py）的警報：出現 spike / stuck 即觸發，clear_duration 秒內沒有新的異常才解除"""
+
+    kind = "anomaly"
+    uses_threshold = False
+
+    def __init__(self, channel, clear_duration=30.0):
+        self.channel = channel
+        self.clear_duration = clear_duration
+        self.reset()
+
+    def reset(self):
+        self.active = False
+        self.reason = None
+        self.started = None
+        self.peak = None
+        self._last = None
+
+    def evaluate(self, ts, value, kind):
+        """kind 為該筆樣本的異常種類（沒有則為 None），狀態改變時回傳 True"""
+        if kind:
+            self._last = ts
+            if not self.active:
+                self.active = True
+                self.reason = kind
+                self.started = ts
+                self.peak = value
+                return True
+            return False
+        if self.active and ts - self._last >= self.clear_duration:
+            self.active = False
+            return True
+        return False
+
+
+class AlarmEngine:
+    """在獨立執行緒評估警報規則
+
+    collect_data() 只把樣本放進佇列就返回；狀態改變時呼叫
+    on_change(flags, rule, ts)，flags 為 {channel: 門檻警報中} 加上 {channel_anomaly: 異常警報中}。
+    """
+
+    def __init__(self, rules, thresholds, on_change=None, max_queue=100):
+        self.rules = list(rules)
+        self.thresholds = thresholds
+        self.on_change = on_change
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self.evaluated = 0
+        self.dropped = 0
+        self.transitions = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="alarm-engine", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=2.0):
+        self._put(_STOP)
+        if self._thread:
+            self._thread.join(timeout)
+
+    def submit(self, ts, values, anomalies=None):
+        """加入一筆樣本 {channel: value} 與異常偵測結果 {channel: kind}，不會阻塞"""
+        self._put((ts, values, anomalies or {}))
+
+    def reset(self):
+        """清除所有規則狀態（例如修改門檻後重新判斷）"""
+        self._put(_RESET)
+
+    def flags(self):
+        # 異常規則另立旗標：正常範圍內的突波不應顯示成「過高」
+        flags = {}
+        for rule in self.rules:
+            key = rule.channel if rule.uses_threshold else f"{rule.channel}_anomaly"
+            flags[key] = flags.get(key, False) or rule.active
+        return flags
+
+    def queued(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "evaluated": self.evaluated,
+            "dropped": self.dropped,
+            "transitions": self.transitions,
+            "queued": self._queue.qsize(),
+            "active": [rule.channel for rule in self.rules if rule.active],
+        }
+
+    def _put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                # 佇列已滿：捨棄最舊的樣本
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _notify(self, rule, ts):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(self.flags(), rule, ts)
+        except Exception as e:
+            logger.error("Alarm change handler failed: %s", e)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            if item is _RESET:
+                now = time.time()
+                for rule in self.rules:
+                    if rule.active:
+                        # 視為解除，讓事件紀錄得以結束
+                        rule.active = False
+                        self.transitions += 1
+                        self._notify(rule, now)
+                    rule.reset()
+                self._notify(None, now)
+                continue
+            ts, values, anomalies = item
+            self.evaluated += 1
+            for rule in self.rules:
+                value = values.get(rule.channel)
+                if rule.uses_threshold:
+                    threshold = self.thresholds.get(rule.channel)
+                    if value is None or threshold is None:
+                        continue
+                    changed = rule.evaluate(ts, value, threshold)
+                else:
+                    changed = rule.evaluate(ts, value, anomalies.get(rule.channel))
+                if changed:
+                    self.transitions += 1
+                    self._notify(rule, ts)
+
+
+class ActuatorWorker:
+    """以獨立執行緒驅動蜂鳴器與 LED，呼叫端只設定目標狀態，不等待 GPIO"""
+
+    def __init__(self, actuator, blink_interval=0.5):
+        self.actuator = actuator
+        self.blink_interval = blink_interval
+        self._commands = queue.Queue()
+        self._thread = None
+        self.alarm = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="actuator", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=2.0):
+        self._commands.put(_STOP)
+        if self._thread:
+            self._thread.join(timeout)
+
+    def set_alarm(self, on):
+        self._commands.put(bool(on))
+
+    def _apply(self, on):
+        try:
+            if on:
+                self.actuator.buzzer_on()
+            else:
+                self.actuator.buzzer_off()
+                self.actuator.led(False)
+        except Exception as e:
+            logger.error("Actuator command failed: %s", e)
+
+    def _run(self):
+        led = False
+        while True:
+            try:
+                command = self._commands.get(timeout=self.blink_interval if self.alarm else None)
+            except queue.Empty:
+                # 警報期間 LED 閃爍
+                led = not led
+                try:
+                    self.actuator.led(led)
+                except Exception as e:
+                    logger.error("LED toggle failed: %s", e)
+                continue
+            if command is _STOP:
+                self._apply(False)
+                break
+            if command != self.alarm:
+                self.alarm = command
+                led = False
+                self._apply(command)
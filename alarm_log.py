@@ -0,0 +1,119 @@
+import logging
+import sqlite3
+import threading
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+CREATE_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS alarm_events (
+        id INTEGER PRIMARY KEY,
+        channel TEXT NOT NULL,
+        reason TEXT,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER,
+        threshold REAL,
+        peak REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_alarm_events_start ON alarm_events (start_ts)",
+    "CREATE INDEX IF NOT EXISTS ix_alarm_events_channel_start ON alarm_events (channel, start_ts)",
+]
+
+COLUMNS = ("id", "channel", "reason", "start_ts", "end_ts", "threshold", "peak")
+
+
+def create_tables(conn):
+    for sql in CREATE_SQL:
+        conn.execute(sql)
+    conn.commit()
+
+
+def close_open_events(conn):
+    """上次關機時仍在警報中的事件，以最後一筆讀數的時間結束"""
+    cur = conn.execute(
+        "UPDATE alarm_events SET end_ts = MAX(start_ts, COALESCE((SELECT MAX(ts) FROM sensor_data), start_ts)) "
+        "WHERE end_ts IS NULL"
+    )
+    conn.commit()
+    return cur.rowcount
+
+
+def _range_filter(start, end, channel):
+    # 與 [start, end] 有重疊的事件；start_ts 上限走索引
+    where = ["start_ts <= ?", "(end_ts IS NULL OR end_ts >= ?)"]
+    params = [end, start]
+    if channel:
+        where.append("channel = ?")
+        params.append(channel)
+    return " AND ".join(where), params
+
+
+def list_events(conn, start, end, channel=None, limit=100):
+    """列出區間內的警報事件，由新到舊"""
+    where, params = _range_filter(start, end, channel)
+    cursor = conn.execute(
+        f"SELECT {', '.join(COLUMNS)} FROM alarm_events WHERE {where} ORDER BY start_ts DESC LIMIT ?",
+        params + [limit]
+    )
+    return [dict(zip(COLUMNS, row)) for row in cursor]
+
+
+def summarize_events(conn, start, end, channel=None, now=None):
+    """依通道統計次數、區間內的累計秒數、最長一次與極值"""
+    where, params = _range_filter(start, end, channel)
+    open_end = end if now is None else min(end, now)
+    cursor = conn.execute(
+        f"""
+        SELECT channel, COUNT(*),
+               SUM(MIN(COALESCE(end_ts, ?), ?) - MAX(start_ts, ?)),
+               MAX(COALESCE(end_ts, ?) - start_ts),
+               MIN(peak), MAX(peak), SUM(end_ts IS NULL)
+        FROM alarm_events WHERE {where}
+        GROUP BY channel ORDER BY channel
+        """,
+        [open_end, end, start, open_end] + params
+    )
+    return {
+        ch: {
+            "count": count,
+            "duration": max(0, duration or 0),
+            "longest": max(0, longest or 0),
+            "min_peak": lo,
+            "max_peak": hi,
+            "active": active,
+        }
+        for ch, count, duration, longest, lo, hi, active in cursor
+    }
+
+
+class AlarmLog:
+    """把警報狀態改變寫成事件：觸發時新增一列，解除時補上結束時間與極值"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._open = {}  # (channel, rule.kind) -> 進行中事件的 id；門檻與異常警報可同時進行
+        self._lock = threading.Lock()
+
+    def record(self, rule, ts, threshold):
+        """由警報引擎在狀態改變時呼叫"""
+        with self._lock:
+            try:
+                with storage.write_transaction(self.db_path) as conn:
+                    if rule.active:
+                        cur = conn.execute(
+                            "INSERT INTO alarm_events (channel, reason, start_ts, threshold, peak) VALUES (?, ?, ?, ?, ?)",
+                            (rule.channel, rule.reason, int(rule.started), threshold, rule.peak)
+                        )
+                        self._open[(rule.channel, rule.kind)] = cur.lastrowid
+                    else:
+                        event_id = self._open.pop((rule.channel, rule.kind), None)
+                        if event_id is not None:
+                            conn.execute(
+                                "UPDATE alarm_events SET end_ts = ?, peak = ? WHERE id = ?",
+                                (int(ts), rule.peak, event_id)
+                            )
+            except sqlite3.Error as e:
+                logger.error("Failed to record alarm event: %s", e)
@@ -0,0 +1,223 @@
+"""感測資料的異常偵測：逐筆（線上）與 NumPy 批次（重新掃描歷史）兩種模式，結果相同
+
+每個通道以 EWMA 估計平均與變異數，讀值與平均的差距超過 z_threshold 個標準差記為 spike；
+連續 stuck_samples 筆讀值都沒有變化（差異在 stuck_epsilon 內）記為 stuck（感測器卡住）。
+
+    python anomaly.py --from 2024-03-01 --to 2024-04-01      # 重新掃描歷史資料
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+import blockstore
+import rollup
+
+SPIKE = "spike"
+STUCK = "stuck"
+KINDS = (None, SPIKE, STUCK)  # 批次模式的代碼 0 / 1 / 2
+
+
+class ChannelDetector:
+    """單一通道的線上偵測，每筆 O(1)"""
+
+    def __init__(self, alpha=0.05, z_threshold=4.0, min_std=0.5, warmup=30, stuck_samples=None, stuck_epsilon=0.0):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_std = min_std  # 標準差下限，DHT11 這類整數讀值變異數常為 0
+        self.warmup = warmup
+        self.stuck_samples = stuck_samples
+        self.stuck_epsilon = stuck_epsilon
+        self.reset()
+
+    def reset(self):
+        self.mean = None
+        self.var = 0.0
+        self.count = 0
+        self.prev = None
+        self.run = 0
+
+    def update(self, value):
+        """加入一筆讀數，回傳 'spike' / 'stuck' / None"""
+        if value is None:
+            return None
+        if self.mean is None:
+            self.mean, self.var, self.count, self.prev, self.run = value, 0.0, 1, value, 1
+            return None
+        diff = value - self.mean
+        flag = None
+        if self.count >= self.warmup and abs(diff) > self.z_threshold * max(math.sqrt(self.var), self.min_std):
+            flag = SPIKE
+        # EWMA 平均與變異數（與 scan_channel 的遞迴式相同）
+        incr = self.alpha * diff
+        self.mean += incr
+        self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.count += 1
+        self.run = self.run + 1 if abs(value - self.prev) <= self.stuck_epsilon else 1
+        self.prev = value
+        if flag is None and self.stuck_samples and self.run >= self.stuck_samples:
+            flag = STUCK
+        return flag
+
+    def state(self):
+        return (self.mean, self.var, self.count, self.prev, self.run)
+
+
+class AnomalyDetector:
+    """多通道的線上偵測：update({channel: value}) 回傳有異常的 {channel: kind}"""
+
+    def __init__(self, channels, alpha=0.05, z_threshold=4.0, warmup=30):
+        self.detectors = {
+            channel: ChannelDetector(alpha=alpha, z_threshold=z_threshold, warmup=warmup, **options)
+            for channel, options in channels.items()
+        }
+        self.samples = 0
+        self.counts = {channel: {SPIKE: 0, STUCK: 0} for channel in channels}
+
+    def update(self, values):
+        self.samples += 1
+        flags = {}
+        for channel, detector in self.detectors.items():
+            kind = detector.update(values.get(channel))
+            if kind:
+                flags[channel] = kind
+                self.counts[channel][kind] += 1
+        return flags
+
+    def reset(self):
+        for detector in self.detectors.values():
+            detector.reset()
+
+    def stats(self):
+        return {"samples": self.samples, "flagged": self.counts}
+
+
+def _linear_recurrence(u, decay, init, block=256):
+    """y[k] = decay * y[k-1] + u[k]，y[-1] = init
+
+    分成 block 筆一段：段內以 cumsum 一次算完，段與段之間只傳遞一個數值，
+    Python 迴圈次數為 n / block。
+    """
+    n = len(u)
+    if n == 0:
+        return np.empty(0)
+    # decay ** -block 不能溢位
+    block = max(16, min(block, int(500 / max(-math.log(decay), 1e-12))))
+    nb = -(-n // block)
+    u = np.concatenate([u, np.zeros(nb * block - n)]).reshape(nb, block)
+    k = np.arange(block)
+    powers = decay ** k
+    partial = np.cumsum(u * decay ** -k.astype(np.float64), axis=1) * powers
+    carries = np.empty(nb)
+    carry = init
+    decay_block = decay ** block
+    for b, end in enumerate(partial[:, -1].tolist()):
+        carries[b] = carry
+        carry = end + decay_block * carry
+    return (partial + carries[:, None] * (decay * powers)).ravel()[:n]
+
+
+def scan_channel(values, alpha=0.05, z_threshold=4.0, min_std=0.5, warmup=30,
+                 stuck_samples=None, stuck_epsilon=0.0, state=None):
+    """批次偵測，回傳 (代碼陣列, state)；state 傳給下一段可接續掃描，結果與 ChannelDetector 逐筆相同
+
+    代碼：0 正常、1 spike、2 stuck（見 KINDS）；NaN 視為缺值，不影響統計。
+    """
+    x_all = np.asarray(values, dtype=np.float64)
+    codes = np.zeros(len(x_all), dtype=np.int8)
+    valid = np.flatnonzero(~np.isnan(x_all))
+    x = x_all[valid]
+    if len(x) == 0:
+        return codes, state
+    if state is None or state[0] is None:
+        # 第一筆只用來初始化
+        state = (x[0], 0.0, 1, x[0], 1)
+        valid, x = valid[1:], x[1:]
+        if len(x) == 0:
+            return codes, state
+    mean0, var0, count0, prev0, run0 = state
+    n = len(x)
+
+    mean = _linear_recurrence(alpha * x, 1 - alpha, mean0)
+    mean_before = np.concatenate([[mean0], mean[:-1]])
+    diff = x - mean_before
+    var = _linear_recurrence((1 - alpha) * alpha * diff * diff, 1 - alpha, var0)
+    var_before = np.concatenate([[var0], var[:-1]])
+    count_before = count0 + np.arange(n)
+    spike = (count_before >= warmup) & (np.abs(diff) > z_threshold * np.maximum(np.sqrt(var_before), min_std))
+
+    # 連續不變的筆數：從最近一次變化的位置算起
+    idx = np.arange(n)
+    changed = np.abs(x - np.concatenate([[prev0], x[:-1]])) > stuck_epsilon
+    last_change = np.maximum.accumulate(np.where(changed, idx, -1))
+    run = np.where(last_change >= 0, idx - last_change + 1, run0 + idx + 1)
+
+    out = np.where(spike, 1, 0).astype(np.int8)
+    if stuck_samples:
+        out[~spike & (run >= stuck_samples)] = 2
+    codes[valid] = out
+    return codes, (float(mean[-1]), float(var[-1]), int(count0 + n), float(x[-1]), int(run[-1]))
+
+
+def scan(columns, channels, alpha=0.05, z_threshold=4.0, warmup=30, state=None):
+    """多通道批次偵測：columns 為 {channel: 陣列}，回傳 ({channel: 代碼陣列}, state)"""
+    state = dict(state or {})
+    codes = {}
+    for channel, options in channels.items():
+        codes[channel], state[channel] = scan_channel(
+            columns[channel], alpha=alpha, z_threshold=z_threshold, warmup=warmup,
+            state=state.get(channel), **options
+        )
+    return codes, state
+
+
+def flags_at(codes, i):
+    """把批次代碼轉成單一時間點的 {channel: kind}，沒有異常回傳 None"""
+    flags = {channel: KINDS[c[i]] for channel, c in codes.items() if c[i]}
+    return flags or None
+
+
+def rescan(conn, device_id, start, end, channels, alpha=0.05, z_threshold=4.0, warmup=30,
+           chunk_rows=65536, limit=1000):
+    """重新掃描資料庫中的歷史資料，回傳 (筆數, 各通道各類異常的次數, 前 limit 個異常點)"""
+    counts = {channel: {SPIKE: 0, STUCK: 0} for channel in channels}
+    points = []
+    total = 0
+    state = None
+    for block in blockstore.iter_range(conn, device_id, start, end, chunk_rows):
+        codes, state = scan(block, channels, alpha, z_threshold, warmup, state)
+        for channel, c in codes.items():
+            counts[channel][SPIKE] += int(np.count_nonzero(c == 1))
+            counts[channel][STUCK] += int(np.count_nonzero(c == 2))
+        if len(points) < limit:
+            flagged = np.flatnonzero(np.any([c != 0 for c in codes.values()], axis=0))
+            for i in flagged[:limit - len(points)].tolist():
+                points.append({"ts": int(block["ts"][i]), "flags": flags_at(codes, i)})
+        total += len(block["ts"])
+    return total, counts, points
+
+
+if __name__ == '__main__':
+    import json
+    import storage
+    from config import DB_PATH, DEVICE_ID, ANOMALY_CHANNELS, ANOMALY_ALPHA, ANOMALY_Z_THRESHOLD, ANOMALY_WARMUP
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--device', default=DEVICE_ID)
+    parser.add_argument('--from', dest='start', default='0')
+    parser.add_argument('--to', dest='end', default=None)
+    parser.add_argument('--limit', type=int, default=20, help='列出的異常點數')
+    args = parser.parse_args()
+
+    conn = storage.connect(args.db, readonly=True)
+    started = time.perf_counter()
+    end = rollup.parse_time_arg(args.end) if args.end else int(time.time())
+    total, counts, points = rescan(
+        conn, args.device, rollup.parse_time_arg(args.start), end, ANOMALY_CHANNELS,
+        ANOMALY_ALPHA, ANOMALY_Z_THRESHOLD, ANOMALY_WARMUP, limit=args.limit
+    )
+    conn.close()
+    print(f"Scanned {total} rows in {time.perf_counter() - started:.2f}s")
+    print(json.dumps({"flagged": counts, "points": points}, ensure_ascii=False, indent=2))
@@ -1,49 +1,127 @@
-app.py
 import threading
 import time
-import sqlite3
 import logging
+import atexit
+import signal
+import sys
 from datetime import datetime
-from flask import Flask, render_template, jsonify
-from flask_sqlalchemy import SQLAlchemy
-import RPi.GPIO as GPIO
-import dht11
-import random
+from flask import Flask, Blueprint, render_template, jsonify, Response
 import os
-from apds9930 import APDS9930
-from flask import request
-from openai import OpenAI
-
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+from flask import request, g
+import ai_report
+from report_jobs import ReportJobs
+from config import WRITE_BUFFER_MAX_ROWS, WRITE_BUFFER_MAX_AGE, WRITE_BUFFER_QUEUE_SIZE
+from config import HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, DATA_WINDOW
+from config import STREAM_CLIENT_QUEUE_SIZE, STREAM_HEARTBEAT, STREAM_MAX_CLIENTS, DATA_RANGE_MAX_ROWS
+from config import ROLLUP_RESOLUTIONS, SERIES_DEFAULT_POINTS
+from config import RAW_RETENTION_DAYS, ROLLUP_RETENTION_DAYS, RETENTION_INTERVAL, CHECKPOINT_INTERVAL
+from config import RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE, VACUUM_PAGES_PER_RUN
+from config import COMPACT_ENABLED, COMPACT_AFTER, BLOCK_SECONDS
+from config import DHT_INTERVAL, LIGHT_INTERVAL, SAMPLE_BACKOFF_MAX, SAMPLE_MERGE_MAX_AGE
+from config import SENSOR_BACKEND, SIM_SPEEDUP
+from config import BASE_DIR, DB_PATH, OPENAI_MODEL
+from config import REPORT_WORKERS, REPORT_CACHE_SIZE, REPORT_CACHE_TTL, REPORT_JOB_TTL
+from config import REPORT_DEFAULT_WINDOW, REPORT_MAX_POINTS, REPORT_MAX_CHARS
+from config import ALARM_RULES, ALARM_MIN_DURATION, ALARM_CLEAR_DURATION, ALARM_RATE_WINDOW
+from config import ALARM_QUEUE_SIZE, ALARM_LED_BLINK
+from config import DEVICE_ID, COLLECTOR_URL, COLLECTOR_MODE, INGEST_TOKEN, INGEST_MAX_BYTES
+from config import PUSH_INTERVAL, PUSH_BATCH_SIZE, PUSH_BACKOFF_MAX, SPOOL_DIR, SPOOL_MAX_BYTES
+from config import EXPORT_CHUNK_ROWS, IMPORT_MAX_BYTES
+from config import SERVER_ROLE, WEB_HOST, WEB_PORT, WEB_DEBUG, RUNTIME_DIR, LIVE_SNAPSHOT_PATH, STATS_PATH
+from config import SNAPSHOT_POLL_INTERVAL, SETTINGS_POLL_INTERVAL, STATS_INTERVAL
+from config import SQLITE_READ_POOL_SIZE
+from config import ANOMALY_ALPHA, ANOMALY_Z_THRESHOLD, ANOMALY_WARMUP, ANOMALY_CHANNELS
+from config import ANOMALY_ALARMS, ANOMALY_CLEAR_DURATION
+from config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_RATE_LIMITS
+from config import COMPRESS_ENABLED, COMPRESS_MIN_BYTES, COMPRESS_LEVEL, BROTLI_QUALITY, COMPRESS_TYPES
+from config import COMPRESS_CACHE_SIZE, STATIC_MAX_AGE
+from write_buffer import WriteBuffer
+from ring_buffer import SampleRing
+import schema
+import rollup
+import retention
+from functools import partial
+from event_stream import EventBroadcaster, StreamLimit, format_sse
+from sampler import Sampler, SensorTask
+from drivers import load_drivers
+from alarm_engine import AlarmRule, AnomalyRule, AlarmEngine, ActuatorWorker
+import alarm_log
+import collector
+from edge_push import EdgePusher
+import tempfile
+import argparse
+import shared_state
+import storage
+import metrics
+import logs
+import http_cache
+from sensor_data import db, SensorData
+
+# Set up logging：記錄經佇列交給背景執行緒輸出，採樣與請求執行緒不做 I/O
+logs.setup(LOG_LEVEL, LOG_FORMAT, queue_size=LOG_QUEUE_SIZE, rate_limits=LOG_RATE_LIMITS)
 logger = logging.getLogger(__name__)
-
-# 初始化 GPIO 模式
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
-
-app = Flask(__name__)
-# ✅ 先定義 BASE_DIR，再設定資料庫路徑
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'data.db')
-
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{DB_PATH}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-
-# GPIO setup
-DHT_PIN = 4  # DHT11 Data pin
-LED_PIN = 18  # LED
-
-# 蜂鳴器設定
-BUZZER_PIN = 19
-GPIO.setup(BUZZER_PIN, GPIO.OUT)
-GPIO.output(BUZZER_PIN, 1)  # 初始靜音（低電平觸發）
-
-# 在開頭區域初始化時加入 PWM
-buzzer_pwm = GPIO.PWM(BUZZER_PIN, 1000)  # 建立 PWM，初始頻率 1000 Hz
-buzzer_pwm.stop()  # 先關閉蜂鳴器
-
+# 每筆樣本的記錄（DEBUG 等級；開啟時限流，預設每分鐘一筆）
+sample_logger = logging.getLogger("samples")
+
+# 路由定義在 blueprint，由 create_app() 建立 Flask app 時註冊
+bp = Blueprint('monitor', __name__)
+
+# /metrics 的請求與警報指標（感測器、寫入緩衝與 LLM 的指標定義在各自的模組）
+REQUEST_SECONDS = metrics.histogram("http_request_seconds", "Time to build the response, per route", ["route", "method"])
+REQUESTS = metrics.counter("http_requests_total", "HTTP responses per route and status", ["route", "method", "status"])
+STREAMS_REJECTED = metrics.counter("stream_responses_rejected_total", "Streaming requests refused with 503 at the limit")
+ALARM_TRANSITIONS = metrics.counter("alarm_transitions_total", "Alarm rules raised / cleared", ["channel", "state"])
+
+# 感測資料先進寫入緩衝，再批次寫入資料庫
+write_buffer = WriteBuffer(
+    DB_PATH,
+    max_rows=WRITE_BUFFER_MAX_ROWS,
+    max_age=WRITE_BUFFER_MAX_AGE,
+    max_queue=WRITE_BUFFER_QUEUE_SIZE,
+    hooks=[partial(rollup.apply, resolutions=ROLLUP_RESOLUTIONS)],
+    device_id=DEVICE_ID
+)
+
+# 邊緣節點：設定了收集端網址才推送
+edge_pusher = EdgePusher(
+    DB_PATH,
+    DEVICE_ID,
+    COLLECTOR_URL,
+    SPOOL_DIR,
+    interval=PUSH_INTERVAL,
+    batch_size=PUSH_BATCH_SIZE,
+    spool_max_bytes=SPOOL_MAX_BYTES,
+    token=INGEST_TOKEN,
+    backoff_max=PUSH_BACKOFF_MAX
+) if COLLECTOR_URL else None
+
+# 資料保留與壓縮（分批刪除、incremental VACUUM、WAL checkpoint）
+retention_worker = retention.RetentionWorker(
+    DB_PATH,
+    raw_days=RAW_RETENTION_DAYS,
+    rollup_days=ROLLUP_RETENTION_DAYS,
+    finest_resolution=min(ROLLUP_RESOLUTIONS),
+    interval=RETENTION_INTERVAL,
+    checkpoint_interval=CHECKPOINT_INTERVAL,
+    batch_size=RETENTION_BATCH_SIZE,
+    batch_pause=RETENTION_BATCH_PAUSE,
+    vacuum_pages=VACUUM_PAGES_PER_RUN,
+    # 較舊的本機原始資料壓成區塊；邊緣節點只壓縮已切成批次檔的資料
+    device_id=DEVICE_ID,
+    compact_after=COMPACT_AFTER if COMPACT_ENABLED else None,
+    block_seconds=BLOCK_SECONDS,
+    compact_limit=edge_pusher.cursor if edge_pusher else None
+)
+
+# AI 報告工作佇列（背景產生 + 結果快取）
+report_jobs = ReportJobs(
+    ai_report.complete,
+    workers=REPORT_WORKERS,
+    cache_size=REPORT_CACHE_SIZE,
+    cache_ttl=REPORT_CACHE_TTL,
+    job_ttl=REPORT_JOB_TTL,
+    db_path=DB_PATH  # 多個 web worker 共用工作狀態與快取
+)
 
 # 預設警報閾值
 alert_thresholds = {
@@ -52,62 +130,66 @@ alert_thresholds = {
     "light": 30.0
 }
 
-# Sensor initialization
-try:
-    light_detect = APDS9930(1)
-    light_detect.enable_ambient_light_sensor(False)
-    logger.info("APDS9930 Light sensor initialized successfully")
-    time.sleep(1)
-except Exception as e:
-    logger.error(f"Failed to initialize Light sensor: {e}")
-    exit(1)
-    
-try:
-    instance = dht11.DHT11(pin=DHT_PIN)
-    logger.info("DHT11 sensor initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize DHT11 sensor: {e}")
-    exit(1)
-
-# Database model (must match existing sensor_data table)
-class SensorData(db.Model):
-    __tablename__ = 'sensor_data'  # Explicitly set table name
-    id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.String(20))
-    temperature = db.Column(db.Float)
-    humidity = db.Column(db.Float)
-    light = db.Column(db.Float)
+# Sensor / actuator：只有負責採樣的行程（SERVER_ROLE 為 all 或 sampler）才載入驅動與 GPIO
+drivers = None
+sampler = None
+actuator_worker = None
+detector = None
+
+# 模擬模式可加速採樣做壓力測試
+speedup = SIM_SPEEDUP if SENSOR_BACKEND == "sim" else 1.0
+
+def init_sampling():
+    """載入感測器驅動（config.SENSOR_BACKEND 選擇實機或模擬）並建立採樣排程"""
+    global drivers, sampler, actuator_worker, detector
+    import anomaly
+    drivers = load_drivers(SENSOR_BACKEND)
+    # 每個感測器依自己的週期採樣，DHT11 的慢速讀取不會拖累光感
+    sampler = Sampler(
+        [
+            SensorTask("dht", drivers.dht.read, DHT_INTERVAL / speedup, backoff_max=SAMPLE_BACKOFF_MAX),
+            SensorTask("light", drivers.light.read, LIGHT_INTERVAL / speedup, backoff_max=SAMPLE_BACKOFF_MAX),
+        ],
+        primary="dht",
+        max_age=SAMPLE_MERGE_MAX_AGE
+    )
+    # 蜂鳴器與 LED 由獨立執行緒驅動，採樣與寫入不會等待 GPIO
+    actuator_worker = ActuatorWorker(drivers.actuator, blink_interval=ALARM_LED_BLINK)
+    # 每筆樣本 O(1) 的異常偵測（EWMA z 分數、卡住判定）
+    detector = anomaly.AnomalyDetector(
+        ANOMALY_CHANNELS, alpha=ANOMALY_ALPHA, z_threshold=ANOMALY_Z_THRESHOLD, warmup=ANOMALY_WARMUP
+    )
+
+INDEX_TEMPLATE = os.path.join(BASE_DIR, 'index.html')
+
+# web 行程：/data 與 /stream 讀取採樣行程寫出的快照檔
+live_snapshot = shared_state.SnapshotReader(LIVE_SNAPSHOT_PATH)
 
 # Verify existing table schema
 def check_table_schema():
     try:
-        with app.app_context():
-            conn = sqlite3.connect('data.db')
-            cursor = conn.cursor()
-            cursor.execute("PRAGMA table_info(sensor_data)")
-            columns = cursor.fetchall()
-            expected_columns = [
-                ('id', 'INTEGER'),
-                ('timestamp', 'TEXT'),
-                ('temperature', 'REAL'),
-                ('humidity', 'REAL'),
-                ('light', 'REAL')
-            ]
-            actual_columns = [(col[1], col[2]) for col in columns]  # Name and type
-            if set(expected_columns).issubset(set(actual_columns)):
-                logger.info("Existing sensor_data table schema is compatible")
-            else:
-                logger.error(f"Schema mismatch. Expected {expected_columns}, found {actual_columns}")
-                exit(1)
-            cursor.execute("SELECT COUNT(*) FROM sensor_data")
-            count = cursor.fetchone()[0]
-            logger.info(f"Table sensor_data contains {count} records")
+        # 先把舊版資料表升級（新增 ts 欄位與索引），再檢查結構
+        version = schema.migrate(DB_PATH)
+        conn = storage.connect(DB_PATH)
+        compatible, actual_columns = schema.verify_sensor_table(conn)
+        if compatible:
+            logger.info(f"sensor_data table schema is compatible (version {version})")
+        else:
+            logger.error(f"Schema mismatch. Expected {schema.EXPECTED_COLUMNS}, found {actual_columns}")
             conn.close()
+            return False
+        count = retention.row_count(conn)
+        logger.info(f"Table sensor_data contains {count} records")
+        closed = alarm_log.close_open_events(conn)
+        if closed:
+            logger.info(f"Closed {closed} alarm events left open by the previous run")
+        conn.close()
+        return True
     except Exception as e:
         logger.error(f"Failed to verify sensor_data table: {e}")
-        exit(1)
+        return False
 
-@app.route('/set_thresholds', methods=['POST'])
+@bp.route('/set_thresholds', methods=['POST'])
 def set_thresholds():
     global alert_thresholds
     try:
@@ -115,12 +197,17 @@ def set_thresholds():
         if not data:
             return jsonify({"error": "No data received"}), 400
 
-        alert_thresholds["temperature"] = float(data.get("temperature", alert_thresholds["temperature"]))
-        alert_thresholds["humidity"] = float(data.get("humidity", alert_thresholds["humidity"]))
-        alert_thresholds["light"] = float(data.get("light", alert_thresholds["light"]))
+        # 寫入 settings 表，採樣行程會套用新的門檻；其他 web worker 可能已改過，先以表中的值為準
+        with storage.write_transaction(DB_PATH) as conn:
+            alert_thresholds.update(current_thresholds(conn))
+            alert_thresholds["temperature"] = float(data.get("temperature", alert_thresholds["temperature"]))
+            alert_thresholds["humidity"] = float(data.get("humidity", alert_thresholds["humidity"]))
+            alert_thresholds["light"] = float(data.get("light", alert_thresholds["light"]))
+            shared_state.save_json_setting(conn, "thresholds", alert_thresholds)
 
-        # ✅ 更新閾值時立即靜音
-        stop_buzzer_immediate()
+        # ✅ 更新閾值時立即靜音（本行程負責採樣時）
+        if sampler is not None:
+            stop_buzzer_immediate()
 
         logger.info(f"✅ Updated thresholds: {alert_thresholds}")
         return jsonify({"success": True, "thresholds": alert_thresholds})
@@ -128,611 +215,816 @@ def set_thresholds():
         logger.error(f"Failed to set thresholds: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/create_report', methods=['POST'])
+
+# 串流模式的報告：邊產生邊以 SSE 轉送
+def stream_report(messages):
+    """以 SSE 逐段轉送 LLM 回覆；完成後寫入報告快取"""
+    key = report_jobs.key_for(messages, OPENAI_MODEL)
+    # 先送出註解行，讓瀏覽器立刻收到回應
+    yield b": report\n\n"
+    cached = report_jobs.cached(key)
+    if cached is not None:
+        yield format_sse("token", {"text": cached})
+        yield format_sse("done", {"cached": True})
+        return
+
+    parts = []
+    size = 0
+    try:
+        for text in ai_report.stream(messages, OPENAI_MODEL):
+            yield format_sse("token", {"text": text})
+            # 只保留上限內的內容供快取，避免單一報告佔用過多記憶體
+            if parts is not None:
+                size += len(text)
+                if size <= REPORT_MAX_CHARS:
+                    parts.append(text)
+                else:
+                    parts = None
+    except Exception as e:
+        logger.error(f"Report stream failed: {e}")
+        yield format_sse("error", {"error": str(e)})
+        return
+    if parts is not None:
+        report_jobs.store(key, "".join(parts))
+    yield format_sse("done", {"cached": False})
+
+
+@bp.route('/create_report', methods=['POST'])
 def create_report():
+    import summarize  # NumPy 只在產生報告時載入
     try:
-        data = SensorData.query.order_by(SensorData.id.desc()).limit(50).all()
-        labels = [d.timestamp for d in data]
-        temps = [d.temperature for d in data]
-        hums = [d.humidity for d in data]
-        lights = [d.light for d in data]
-
-        # 反轉順序（由舊到新）
-        labels = labels[::-1]
-        temps = temps[::-1]
-        hums = hums[::-1]
-        lights = lights[::-1]
-
-        # 組成要給模型看的 context
-        sensor_context = {
-            "timestamps": [str(t) for t in labels],
-            "temperature": temps,
-            "humidity": hums,
-            "light": lights
-        }
-
-
-        client = OpenAI(
-            api_key="金鑰",
-                base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-        )
-        response = client.chat.completions.create(
-            model="gemini-2.0-flash",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "你是一位專業的環境感測數據分析專家，請使用繁體中文回答。"
-                },
-                {
-                    "role": "user",
-                    "content": f"以下是最新的感測資料：{sensor_context}。請用繁體中文分析溫度、濕度、光度的趨勢與異常。"
-                }
-            ]
-        )
-        message = response.choices[0].message.content
-        print("報告內容%s" % response.choices[0].message.content)
-        
-        return jsonify({"success": True, "message": message})
+        body = request.get_json(silent=True) or {}
+        start, end = summarize.window_bounds(body.get("window", REPORT_DEFAULT_WINDOW))
+    except (TypeError, ValueError) as e:
+        return jsonify(error=f"Invalid window: {e}"), 400
+    try:
+        # 以 NumPy 把整段區間壓縮成統計摘要，提示詞長度與區間長短無關
+        with storage.read_connection(DB_PATH) as conn:
+            sensor_context = summarize.build_context(
+                conn, start, end, current_thresholds(conn), DEVICE_ID,
+                max_points=REPORT_MAX_POINTS, resolutions=ROLLUP_RESOLUTIONS
+            )
+
+        messages = ai_report.build_messages(sensor_context)
+        if body.get("stream") or request.args.get("stream"):
+            # 串流模式：邊產生邊送出
+            return sse_response(stream_report(messages))
+
+        # 交給背景工作產生，立即回傳 job id；相同資料視窗會直接命中快取
+        job = report_jobs.submit(messages, OPENAI_MODEL)
+        return jsonify(success=True, **job.to_dict()), 202
     except Exception as e:
         logger.error(f"Failed to create report: {e}")
         return jsonify({"error": str(e)}), 500
-        
-# Alarm function
-def trigger_alarm():
-    try:
-        logger.info("Triggering alarm")
-        GPIO.output(BUZZER_PIN, GPIO.HIGH)
-        time.sleep(3)
-        GPIO.output(BUZZER_PIN, GPIO.LOW)
-        for _ in range(3):
-            GPIO.output(LED_PIN, GPIO.HIGH)
-            time.sleep(0.5)
-            GPIO.output(LED_PIN, GPIO.LOW)
-            time.sleep(0.5)
-    except Exception as e:
-        logger.error(f"Alarm execution failed: {e}")
 
-# Data collection function with thread lock
-data_lock = threading.Lock()
-# 全域變數儲存蜂鳴器狀態
-buzzer_active = False
-buzzer_timer = None
-alert_triggered_tem = 26
-alert_triggered_hum = 60
-alert_triggered_lig = 160
+# 查詢報告工作狀態與結果
+@bp.route('/report/<job_id>')
+def get_report(job_id):
+    job = report_jobs.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown report job"), 404
+    return jsonify(job.to_dict())
+        
+# 最近 DATA_WINDOW 筆讀數，/data 直接由此回應，不查詢 SQLite
+recent_samples = SampleRing(
+    DATA_WINDOW,
+    buzzer="OFF",
+    tem=False,
+    hum=False,
+    lig=False,
+    temperature_anomaly=False,
+    humidity_anomaly=False,
+    light_anomaly=False
+)
+
+# /stream 的推送中心：新樣本與警報狀態變化
+events = EventBroadcaster(max_queue=STREAM_CLIENT_QUEUE_SIZE, heartbeat=STREAM_HEARTBEAT)
+# 串流回應各占一個 worker 執行緒，超過上限回 503（瀏覽器端退回輪詢）
+stream_limit = StreamLimit(STREAM_MAX_CLIENTS)
+
+
+def sse_response(body):
+    """包成 text/event-stream 回應；已達 STREAM_MAX_CLIENTS 時回 503，連線關閉時釋放名額"""
+    if not stream_limit.acquire():
+        STREAMS_REJECTED.inc()
+        response = jsonify(error="Too many open streams, retry later")
+        response.status_code = 503
+        response.headers['Retry-After'] = str(int(STREAM_HEARTBEAT))
+        return response
+    response = Response(
+        body,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(stream_limit.release)
+    return response
+
+def current_thresholds(conn):
+    """web 行程以 settings 表為準，採樣行程直接用記憶體中的值"""
+    if SERVER_ROLE == "web":
+        return shared_state.load_json_setting(conn, "thresholds", dict(alert_thresholds))
+    return dict(alert_thresholds)
+
+def publish_snapshot():
+    """sampler 行程：把 /data 的內容寫成快照檔給 web worker 讀取"""
+    if SERVER_ROLE == "sampler":
+        try:
+            shared_state.write_atomic(LIVE_SNAPSHOT_PATH, recent_samples.payload())
+        except OSError as e:
+            logger.error(f"Failed to write live snapshot: {e}")
+
+def publish_status(flags):
+    """把蜂鳴器與警報旗標同步到 /data 的快取，有變化時推送給 /stream"""
+    changed = recent_samples.set_status(
+        buzzer="ON" if any(flags.values()) else "OFF",
+        tem=flags.get("temperature", False),
+        hum=flags.get("humidity", False),
+        lig=flags.get("light", False),
+        temperature_anomaly=flags.get("temperature_anomaly", False),
+        humidity_anomaly=flags.get("humidity_anomaly", False),
+        light_anomaly=flags.get("light_anomaly", False)
+    )
+    if changed:
+        events.publish("alarm", recent_samples.status())
+        publish_snapshot()
+
+# 每次警報觸發／解除寫一筆事件
+alarm_events = alarm_log.AlarmLog(DB_PATH)
+
+def on_alarm_change(flags, rule, ts):
+    """警報引擎狀態改變時呼叫（在警報執行緒中執行）"""
+    if rule is not None:
+        ALARM_TRANSITIONS.labels(rule.channel, "raised" if rule.active else "cleared").inc()
+        alarm_events.record(rule, ts, alert_thresholds.get(rule.channel) if rule.uses_threshold else None)
+        if rule.active:
+            logger.warning(f"⚠️ 警報觸發! {rule.channel} ({rule.reason}) 當前值: {rule.peak}")
+        else:
+            logger.info(f"✅ 警報解除: {rule.channel}")
+    actuator_worker.set_alarm(any(flags.values()))
+    publish_status(flags)
+
+# 警報規則在獨立執行緒評估：門檻遲滯、最短持續時間與變化率
+alarm_engine = AlarmEngine(
+    [
+        AlarmRule(
+            channel,
+            rule["direction"],
+            hysteresis=rule["hysteresis"],
+            min_duration=ALARM_MIN_DURATION / speedup,
+            clear_duration=ALARM_CLEAR_DURATION / speedup,
+            # 模擬加速時數值變化也同比例加快
+            max_rate=rule["max_rate"] * speedup if rule["max_rate"] is not None else None,
+            rate_window=ALARM_RATE_WINDOW / speedup
+        )
+        for channel, rule in ALARM_RULES.items()
+    ] + [
+        # 異常偵測的 spike / stuck 也走相同的警報流程
+        AnomalyRule(channel, clear_duration=ANOMALY_CLEAR_DURATION / speedup)
+        for channel in (ANOMALY_CHANNELS if ANOMALY_ALARMS else ())
+    ],
+    alert_thresholds,
+    on_change=on_alarm_change,
+    max_queue=ALARM_QUEUE_SIZE
+)
 
 def stop_buzzer_immediate():
-    """立即停止蜂鳴器並重置狀態（確保完全靜音）"""
-    global buzzer_active, buzzer_timer
-    try:
-        if buzzer_timer and buzzer_timer.is_alive():
-            buzzer_timer.cancel()
-        buzzer_pwm.ChangeDutyCycle(0)   # 停止輸出聲音
-        buzzer_pwm.stop()               # 停止 PWM
-        GPIO.output(BUZZER_PIN, GPIO.HIGH)  # 轉為高電平（靜音）
-        buzzer_active = False
-        logger.info("🔇 蜂鳴器已停止")
-    except Exception as e:
-        logger.error(f"Stop buzzer failed: {e}")
-        
+    """立即停止蜂鳴器並重置警報狀態（之後依新的門檻重新判斷）"""
+    if actuator_worker is not None:
+        actuator_worker.set_alarm(False)
+    alarm_engine.reset()
+    logger.info("🔇 蜂鳴器已停止")
+
 def collect_data():
-    global buzzer_active
-    global alert_triggered_tem
-    global alert_triggered_hum
-    global alert_triggered_lig
     while True:
-        result = instance.read()
+        # 由採樣排程取得合併好的樣本（DHT11 與光感各自依週期讀取，失敗時自行退避）
+        now, sample = sampler.get()
         try:
-            if result.is_valid():  # 模擬測試
-                temperature = result.temperature
-                humidity = result.humidity
-                print("目前溫度: %d 度C" % result.temperature)
-                print("目前濕度: %d %%" % result.humidity)
-                light = round(light_detect.ambient_light, 1)
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                logging.info(f"Collected data: Temperature={temperature}°C, Humidity={humidity}%, Light={light}%")
-
-                # 判斷是否超出警報閾值
-                alert_triggered_tem = temperature > alert_thresholds["temperature"]
-                alert_triggered_hum = humidity > alert_thresholds["humidity"]
-                alert_triggered_lig = light < alert_thresholds["light"]
-
-                if alert_triggered_tem or alert_triggered_hum or alert_triggered_lig:
-                    if not buzzer_active:
-                        buzzer_active = True
-                        logger.warning(f"⚠️ 警報觸發! 當前值: T={temperature}, H={humidity}, L={light}")
-                        GPIO.output(BUZZER_PIN, GPIO.LOW)  # 低電平啟動蜂鳴器
-                        buzzer_pwm.start(50)
-                else:
-                    if buzzer_active:
-                        stop_buzzer_immediate()
-
-                # 寫入資料庫
-                with app.app_context():
-                    with data_lock:
-                        new_data = SensorData(
-                            timestamp=timestamp,
-                            temperature=temperature,
-                            humidity=humidity,
-                            light=light
-                        )
-                        db.session.add(new_data)
-                        db.session.commit()
-
-                time.sleep(2)
+            temperature, humidity = sample["dht"]
+            light = round(sample["light"], 1)
+            ts = int(now)
+            timestamp = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')
+
+            values = {"temperature": temperature, "humidity": humidity, "light": light}
+            sample_logger.debug(
+                "Collected data: Temperature=%s°C, Humidity=%s%%, Light=%s", temperature, humidity, light,
+                extra={"fields": values}
+            )
+            anomalies = detector.update(values)
+            if anomalies:
+                logger.debug("Anomalies detected: %s", anomalies)
+
+            # 交給警報引擎判斷，不在這裡等待
+            alarm_engine.submit(now, values, anomalies)
+
+            recent_samples.push(timestamp, temperature, humidity, light, anomalies)
+            events.publish("sample", {
+                "timestamp": timestamp,
+                "temperature": temperature,
+                "humidity": humidity,
+                "light": light,
+                "anomalies": anomalies or None
+            }, event_id=recent_samples.seq)
+            publish_snapshot()
+
+            # 放入寫入緩衝，由背景執行緒批次寫入資料庫
+            write_buffer.put((timestamp, temperature, humidity, light, ts))
         except Exception as e:
-            logger.error(f"Error reading sensor or saving to database: {e}")
+            logger.error("Error processing sample or saving to database: %s", e)
+
+
+def live_tagged():
+    """/data 的最近樣本 (bytes, ETag, 最後修改時間)：web 行程讀快照檔，其他模式直接用記憶體中的環狀緩衝"""
+    if SERVER_ROLE == "web":
+        return live_snapshot.tagged()
+    return recent_samples.tagged()
+
+def ingest_stats_dict():
+    return dict(
+        write_buffer=write_buffer.stats(),
+        sensors=sampler.stats() if sampler else None,
+        alarms=alarm_engine.stats(),
+        anomalies=detector.stats() if detector else None,
+        edge_push=edge_pusher.stats() if edge_pusher else None
+    )
+
+def publish_stats():
+    """sampler 行程：定期把統計寫成檔案，web worker 的 /ingest_stats 讀取"""
+    while True:
+        try:
+            shared_state.write_json(STATS_PATH, dict(ingest_stats_dict(), updated=time.time()))
+            metrics.dump(RUNTIME_DIR)
+        except OSError as e:
+            logger.error(f"Failed to write stats: {e}")
+        time.sleep(STATS_INTERVAL)
+
+def publish_metrics():
+    """web worker：定期把本行程的指標寫到 RUNTIME_DIR，讓任何一個 worker 的 /metrics 都能加總"""
+    while True:
+        try:
+            metrics.dump(RUNTIME_DIR)
+        except OSError as e:
+            logger.error(f"Failed to write metrics: {e}")
+        time.sleep(STATS_INTERVAL)
+
+# 讀取 /metrics 時才取值的量表
+metrics.gauge("write_buffer_queue_depth", "Readings waiting in the write buffer", write_buffer.queued)
+metrics.gauge("sample_queue_depth", "Merged samples waiting for collect_data()",
+              lambda: sampler.samples.qsize() if sampler else None)
+metrics.gauge("alarm_queue_depth", "Samples waiting for the alarm engine",
+              lambda: alarm_engine.queued() if sampler else None)
+metrics.gauge("sensor_consecutive_failures", "Current run of failed reads per sensor",
+              lambda: {(name,): s["failures"] for name, s in sampler.stats().items()} if sampler else None,
+              ["sensor"])
+metrics.gauge("sse_clients", "Open /stream connections", lambda: events.client_count)
+metrics.gauge("stream_responses_open", "Open streaming responses (/stream and report streams)",
+              lambda: stream_limit.active)
+metrics.gauge("report_jobs_inflight", "AI reports being generated", lambda: report_jobs.stats()["inflight"])
+
+def on_settings_change(name, value):
+    """sampler 行程：web worker 修改了門檻"""
+    if name == "thresholds":
+        alert_thresholds.update({k: float(v) for k, v in value.items() if k in alert_thresholds})
+        logger.info(f"✅ Applied thresholds from settings: {alert_thresholds}")
+        stop_buzzer_immediate()
 
 
 # Start background thread
 # Web routes
-@app.route('/')
+def history_page(before_id=None, after_id=None, limit=HISTORY_PAGE_SIZE):
+    """以 id 做 keyset 分頁，結果一律由新到舊；已壓成區塊的舊資料一併合併"""
+    query = SensorData.query.filter(SensorData.device_id == DEVICE_ID)
+    if after_id is not None:
+        # 取比 after_id 新的資料（即時更新用）
+        rows = query.filter(SensorData.id > after_id).order_by(SensorData.id.asc()).limit(limit).all()
+        rows += block_rows(after_id, limit, rows, descending=False)
+        return sorted(rows, key=lambda d: d.id)[:limit][::-1]
+    if before_id is not None:
+        query = query.filter(SensorData.id < before_id)
+    rows = query.order_by(SensorData.id.desc()).limit(limit).all()
+    rows += block_rows(before_id, limit, rows, descending=True)
+    return sorted(rows, key=lambda d: d.id, reverse=True)[:limit]
+
+
+def block_rows(bound, limit, rows, descending):
+    """從壓縮區塊補上 id 在 bound 之外的資料；rows 已滿一頁時只讀 id 範圍會影響結果的區塊"""
+    import blockstore
+    if bound is None:
+        bound = sys.maxsize if descending else -1
+    kth = rows[-1].id if len(rows) == limit else None
+    with storage.read_connection(DB_PATH) as conn:
+        return blockstore.rows_by_id(conn, DEVICE_ID, bound, limit, descending, kth)
+
+
+def data_validators():
+    """(ETag, Last-Modified)：以資料庫最新樣本的 id 為準，新樣本寫入後才會改變"""
+    with storage.read_connection(DB_PATH) as conn:
+        latest, ts = http_cache.latest_sample(conn)
+    return f"{DEVICE_ID}-{latest:x}", ts
+
+
+@bp.route('/')
 def index():
     try:
-        data = SensorData.query.order_by(SensorData.id.desc()).all()
-        logger.info(f"Loaded {len(data)} records for web display")
-        return render_template('index.html', data=data)
+        etag, modified = data_validators()
+        # 部署新版的頁面時也要讓瀏覽器重新取得
+        etag = f"{etag}-{os.stat(INDEX_TEMPLATE).st_mtime_ns:x}"
+        cached = http_cache.not_modified(etag, modified)
+        if cached is not None:
+            return cached
+        data = history_page()
+        next_before = data[-1].id if len(data) == HISTORY_PAGE_SIZE else None
+        logger.debug("Loaded %d records for web display", len(data))
+        html = render_template(
+            'index.html', data=data, next_before=next_before, data_window=DATA_WINDOW, page_size=HISTORY_PAGE_SIZE
+        )
+        return http_cache.tag(Response(html, mimetype='text/html'), etag, modified)
     except Exception as e:
         logger.error(f"Failed to load web data: {e}")
         return "Error: Unable to load data, check logs", 500
 
+# API for history table (infinite scroll / 即時新增)
+@bp.route('/history')
+def get_history():
+    try:
+        before_id = request.args.get('before', type=int)
+        after_id = request.args.get('after', type=int)
+        limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+        # 即時更新的 ?after= 輪詢在沒有新資料時回 304
+        etag, modified = data_validators()
+        cached = http_cache.not_modified(etag, modified)
+        if cached is not None:
+            return cached
+        data = history_page(before_id=before_id, after_id=after_id, limit=limit)
+        rows = [
+            {
+                "id": d.id,
+                "timestamp": d.timestamp,
+                "temperature": d.temperature,
+                "humidity": d.humidity,
+                "light": d.light
+            }
+            for d in data
+        ]
+        # 往舊資料捲動時，回傳下一頁的游標；沒有更多資料則為 None
+        next_before = None
+        if after_id is None and len(data) == limit:
+            next_before = data[-1].id
+        return http_cache.tag(jsonify(rows=rows, next_before=next_before), etag, modified)
+    except Exception as e:
+        logger.error(f"History retrieval failed: {e}")
+        return jsonify(error=str(e)), 500
+
 # API for real-time data
-@app.route('/data')
+@bp.route('/data')
 def get_data():
-    global buzzer_active
-    global alert_triggered_tem
-    global alert_triggered_hum
-    global alert_triggered_lig
     try:
-        data = SensorData.query.order_by(SensorData.id.desc()).limit(50).all()
-        labels = [d.timestamp for d in data]
-        temps = [d.temperature for d in data]
-        hums = [d.humidity for d in data]
-        lights = [d.light for d in data]
+        start = rollup.parse_time_arg(request.args.get('from'))
+        end = rollup.parse_time_arg(request.args.get('to'))
+    except ValueError as e:
+        return jsonify(error=f"Invalid time range: {e}"), 400
+    try:
+        if start is None and end is None:
+            # 預先編碼好的 JSON，只有新樣本進來時才會重建；輪詢的客戶端在沒有新樣本時收到 304
+            payload, etag, modified = live_tagged()
+            cached = http_cache.not_modified(etag, modified)
+            if cached is not None:
+                return cached
+            return http_cache.tag(Response(payload, mimetype='application/json'), etag, modified)
+
+        # 指定時間區間：走 (device_id, ts) 索引並合併壓縮區塊；收集端可用 device= 查詢其他裝置
+        import blockstore
+        with storage.read_connection(DB_PATH) as conn:
+            latest, modified = http_cache.latest_sample(conn)
+            etag = f"range-{latest:x}"
+            cached = http_cache.not_modified(etag, modified)
+            if cached is not None:
+                return cached
+            cols = blockstore.read_range(
+                conn, request.args.get('device', DEVICE_ID),
+                start if start is not None else 0, end if end is not None else sys.maxsize >> 1,
+                DATA_RANGE_MAX_ROWS + 1
+            )
+        truncated = len(cols["ts"]) > DATA_RANGE_MAX_ROWS
+        cols = {name: values[:DATA_RANGE_MAX_ROWS] for name, values in cols.items()}
+        data = dict(
+            ts=cols["ts"].tolist(),
+            labels=blockstore.labels(cols["ts"]),
+            temps=blockstore.nullable(cols["temperature"]),
+            hums=blockstore.nullable(cols["humidity"]),
+            lights=blockstore.nullable(cols["light"]),
+            truncated=truncated
+        )
+        if request.args.get('anomalies') == '1':
+            # 以批次模式重新偵測這段區間（區間開頭的 ANOMALY_WARMUP 筆為暖機，不會標記）
+            import anomaly
+            codes, _ = anomaly.scan(
+                {"temperature": data["temps"], "humidity": data["hums"], "light": data["lights"]},
+                ANOMALY_CHANNELS, ANOMALY_ALPHA, ANOMALY_Z_THRESHOLD, ANOMALY_WARMUP
+            )
+            data["anomalies"] = [anomaly.flags_at(codes, i) for i in range(len(data["ts"]))]
+        return http_cache.tag(jsonify(**data), etag, modified)
+    except Exception as e:
+        logger.error(f"API data retrieval failed: {e}")
+        return jsonify(error=str(e)), 500
+
+# 長時間區間的圖表資料：自動選擇合適解析度的彙總表
+@bp.route('/series')
+def get_series():
+    try:
+        end = rollup.parse_time_arg(request.args.get('to'))
+        start = rollup.parse_time_arg(request.args.get('from'))
+    except ValueError as e:
+        return jsonify(error=f"Invalid time range: {e}"), 400
+    points = request.args.get('points', SERIES_DEFAULT_POINTS, type=int)
+    points = max(1, min(points, DATA_RANGE_MAX_ROWS))
+    if end is None:
+        end = int(time.time())
+    if start is None:
+        start = end - 86400
+    try:
+        with storage.read_connection(DB_PATH) as conn:
+            # 彙總表只有本機資料，原始資料也只取本機；其他裝置見 /fleet/series
+            series = rollup.query_series(
+                conn, start, end, points, DEVICE_ID,
+                resolutions=ROLLUP_RESOLUTIONS,
+                raw_limit=DATA_RANGE_MAX_ROWS
+            )
+        return jsonify(series)
+    except Exception as e:
+        logger.error(f"Series retrieval failed: {e}")
+        return jsonify(error=str(e)), 500
+
+# 推送串流 (Server-Sent Events)：連線時先送目前快照，之後只推新樣本與警報變化
+@bp.route('/stream')
+def stream():
+    if SERVER_ROLE == "web":
+        snapshot = format_sse("snapshot", live_snapshot.payload(), event_id=live_snapshot.data().get("seq"))
+    else:
+        snapshot = format_sse("snapshot", recent_samples.payload(), event_id=recent_samples.seq)
+    return sse_response(events.listen(initial=snapshot))
+
+# 寫入緩衝統計（flush 次數與延遲）與各感測器讀取次數
+@bp.route('/ingest_stats')
+def ingest_stats():
+    if SERVER_ROLE == "web":
+        # 採樣行程定期寫出的統計
+        return Response(shared_state.SnapshotReader(STATS_PATH).payload(), mimetype='application/json')
+    return jsonify(ingest_stats_dict())
+
+# 收集端：接收邊緣節點推送的壓縮批次
+@bp.route('/ingest', methods=['POST'])
+def ingest():
+    if not COLLECTOR_MODE:
+        return jsonify(error="Collector mode is disabled"), 404
+    if INGEST_TOKEN and request.headers.get('X-Ingest-Token') != INGEST_TOKEN:
+        return jsonify(error="Bad ingest token"), 403
+    if (request.content_length or 0) > INGEST_MAX_BYTES:
+        return jsonify(error="Payload too large"), 413
+    try:
+        device_id, rows = collector.decode_batch(
+            request.get_data(), request.headers.get('Content-Encoding'), INGEST_MAX_BYTES
+        )
+    except collector.IngestError as e:
+        return jsonify(error=str(e)), 400
+    if device_id == DEVICE_ID:
+        return jsonify(error="Device id collides with the collector's own"), 400
+    try:
+        with storage.write_transaction(DB_PATH) as conn:
+            inserted = collector.ingest(conn, device_id, rows)
+        return jsonify(accepted=inserted, duplicates=len(rows) - inserted)
+    except Exception as e:
+        logger.error(f"Ingest from {device_id} failed: {e}")
+        return jsonify(error=str(e)), 500
+
+# 欄式匯出：/export?from=&to=&device=，以 .npz 串流回傳，記憶體用量與區間長短無關
+@bp.route('/export')
+def export_data():
+    try:
+        end = rollup.parse_time_arg(request.args.get('to'))
+        start = rollup.parse_time_arg(request.args.get('from'))
+    except ValueError as e:
+        return jsonify(error=f"Invalid time range: {e}"), 400
+    if end is None:
+        end = int(time.time())
+    if start is None:
+        start = end - 86400
+    device_id = request.args.get('device', DEVICE_ID)
+    import archive
+
+    def generate():
+        with storage.read_connection(DB_PATH) as conn:
+            yield from archive.export_chunks(conn, device_id, start, end, EXPORT_CHUNK_ROWS)
+
+    return Response(
+        generate(),
+        mimetype='application/octet-stream',
+        headers={'Content-Disposition': f'attachment; filename="sensor_{device_id}_{start}_{end}.npz"'}
+    )
+
+# 匯入 /export 產生的 .npz（請求本體即檔案）；重複匯入不會產生重複資料
+@bp.route('/import', methods=['POST'])
+def import_data():
+    import archive
+    if INGEST_TOKEN and request.headers.get('X-Ingest-Token') != INGEST_TOKEN:
+        return jsonify(error="Bad ingest token"), 403
+    if (request.content_length or 0) > IMPORT_MAX_BYTES:
+        return jsonify(error="Payload too large"), 413
+    try:
+        # 先分段寫到暫存檔，np.load 需要可隨機讀取的檔案
+        with tempfile.TemporaryFile() as f:
+            while True:
+                data = request.stream.read(1 << 16)
+                if not data:
+                    break
+                f.write(data)
+            f.seek(0)
+            # 大量匯入用自己的連線分段 commit，不長時間占住本行程的寫入連線
+            conn = storage.connect(DB_PATH)
+            try:
+                total, inserted = archive.import_file(
+                    conn, f, DEVICE_ID, request.args.get('device'), ROLLUP_RESOLUTIONS
+                )
+            finally:
+                conn.close()
+        return jsonify(rows=total, inserted=inserted)
+    except (archive.ArchiveError, ValueError, OSError) as e:
+        return jsonify(error=f"Invalid archive: {e}"), 400
+    except Exception as e:
+        logger.error(f"Import failed: {e}")
+        return jsonify(error=str(e)), 500
 
-        # 使用實際蜂鳴器狀態，而非重算閾值
-        buzzer_status = "ON" if buzzer_active else "OFF"
+# 已知的裝置（本機與曾推送過資料的邊緣節點）
+@bp.route('/devices')
+def get_devices():
+    try:
+        with storage.read_connection(DB_PATH) as conn:
+            devices = collector.list_devices(conn)
+        return jsonify(local=DEVICE_ID, devices=devices)
+    except Exception as e:
+        logger.error(f"Device list failed: {e}")
+        return jsonify(error=str(e)), 500
 
+# 跨裝置比較：/fleet/series?from=&to=&points=&device=a,b（不指定則為全部裝置）
+@bp.route('/fleet/series')
+def get_fleet_series():
+    try:
+        end = rollup.parse_time_arg(request.args.get('to'))
+        start = rollup.parse_time_arg(request.args.get('from'))
+    except ValueError as e:
+        return jsonify(error=f"Invalid time range: {e}"), 400
+    points = request.args.get('points', SERIES_DEFAULT_POINTS, type=int)
+    points = max(1, min(points, DATA_RANGE_MAX_ROWS))
+    if end is None:
+        end = int(time.time())
+    if start is None:
+        start = end - 86400
+    try:
+        with storage.read_connection(DB_PATH) as conn:
+            devices = [d for d in request.args.get('device', '').split(',') if d]
+            if not devices:
+                devices = [DEVICE_ID] + [d["device_id"] for d in collector.list_devices(conn)]
+            series = collector.fleet_series(conn, start, end, points, devices, resolutions=ROLLUP_RESOLUTIONS)
+        return jsonify(series)
+    except Exception as e:
+        logger.error(f"Fleet series retrieval failed: {e}")
+        return jsonify(error=str(e)), 500
+
+# 警報事件查詢：/alarms?from=&to=&channel=&limit=
+@bp.route('/alarms')
+def get_alarms():
+    try:
+        end = rollup.parse_time_arg(request.args.get('to'))
+        start = rollup.parse_time_arg(request.args.get('from'))
+    except ValueError as e:
+        return jsonify(error=f"Invalid time range: {e}"), 400
+    if end is None:
+        end = int(time.time())
+    if start is None:
+        start = end - 86400
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    try:
+        with storage.read_connection(DB_PATH) as conn:
+            rows = alarm_log.list_events(conn, start, end, request.args.get('channel'), limit)
+        return jsonify(events=rows)
+    except Exception as e:
+        logger.error(f"Alarm query failed: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# 警報事件統計：各通道次數、累計與最長持續秒數、極值
+@bp.route('/alarms/summary')
+def get_alarm_summary():
+    try:
+        end = rollup.parse_time_arg(request.args.get('to'))
+        start = rollup.parse_time_arg(request.args.get('from'))
+    except ValueError as e:
+        return jsonify(error=f"Invalid time range: {e}"), 400
+    now = int(time.time())
+    if end is None:
+        end = now
+    if start is None:
+        start = end - 30 * 86400
+    try:
+        with storage.read_connection(DB_PATH) as conn:
+            summary = alarm_log.summarize_events(conn, start, end, request.args.get('channel'), now=now)
+        return jsonify(start=start, end=end, channels=summary)
+    except Exception as e:
+        logger.error(f"Alarm summary failed: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# 資料庫大小與保留清理統計
+@bp.route('/storage_stats')
+def storage_stats():
+    try:
+        with storage.read_connection(DB_PATH) as conn:
+            rows = retention.row_count(conn)
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            import blockstore
+            blocks = blockstore.stats(conn)
         return jsonify(
-            labels=labels[::-1],
-            temps=temps[::-1],
-            hums=hums[::-1],
-            lights=lights[::-1],
-            buzzer=buzzer_status,
-            tem=alert_triggered_tem,
-            hum=alert_triggered_hum,
-            lig=alert_triggered_lig
+            rows=rows,
+            db_bytes=page_count * page_size,
+            free_bytes=freelist * page_size,
+            journal_mode=journal_mode,
+            blocks=blocks,
+            connections=storage.stats(DB_PATH),
+            retention=retention_worker.stats()
         )
     except Exception as e:
-        logger.error(f"API data retrieval failed: {e}")
+        logger.error(f"Storage stats failed: {e}")
         return jsonify(error=str(e)), 500
 
+# Prometheus 指標；gunicorn 部署時加總 sampler 與所有 web worker
+@bp.route('/metrics')
+def get_metrics():
+    if SERVER_ROLE == "all":
+        merged = metrics.merge([metrics.REGISTRY.snapshot()])
+    else:
+        merged = metrics.collect_dir(RUNTIME_DIR)
+    return Response(metrics.render(merged), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+
+@bp.before_app_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+# JSON 與 HTML 依 Accept-Encoding 壓縮（brotli 有安裝時優先）；同一份內容只壓縮一次
+compressor = http_cache.Compressor(
+    COMPRESS_TYPES,
+    min_bytes=COMPRESS_MIN_BYTES,
+    level=COMPRESS_LEVEL,
+    brotli_quality=BROTLI_QUALITY,
+    cache_size=COMPRESS_CACHE_SIZE
+)
+
+
+@bp.after_app_request
+def compress_response(response):
+    if not COMPRESS_ENABLED:
+        return response
+    return compressor(response)
+
+
+@bp.after_app_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # 以路由樣式（例如 /report/<job_id>）為標籤，避免每個網址各一條時間序列
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.labels(route, request.method).observe(time.perf_counter() - start)
+        REQUESTS.labels(route, request.method, response.status_code).inc()
+    return response
+
+
 # Check database contents
 def check_db():
     try:
-        conn = sqlite3.connect('data.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM sensor_data ORDER BY id DESC LIMIT 10")
-        rows = cursor.fetchall()
+        with storage.read_connection(DB_PATH) as conn:
+            rows = conn.execute("SELECT * FROM sensor_data ORDER BY id DESC LIMIT 10").fetchall()
         logger.info("Last 10 database records:")
         for row in rows:
             logger.info(row)
-        conn.close()
     except Exception as e:
         logger.error(f"Failed to check database contents: {e}")
 
 
-def init_db():
+def load_recent_samples(app):
+    """啟動時先從資料庫載入最近的讀數，避免圖表一開始是空的"""
+    with app.app_context():
+        data = history_page(limit=DATA_WINDOW)
+        for d in reversed(data):
+            # 同時讓異常偵測的平均與變異數暖機
+            anomalies = detector.update({"temperature": d.temperature, "humidity": d.humidity, "light": d.light})
+            recent_samples.push(d.timestamp, d.temperature, d.humidity, d.light, anomalies)
+        logger.info(f"Loaded {len(data)} recent samples into memory")
+
+
+def init_db(app):
     with app.app_context():
         db.create_all()
         logger.info("Database and sensor_data table created successfully")
 
 
-if __name__ == '__main__':
-    logger.info("Starting Flask server")
-    init_db()
-    check_table_schema()  # Verify existing table
+def load_thresholds():
+    """沿用上次設定的門檻（settings 表）"""
+    with storage.read_connection(DB_PATH) as conn:
+        saved = shared_state.load_json_setting(conn, "thresholds")
+    if saved:
+        alert_thresholds.update({k: float(v) for k, v in saved.items() if k in alert_thresholds})
+        logger.info(f"Loaded thresholds: {alert_thresholds}")
+
+
+def start_web():
+    """web worker：只讀共享狀態，不碰 GPIO；資料表由 sampler 行程（或 gunicorn 主行程）建立"""
+    shared_state.SnapshotRelay(live_snapshot, events, interval=SNAPSHOT_POLL_INTERVAL).start()
+    os.makedirs(RUNTIME_DIR, exist_ok=True)
+    threading.Thread(target=publish_metrics, name="metrics", daemon=True).start()
+    return True
+
+
+def start_services(app, role=SERVER_ROLE):
+    """初始化資料庫並啟動背景工作（寫入緩衝、保留清理、採樣）
+
+    role 為 'all' 時單一行程包辦採樣與網頁；'sampler' 只負責採樣，並把最近樣本與統計
+    寫到 RUNTIME_DIR 給 'web' 行程（gunicorn worker，見 wsgi.py）讀取。
+    """
+    global SERVER_ROLE
+    SERVER_ROLE = role
+    if role == "web":
+        return start_web()
+    # 先遷移：空檔案要由 migrate 在建表前設定 auto_vacuum，create_all 之後才只補缺少的表
+    if not check_table_schema():  # Verify / migrate existing table
+        return False
+    init_db(app)
+    load_thresholds()
+    try:
+        init_sampling()
+    except Exception as e:
+        logger.error(f"Failed to initialize sensors: {e}")
+        return False
+    load_recent_samples(app)
+    write_buffer.start()
+    atexit.register(write_buffer.close)  # 關閉時寫入剩餘資料
+    retention_worker.start()
+    if edge_pusher:
+        edge_pusher.start()
+        atexit.register(edge_pusher.close)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    actuator_worker.start()
+    alarm_engine.start()
+    sampler.start()
     threading.Thread(target=collect_data, daemon=True).start()
+    if role == "sampler":
+        os.makedirs(RUNTIME_DIR, exist_ok=True)
+        publish_snapshot()
+        threading.Thread(target=publish_stats, name="stats", daemon=True).start()
+    shared_state.SettingsWatcher(DB_PATH, ["thresholds"], on_settings_change, interval=SETTINGS_POLL_INTERVAL).start()
     check_db()  # Check database at startup
-    app.run(host='192.168.0.115', port=5000, debug=True)
-    #app.run(host='192.168.0.229', port=5000, debug=True)
-
-
-index.html
-<!DOCTYPE html>
-<html>
-<head>
-    <title>即時環境監測平台</title>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-    <style>
-        body { font-family: Arial, sans-serif; margin: 20px; }
-        h1, h2 { color: #2C3E50; }
-        canvas { max-width: 100%; height: auto !important; }
-        table { border-collapse: collapse; width: 100%; margin-top: 20px; }
-        th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
-        th { background-color: #f2f2f2; }
-        /* 背景遮罩 */
-        .modal-overlay {
-          display: none;
-          position: fixed;
-          top: 0;
-          left: 0;
-          width: 100%;
-          height: 100%;
-          background-color: rgba(0,0,0,0.5);
-          justify-content: center;
-          align-items: center;
-          z-index: 1000;
-        }
-
-        /* 彈出視窗 */
-        .modal {
-          background-color: #fff;
-          border-radius: 10px;
-          padding: 20px;
-          width: 600px;               /* ✅ 寬度變寬 */
-          max-height: 80vh;           /* ✅ 限制最高不超過視窗高度 */
-          box-shadow: 0 0 15px rgba(0,0,0,0.3);
-          text-align: center;
-          font-family: "Noto Sans TC", sans-serif;
-          display: flex;
-          flex-direction: column;
-        }
-
-        .modal h2 {
-          margin-top: 0;
-          color: #333;
-        }
-
-        /* 可滾動內容區域 */
-        .modal-content-scroll {
-          overflow-y: auto;           /* ✅ 加上滾動條 */
-          text-align: left;
-          color: #555;
-          margin-top: 10px;
-          padding-right: 10px;
-          flex-grow: 1;               /* ✅ 撐開可滾動區域 */
-          white-space: pre-wrap;
-        }
-
-        .close-btn {
-          margin-top: 15px;
-          padding: 10px 25px;
-          background-color: #007bff;
-          border: none;
-          color: white;
-          border-radius: 5px;
-          cursor: pointer;
-          align-self: center;         /* ✅ 置中 */
-        }
-
-        .close-btn:hover {
-          background-color: #0056b3;
-        }
-
-        /* 按鈕 */
-        #fetchBtn {
-          margin: 40px;
-          padding: 10px 20px;
-          font-size: 16px;
-          border-radius: 8px;
-          border: none;
-          background-color: #007bff;
-          color: white;
-          cursor: pointer;
-        }
-        #fetchBtn:hover {
-          background-color: #0056b3;
-        }
-    </style>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.0/css/all.min.css">
-</head>
-<body>
-    <h1>即時環境監測</h1>
-    <div id="buzzer-alert-lig" style="
-        display:none;
-        background-color: red;
-        color: white;
-        font-size: 24px;
-        text-align: center;
-        padding: 10px;
-        border-radius: 8px;
-        animation: blink 0.2s infinite;
-    ">
-        ⚠️ 光線過低！蜂鳴器已觸發！
-    </div>
-    <div id="buzzer-alert-hum" style="
-        display:none;
-        background-color: red;
-        color: white;
-        font-size: 24px;
-        text-align: center;
-        padding: 10px;
-        border-radius: 8px;
-        animation: blink 0.2s infinite;
-    ">
-        ⚠️ 濕度過高！蜂鳴器已觸發！
-    </div>
-    <div id="buzzer-alert-tem" style="
-        display:none;
-        background-color: red;
-        color: white;
-        font-size: 24px;
-        text-align: center;
-        padding: 10px;
-        border-radius: 8px;
-        animation: blink 0.2s infinite;
-    ">
-        ⚠️ 氣溫過高！蜂鳴器已觸發！
-    </div>
-     <div style="margin-bottom: 20px;">
-        <h2><i class="fa-solid fa-bell"></i> 警報設定</h2>
-        <i class="fa-solid fa-temperature-high" style="color:red;"></i> 溫度警報: 
-        <input type="number" id="temp-th" value="35" step="0.1" style="width:80px;"> °C　
-        <i class="fa-solid fa-droplet" style="color:blue;"></i> 濕度警報: 
-        <input type="number" id="humi-th" value="80" step="0.1" style="width:80px;"> %　
-        <i class="fa-solid fa-sun" style="color:orange;"></i> 光線警報: 
-        <input type="number" id="light-th" value="30" step="0.1" style="width:80px;"> lux　
-        <button onclick="updateThresholds()">
-            <i class="fa-solid fa-rotate"></i> 更新設定
-        </button>
-        <button onclick="createReport()">
-            <i class="fa-solid fa-robot"></i> 生成報告
-        </button>
-    </div>
-    <!-- 彈出視窗 -->
-    <div id="modalOverlay" class="modal-overlay">
-      <div class="modal">
-        <h2>AI 分析結果</h2>
-        <div class="modal-content-scroll" id="aiResponse"></div>
-        <button class="close-btn" id="closeBtn">關閉</button>
-      </div>
-    </div>
-
-    <style>
-    @keyframes blink {
-        0% { opacity: 1; }
-        50% { opacity: 0.2; }
-        100% { opacity: 1; }
+    return True
+
+
+def create_app(role=None, start=True):
+    """建立 Flask app；start=True 時依 role 啟動背景工作（感測器與 GPIO 只在 all / sampler 初始化）
+
+    匯入本模組不會碰硬體、資料庫或 OpenAI，測試與 gunicorn worker fork 都很快。
+    """
+    # index.html 與程式放在同一層目錄；static/vendor 為本機提供的 Chart.js 與 Font Awesome（不依賴 CDN）
+    app = Flask(__name__, template_folder=BASE_DIR)
+    # vendor 目錄名稱含版本號，升級時網址會變，可以讓瀏覽器長期快取
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = STATIC_MAX_AGE
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{DB_PATH}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # ORM 的連線也套用 storage 的 pragma；SQLAlchemy 自己的連線池負責重複使用
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "creator": lambda: storage.connect(DB_PATH, check_same_thread=False),
+        "pool_size": SQLITE_READ_POOL_SIZE,
     }
-    </style>
-    <style>
-        th, td {
-            border: 1px solid #ddd;
-            padding: 8px;
-            text-align: center;
-        }
-        th {
-            background-color: #f2f2f2;
-            position: sticky;
-            top: 0;
-            z-index: 2;
-        }
-        #history-table tbody tr:nth-child(even) {
-            background-color: #fafafa;
-        }
-        #history-table tbody tr:hover {
-            background-color: #e8f4ff;
-        }
-    </style>
-
-
-    <canvas id="chart" width="800" height="400"></canvas>
-    
-    <h2>歷史數據 (即時更新)</h2>
-    <div style="max-height: 300px; overflow-y: auto; border: 1px solid #ccc; border-radius: 8px;">
-        <table id="history-table" border="1" style="width:100%; border-collapse: collapse;">
-            <thead>
-                <tr>
-                    <th>時間</th>
-                    <th>溫度 (°C)</th>
-                    <th>濕度 (%)</th>
-                    <th>光度</th>
-                </tr>
-            </thead>
-            <tbody>
-                {% for d in data %}
-                <tr>
-                    <td>{{ d.timestamp }}</td>
-                    <td>{{ d.temperature | round(1) }}</td>
-                    <td>{{ d.humidity | round(1) }}</td>
-                    <td>{{ d.light | round(1) }}</td>
-                </tr>
-                {% endfor %}
-            </tbody>
-        </table>
-    </div>
-
-
-    <script>
-        // 用於儲存 Chart 實例，避免重複創建
-        let myChart; 
-
-        // 1. 初始圖表設置函數
-        function initChart(data) {
-            const ctx = document.getElementById('chart').getContext('2d');
-            myChart = new Chart(ctx, {
-                type: 'line',
-                data: {
-                    labels: data.labels,
-                    datasets: [
-                        { 
-                            label: '溫度 (°C)', 
-                            data: data.temps, 
-                            borderColor: 'red',
-                            backgroundColor: 'rgba(255, 99, 132, 0.2)',
-                            fill: false,
-                            tension: 0.1
-                        },
-                        { 
-                            label: '濕度 (%)', 
-                            data: data.hums, 
-                            borderColor: 'blue',
-                            backgroundColor: 'rgba(54, 162, 235, 0.2)',
-                            fill: false,
-                            tension: 0.1
-                        },
-                        { 
-                            label: 'Light度', 
-                            data: data.lights, 
-                            borderColor: 'yellow',
-                            backgroundColor: 'rgba(54, 162, 235, 0.2)',
-                            fill: false,
-                            tension: 0.1
-                        },
-                    ]
-                },
-                options: { 
-                    responsive: true,
-                    scales: {
-                        y: {
-                            beginAtZero: false
-                        }
-                    }
-                }
-            });
-        }
-
-        // 2. 圖表更新函數 (僅更新數據，不重新創建)
-        function updateChartData(data) {
-            if (myChart) {
-                // 更新數據
-                myChart.data.labels = data.labels;
-                myChart.data.datasets[0].data = data.temps; // 溫度
-                myChart.data.datasets[1].data = data.hums; // 濕度
-                myChart.data.datasets[2].data = data.lights; // 濕度
-                // 平滑更新圖表
-                myChart.update(); 
-            } else {
-                // 第一次載入時初始化圖表
-                initChart(data); 
-            }
-        }
-
-        // 3. 表格更新函數 (動態重繪歷史表格)
-        function updateTable(data) {
-            const tbody = document.querySelector('#history-table tbody');
-            if (!tbody) return; 
-
-            // 清空舊的行
-            tbody.innerHTML = ''; 
-
-            // 假設 /data 返回的數據是從舊到新 (labels, temps, hums)
-            // 我們反向遍歷來讓最新的數據顯示在表格頂部
-            for (let i = data.labels.length - 1; i >= 0; i--) {
-                const row = tbody.insertRow();
-                // 時間
-                row.insertCell().textContent = data.labels[i]; 
-                // 溫度 (保留一位小數)
-                row.insertCell().textContent = parseFloat(data.temps[i]).toFixed(1); 
-                // 濕度 (保留一位小數)
-                row.insertCell().textContent = parseFloat(data.hums[i]).toFixed(1);
-                row.insertCell().textContent = parseFloat(data.lights[i]).toFixed(1);
-            }
-        }
-
-        // 4. 主要獲取和更新函數：一次調用，更新圖表和表格
-        function fetchDataAndUpdate() {
-            fetch('/data')
-                .then(response => {
-                    if (!response.ok) {
-                        throw new Error(`HTTP 錯誤! 狀態碼: ${response.status}`);
-                    }
-                    return response.json();
-                })
-                .then(data => {
-                    updateChartData(data);
-                    updateTable(data);
-
-                    // ⚠️ 蜂鳴器警示互動
-                    const alertBox_lig = document.getElementById('buzzer-alert-lig');
-                    if (data.buzzer === "ON" && data.lig == true) {
-                        alertBox_lig.style.display = 'block';
-                    } else {
-                        alertBox_lig.style.display = 'none';
-                    }
-                    // ⚠️ 蜂鳴器警示互動
-                    const alertBox_hum = document.getElementById('buzzer-alert-hum');
-                    if (data.buzzer === "ON" && data.hum == true) {
-                        alertBox_hum.style.display = 'block';
-                    } else {
-                        alertBox_hum.style.display = 'none';
-                    }
-                    // ⚠️ 蜂鳴器警示互動
-                    const alertBox_tem = document.getElementById('buzzer-alert-tem');
-                    if (data.buzzer === "ON" && data.tem == true) {
-                        alertBox_tem.style.display = 'block';
-                    } else {
-                        alertBox_tem.style.display = 'none';
-                    }
-                })
-                .catch(error => {
-                    console.error('數據獲取失敗:', error);
-                });
-        }
-
-        function updateThresholds() {
-            const temperature = parseFloat(document.getElementById('temp-th').value);
-            const humidity = parseFloat(document.getElementById('humi-th').value);
-            const light = parseFloat(document.getElementById('light-th').value);
-
-            fetch('/set_thresholds', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ temperature, humidity, light })
-            })
-            .then(res => res.json())
-            .then(data => {
-                if (data.success) {
-                    alert(`✅已更新警報設定：
-        溫度 > ${data.thresholds.temperature} °C
-        濕度 > ${data.thresholds.humidity} %
-        光線 < ${data.thresholds.light} lux`);
-                } else {
-                    alert('❌ 更新失敗: ' + data.error);
-                }
-            })
-            .catch(err => {
-                alert('伺服器錯誤: ' + err);
-            });
-        }
-
-        function createReport() {
-            fetch('/create_report', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' }
-            })
-            .then(res => res.json())
-            .then(data => {
-                if (data.success) {
-                    // 顯示 AI 回覆內容
-                    document.getElementById("aiResponse").textContent = data.message;
-
-                    // 顯示彈窗
-                    document.getElementById("modalOverlay").style.display = "flex";
-
-                } else {
-                    alert('❌ 更新失敗: ' + data.error);
-                }
-            })
-            .catch(err => {
-                alert('伺服器錯誤: ' + err);
-            });
-        }
-
-        document.getElementById("closeBtn").addEventListener("click", () => {
-            document.getElementById("modalOverlay").style.display = "none";
-        });
-
-        // 程式啟動點
-        // 頁面載入時先執行一次
-        fetchDataAndUpdate();             
-        
-        // 設定定時器，每 2 秒自動更新所有內容 (圖表與表格)
-        setInterval(fetchDataAndUpdate, 2000); 
-        
-    </script>
-</body>
-</html>
+    db.init_app(app)
+    app.register_blueprint(bp)
+    if start and not start_services(app, role or SERVER_ROLE):
+        raise RuntimeError("Failed to start services")
+    return app
 
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="環境監測服務；正式環境請用 gunicorn -c gunicorn.conf.py wsgi:app")
+    parser.add_argument('--role', choices=['all', 'sampler'], default='all' if SERVER_ROLE == 'web' else SERVER_ROLE)
+    args = parser.parse_args()
+    try:
+        app = create_app(args.role)
+    except RuntimeError as e:
+        logger.error(e)
+        sys.exit(1)
+    if args.role == "sampler":
+        logger.info("Sampler process running (no web server)")
+        signal.pause()
+    else:
+        # 開發用的單一行程模式；關閉 reloader 以免 GPIO 被初始化兩次
+        logger.info("Starting Flask server")
+        app.run(host=WEB_HOST, port=WEB_PORT, debug=WEB_DEBUG, use_reloader=False, threaded=True)
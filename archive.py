@@ -0,0 +1,210 @@
+"""感測資料的欄式匯出／匯入（分段的 NumPy .npz）
+
+    python archive.py export --from 2024-01-01 --to 2024-04-01 -o q1.npz
+    python archive.py import q1.npz
+
+每 chunk_rows 筆寫成一組 ts_00000 / temperature_00000 / ... 陣列，
+匯出與匯入都只在記憶體中保留一段資料。pandas 分析可用 load()：
+
+    import archive, pandas as pd
+    df = pd.DataFrame(archive.load('q1.npz')[0])
+"""
+import argparse
+import json
+import time
+import zipfile
+from datetime import datetime
+
+import numpy as np
+
+import blockstore
+import rollup
+import storage
+
+VERSION = 1
+
+# 欄位與儲存型別；DHT11 是整數讀值，float32 足夠
+COLUMNS = (
+    ("source_id", np.int64),
+    ("ts", np.int64),
+    ("temperature", np.float32),
+    ("humidity", np.float32),
+    ("light", np.float32),
+)
+
+class ArchiveError(ValueError):
+    pass
+
+
+class _StreamWriter:
+    """zipfile 的輸出目標：只累積寫入的 bytes，由 export_chunks() 取走"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def _write_array(zf, name, array):
+    with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+def export_chunks(conn, device_id, start, end, chunk_rows=65536, compresslevel=1):
+    """逐段產生 .npz 的內容（bytes），適合直接當 HTTP 串流回應或寫入檔案"""
+    out = _StreamWriter()
+    zf = zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+    total = 0
+    chunk = 0
+    # 原始資料與壓縮區塊合併後依時間排序，每段 chunk_rows 筆
+    for cols in blockstore.iter_range(conn, device_id, start, end, chunk_rows):
+        cols["source_id"] = cols["id"]
+        for name, dtype in COLUMNS:
+            _write_array(zf, f"{name}_{chunk:05d}", cols[name].astype(dtype))
+        total += len(cols["ts"])
+        chunk += 1
+        yield out.take()
+
+    meta = {
+        "version": VERSION,
+        "device_id": device_id,
+        "from": start,
+        "to": end,
+        "rows": total,
+        "chunks": chunk,
+        "columns": [name for name, _ in COLUMNS],
+    }
+    _write_array(zf, "meta", np.array(json.dumps(meta)))
+    zf.close()
+    yield out.take()
+
+
+def export_file(conn, path, device_id, start, end, chunk_rows=65536):
+    with open(path, 'wb') as f:
+        for data in export_chunks(conn, device_id, start, end, chunk_rows):
+            f.write(data)
+
+
+def _read_meta(npz):
+    if "meta" not in npz.files:
+        raise ArchiveError("not a sensor archive (missing meta)")
+    meta = json.loads(npz["meta"].item())
+    if meta.get("version") != VERSION:
+        raise ArchiveError(f"unsupported archive version: {meta.get('version')}")
+    return meta
+
+
+def iter_chunks(path_or_file):
+    """依序回傳 (meta, {欄位: 陣列})，一次只載入一段"""
+    if not zipfile.is_zipfile(path_or_file):
+        raise ArchiveError("not a .npz archive")
+    if hasattr(path_or_file, 'seek'):
+        path_or_file.seek(0)
+    with np.load(path_or_file, allow_pickle=False) as npz:
+        meta = _read_meta(npz)
+        for chunk in range(meta["chunks"]):
+            yield meta, {name: npz[f"{name}_{chunk:05d}"] for name in meta["columns"]}
+
+
+def load(path_or_file):
+    """整份載入成 {欄位: 陣列}（給 pandas / NumPy 分析用），回傳 (columns, meta)"""
+    parts = {name: [] for name, _ in COLUMNS}
+    meta = None
+    for meta, arrays in iter_chunks(path_or_file):
+        for name, array in arrays.items():
+            parts[name].append(array)
+    columns = {
+        name: np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+        for (name, dtype), arrays in zip(COLUMNS, parts.values())
+    }
+    return columns, meta
+
+
+def import_file(conn, path_or_file, local_device_id, device_id=None, resolutions=rollup.DEFAULT_RESOLUTIONS):
+    """批次匯入；重複匯入同一份檔案不會產生重複資料，回傳 (檔案筆數, 新增筆數)
+
+    匯入本機的資料以 (device_id, ts) 去重並重建該時段的彙總表；原本的 id 沒被占用時沿用，
+    已被其他樣本占用時由 SQLite 另配新 id。其他裝置的資料與收集端一樣以 (device_id, source_id) 去重。
+    """
+    total = 0
+    inserted = 0
+    lo = hi = None
+    for meta, arrays in iter_chunks(path_or_file):
+        target = device_id or meta["device_id"]
+        local = target == local_device_id
+        if local and len(arrays["ts"]):
+            # 已經壓成區塊的資料不再寫回 sensor_data
+            known = blockstore.contains_ts(
+                conn, target, arrays["ts"], int(arrays["ts"].min()), int(arrays["ts"].max())
+            )
+            if known.any():
+                total += int(known.sum())
+                arrays = {name: array[~known] for name, array in arrays.items()}
+        ts = arrays["ts"].tolist()
+        labels = [datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') for t in ts]
+        rows = zip(
+            arrays["source_id"].tolist(), ts, labels,
+            np.round(arrays["temperature"].astype(np.float64), 2).tolist(),
+            np.round(arrays["humidity"].astype(np.float64), 2).tolist(),
+            np.round(arrays["light"].astype(np.float64), 2).tolist(),
+        )
+        if local:
+            # 走 (device_id, ts) 索引；同一時間已有本機樣本就略過
+            sql = ("INSERT INTO sensor_data (id, ts, timestamp, temperature, humidity, light, device_id) "
+                   "SELECT CASE WHEN EXISTS (SELECT 1 FROM sensor_data WHERE id = ?1) THEN NULL ELSE ?1 END, "
+                   "?2, ?3, ?4, ?5, ?6, ?7 "
+                   "WHERE NOT EXISTS (SELECT 1 FROM sensor_data "
+                   "WHERE device_id = ?7 AND ts = ?2 AND source_id IS NULL)")
+        else:
+            sql = ("INSERT OR IGNORE INTO sensor_data (source_id, ts, timestamp, temperature, humidity, light, device_id) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?)")
+        with conn:
+            cur = conn.executemany(sql, (row + (target,) for row in rows))
+            inserted += max(0, cur.rowcount)
+        total += len(ts)
+        if local and ts:
+            lo = min(ts[0], lo) if lo is not None else ts[0]
+            hi = max(ts[-1], hi) if hi is not None else ts[-1]
+    if lo is not None and inserted:
+        with conn:
+            rollup.rebuild(conn, lo, hi, local_device_id, resolutions)
+    return total, inserted
+
+
+if __name__ == '__main__':
+    from config import DB_PATH, DEVICE_ID, ROLLUP_RESOLUTIONS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help='匯出時間區間')
+    exp.add_argument('--from', dest='start', default='0')
+    exp.add_argument('--to', dest='end', default=None)
+    exp.add_argument('--device', default=DEVICE_ID)
+    exp.add_argument('--chunk-rows', type=int, default=65536)
+    exp.add_argument('-o', '--output', required=True)
+    imp = sub.add_parser('import', help='匯入 .npz')
+    imp.add_argument('path')
+    imp.add_argument('--device', default=None, help='覆寫檔案中的裝置代號')
+    args = parser.parse_args()
+
+    conn = storage.connect(args.db)
+    started = time.perf_counter()
+    if args.command == 'export':
+        end = rollup.parse_time_arg(args.end) if args.end else int(time.time())
+        export_file(conn, args.output, args.device, rollup.parse_time_arg(args.start), end, args.chunk_rows)
+        print(f"Exported to {args.output} in {time.perf_counter() - started:.2f}s")
+    else:
+        total, inserted = import_file(conn, args.path, DEVICE_ID, args.device, ROLLUP_RESOLUTIONS)
+        print(f"Imported {inserted}/{total} rows in {time.perf_counter() - started:.2f}s")
+    conn.close()
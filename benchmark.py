@@ -0,0 +1,521 @@
+"""可重現的基準測試：寫入吞吐量，以及不同資料量與並行數下各路由的延遲
+
+    python benchmark.py                                   # 1k / 1M / 10M 筆
+    python benchmark.py --sizes 1000 100000 --concurrency 1 8 --requests 100
+
+種子資料庫快取在 bench_data/，結果存成 bench_results/<時間>-<commit>.json，
+可用來比較不同版本。Web 伺服器以模擬感測器 (ENV_MONITOR_BACKEND=sim) 在子行程執行，
+/create_report 則打到本機的 llm_stub。
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from functools import partial
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED_DIR = os.path.join(BASE_DIR, 'bench_data')
+RESULT_DIR = os.path.join(BASE_DIR, 'bench_results')
+
+SENSOR_DDL = """
+CREATE TABLE IF NOT EXISTS sensor_data (
+    id INTEGER PRIMARY KEY,
+    timestamp VARCHAR(20),
+    ts INTEGER,
+    temperature FLOAT,
+    humidity FLOAT,
+    light FLOAT
+)
+"""
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[int(round(q * (len(sorted_values) - 1)))]
+
+
+def summarize(latencies, wall, errors):
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / wall, 1) if wall else None,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3) if values else None,
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3) if values else None,
+        "max_ms": round(values[-1] * 1000, 3) if values else None,
+    }
+
+
+def synthetic_rows(count, end_ts, seed=0, interval=2):
+    """產生固定種子的模擬資料 (timestamp, ts, temperature, humidity, light)"""
+    rng = random.Random(seed)
+    start = end_ts - count * interval
+    for i in range(count):
+        ts = start + i * interval
+        yield (
+            datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'),
+            ts,
+            float(rng.randint(22, 32)),
+            float(rng.randint(45, 85)),
+            round(rng.uniform(0, 500), 1),
+        )
+
+
+def seed_db(rows):
+    """建立（或沿用快取的）含 rows 筆資料的種子資料庫"""
+    import schema
+
+    os.makedirs(SEED_DIR, exist_ok=True)
+    path = os.path.join(SEED_DIR, f'seed_{rows}.db')
+    if os.path.exists(path):
+        return path
+
+    print(f"Seeding {rows} rows into {path} ...", flush=True)
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # 之後的遷移就不必再做完整 VACUUM
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(SENSOR_DDL)
+    rows_iter = synthetic_rows(rows, int(time.time()))
+    while True:
+        chunk = [r for _, r in zip(range(100000), rows_iter)]
+        if not chunk:
+            break
+        conn.executemany(
+            "INSERT INTO sensor_data (timestamp, ts, temperature, humidity, light) VALUES (?, ?, ?, ?, ?)",
+            chunk
+        )
+        conn.commit()
+    conn.close()
+    schema.migrate(tmp)
+    os.replace(tmp, path)
+    return path
+
+
+_copies = []
+
+
+def working_copy(seed_path, workdir):
+    """每次用新的檔名：前一輪留在 storage 裡的寫入連線與讀取池（以路徑快取）不會鎖住新的副本
+
+    上一份副本直接刪除（仍開著的連線持有已刪除的檔案，不影響新的副本），避免大型種子佔滿磁碟。
+    """
+    for old in _copies:
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(old + suffix)
+            except FileNotFoundError:
+                pass
+    _copies.clear()
+    path = os.path.join(workdir, f"{time.monotonic_ns():x}-{os.path.basename(seed_path)}")
+    shutil.copyfile(seed_path, path)
+    _copies.append(path)
+    return path
+
+
+def bench_ingest(seed_path, workdir, rows):
+    """比較逐筆 commit（舊做法）與 write-behind 批次寫入的每秒筆數"""
+    import rollup
+    from config import ROLLUP_RESOLUTIONS, WRITE_BUFFER_MAX_ROWS
+    from write_buffer import WriteBuffer
+
+    results = {}
+    end_ts = int(time.time()) + rows * 2
+
+    path = working_copy(seed_path, workdir)
+    per_row = min(rows, 2000)
+    conn = sqlite3.connect(path)
+    start = time.perf_counter()
+    for r in synthetic_rows(per_row, end_ts, seed=1):
+        conn.execute("INSERT INTO sensor_data (timestamp, ts, temperature, humidity, light) VALUES (?, ?, ?, ?, ?)", r)
+        conn.commit()
+    wall = time.perf_counter() - start
+    conn.close()
+    results["per_row_commit"] = {"rows": per_row, "seconds": round(wall, 3), "rows_per_s": round(per_row / wall, 1)}
+
+    path = working_copy(seed_path, workdir)
+    buffer = WriteBuffer(
+        path, max_rows=WRITE_BUFFER_MAX_ROWS, max_age=1.0, max_queue=rows + 1,
+        hooks=[partial(rollup.apply, resolutions=ROLLUP_RESOLUTIONS)]
+    )
+    buffer.start()
+    start = time.perf_counter()
+    for timestamp, ts, t, h, l in synthetic_rows(rows, end_ts, seed=2):
+        buffer.put((timestamp, t, h, l, ts))
+    buffer.close(timeout=600)
+    wall = time.perf_counter() - start
+    stats = buffer.stats()
+    results["write_buffer"] = {
+        "rows": stats["rows_written"],
+        "seconds": round(wall, 3),
+        "rows_per_s": round(stats["rows_written"] / wall, 1),
+        "flush": stats,
+    }
+    return results
+
+
+def _sqlite_round(path, profile, readers, seconds):
+    """一個寫入者（每批 30 筆，約每 10 ms 一批）與 readers 個讀取者同時跑 seconds 秒"""
+    import storage
+
+    end_ts = int(time.time()) + 10 ** 6
+    rows = synthetic_rows(10 ** 6, end_ts, seed=3)
+    conn = sqlite3.connect(path)
+    latest = conn.execute("SELECT MAX(ts) FROM sensor_data").fetchone()[0] or 0
+    conn.close()
+    stop = threading.Event()
+    lock = threading.Lock()
+    read_latencies, write_latencies = [], []
+    errors = {"read": 0, "write": 0}
+    pool = storage.ReaderPool(path, size=readers)
+    writer = storage.Writer(path)
+
+    def write_batch(batch):
+        if profile == "tuned":
+            with writer.transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO sensor_data (timestamp, ts, temperature, humidity, light) VALUES (?, ?, ?, ?, ?)", batch
+                )
+            return
+        # 舊做法：每次開新連線、預設設定
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO sensor_data (timestamp, ts, temperature, humidity, light) VALUES (?, ?, ?, ?, ?)", batch
+                )
+        finally:
+            conn.close()
+
+    def write_loop():
+        while not stop.is_set():
+            batch = [r for _, r in zip(range(30), rows)]
+            start = time.perf_counter()
+            try:
+                write_batch(batch)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    write_latencies.append(elapsed)
+            except sqlite3.Error:
+                with lock:
+                    errors["write"] += 1
+            time.sleep(0.01)
+
+    def read_once():
+        # 彙總查詢在 SQLite 內執行（不持有 GIL），量到的是鎖的競爭而不是 Python 建立結果列的成本
+        sql = "SELECT COUNT(*), AVG(temperature), MAX(humidity), MIN(light) FROM sensor_data WHERE ts >= ?"
+        if profile == "tuned":
+            with pool.connection() as conn:
+                return conn.execute(sql, (latest - 6 * 3600,)).fetchall()
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            return conn.execute(sql, (latest - 6 * 3600,)).fetchall()
+        finally:
+            conn.close()
+
+    def read_loop():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                read_once()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    read_latencies.append(elapsed)
+            except sqlite3.Error:
+                with lock:
+                    errors["read"] += 1
+
+    threads = [threading.Thread(target=write_loop)] + [threading.Thread(target=read_loop) for _ in range(readers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    return {
+        "profile": profile,
+        "readers": readers,
+        "reads": summarize(read_latencies, wall, errors["read"]),
+        "writes": summarize(write_latencies, wall, errors["write"]),
+    }
+
+
+def bench_sqlite(seed_path, workdir, reader_counts, seconds):
+    """比較預設 rollback journal + 每次開連線，與 storage.py 的 WAL + 連線池 + 單一寫入連線"""
+    results = []
+    for profile, journal_mode in (("default", "DELETE"), ("tuned", "WAL")):
+        path = working_copy(seed_path, workdir)
+        conn = sqlite3.connect(path)
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        conn.close()
+        for readers in reader_counts:
+            result = _sqlite_round(path, profile, readers, seconds)
+            results.append(result)
+            print(f"  {profile:7s} {readers:3d} readers: {result['reads']['throughput_rps']} reads/s "
+                  f"(p99 {result['reads']['p99_ms']} ms), {result['writes']['throughput_rps']} writes/s "
+                  f"(p99 {result['writes']['p99_ms']} ms)", flush=True)
+    return results
+
+
+def _db_bytes(conn, path):
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path)
+
+
+def bench_blocks(seed_path, workdir):
+    """原始資料壓成區塊前後的檔案大小，以及整段區間讀成 NumPy 陣列的時間"""
+    import blockstore
+    import schema
+    import storage
+    from config import BLOCK_SECONDS
+
+    path = working_copy(seed_path, workdir)
+    schema.migrate(path)  # 之前版本建立的種子資料庫沒有區塊表
+    conn = storage.connect(path)
+    device_id, lo, hi = conn.execute("SELECT device_id, MIN(ts), MAX(ts) FROM sensor_data").fetchone()
+    result = {"raw_bytes": _db_bytes(conn, path)}
+    start = time.perf_counter()
+    rows = len(blockstore.read_range(conn, device_id, lo, hi)["ts"])
+    result["raw_scan_s"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    blockstore.compact(conn, device_id, hi + BLOCK_SECONDS, BLOCK_SECONDS)
+    result["compact_s"] = round(time.perf_counter() - start, 3)
+    result["compact_bytes"] = _db_bytes(conn, path)
+    start = time.perf_counter()
+    assert len(blockstore.read_range(conn, device_id, lo, hi)["ts"]) == rows
+    result["block_scan_s"] = round(time.perf_counter() - start, 3)
+    result["size_ratio"] = round(result["raw_bytes"] / result["compact_bytes"], 1)
+    result["blocks"] = blockstore.stats(conn)
+    conn.close()
+    return result
+
+
+def read_rss(pid):
+    """回傳子行程目前與最高的 RSS (KiB)"""
+    info = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    key, value = line.split(':', 1)
+                    info[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return {"rss_kib": info.get('VmRSS'), "peak_rss_kib": info.get('VmHWM')}
+
+
+def wait_for_server(port, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/data')
+            conn.getresponse().read()
+            conn.close()
+            return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+def drive(port, method, path, total, concurrency):
+    """以 concurrency 個各自保持連線的客戶端送出 total 個請求"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        headers = {'Content-Type': 'application/json'}
+        body = b'{}' if method == 'POST' else None
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                payload = response.read()
+                failed = response.status >= 400
+                if path == '/create_report' and not failed:
+                    # 報告是背景工作：量測到結果可取得為止
+                    job = json.loads(payload)
+                    while job.get('status') in ('pending', 'running'):
+                        time.sleep(0.05)
+                        conn.request('GET', f"/report/{job['job_id']}")
+                        job = json.loads(conn.getresponse().read())
+                    failed = job.get('status') != 'done'
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+                failed = True
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if failed:
+                    errors[0] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+def route_cases(rows):
+    now = int(time.time())
+    return [
+        ("index", "GET", "/"),
+        ("data", "GET", "/data"),
+        ("data_range_1h", "GET", f"/data?from={now - 3600}&to={now}"),
+        ("history_page", "GET", f"/history?before={max(2, rows // 2)}"),
+        ("series_7d", "GET", f"/series?from={now - 7 * 86400}&to={now}&points=500"),
+        ("create_report", "POST", "/create_report"),
+    ]
+
+
+def bench_http(db_path, rows, concurrency_levels, requests, report_requests, llm_delay, workdir):
+    from llm_stub import start_stub
+
+    stub, stub_url = start_stub(delay=llm_delay)
+    port = 18000 + random.randint(0, 999)
+    env = dict(
+        os.environ,
+        ENV_MONITOR_DB=db_path,
+        ENV_MONITOR_BACKEND='sim',
+        OPENAI_BASE_URL=stub_url,
+        OPENAI_API_KEY='bench',
+    )
+    log = open(os.path.join(workdir, f'server_{rows}.log'), 'w')
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve', '--port', str(port)],
+        env=env, stdout=log, stderr=subprocess.STDOUT, cwd=BASE_DIR
+    )
+    results = []
+    try:
+        if not wait_for_server(port):
+            raise RuntimeError(f"Server did not start, see {log.name}")
+        for name, method, path in route_cases(rows):
+            for concurrency in concurrency_levels:
+                total = report_requests if name == "create_report" else requests
+                result = drive(port, method, path, total, concurrency)
+                result.update(route=name, path=path, concurrency=concurrency, rows=rows)
+                result.update(read_rss(server.pid))
+                results.append(result)
+                print(f"  rows={rows:<9} {name:<15} c={concurrency:<3} "
+                      f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+                      f"rps={result['throughput_rps']} errors={result['errors']}", flush=True)
+    finally:
+        server.terminate()
+        server.wait(30)
+        log.close()
+        stub.shutdown()
+    return results
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=BASE_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def serve(port):
+    """子行程：以模擬感測器啟動完整服務"""
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    make_server('127.0.0.1', port, create_app("all"), threaded=True).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command')
+    serve_parser = sub.add_parser('serve', help='(內部使用) 啟動受測伺服器')
+    serve_parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 1000000, 10000000])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=200, help='每個路由、每種並行數的請求數')
+    parser.add_argument('--report-requests', type=int, default=20)
+    parser.add_argument('--ingest-rows', type=int, default=50000)
+    parser.add_argument('--llm-delay', type=float, default=0.2, help='LLM 替身的回應延遲（秒）')
+    parser.add_argument('--sqlite-readers', type=int, nargs='+', default=[1, 4, 16], help='SQLite 並行讀取測試的讀取者數')
+    parser.add_argument('--sqlite-seconds', type=float, default=5.0, help='每種組合的執行秒數')
+    parser.add_argument('--output', help='結果 JSON 路徑')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.port)
+        return
+
+    version = git_version()
+    report = {
+        "version": version,
+        "started": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k != 'command'},
+        "ingest": {},
+        "sqlite": {},
+        "blocks": {},
+        "http": [],
+    }
+    workdir = tempfile.mkdtemp(prefix='envmon-bench-')
+    try:
+        for rows in args.sizes:
+            seed_path = seed_db(rows)
+            print(f"Ingest benchmark on {rows} rows", flush=True)
+            report["ingest"][str(rows)] = bench_ingest(seed_path, workdir, args.ingest_rows)
+            print(f"  {report['ingest'][str(rows)]['per_row_commit']['rows_per_s']} rows/s per-row commit, "
+                  f"{report['ingest'][str(rows)]['write_buffer']['rows_per_s']} rows/s buffered", flush=True)
+            print(f"SQLite concurrency benchmark on {rows} rows", flush=True)
+            report["sqlite"][str(rows)] = bench_sqlite(seed_path, workdir, args.sqlite_readers, args.sqlite_seconds)
+            print(f"Block storage benchmark on {rows} rows", flush=True)
+            blocks = report["blocks"][str(rows)] = bench_blocks(seed_path, workdir)
+            print(f"  {blocks['raw_bytes']} -> {blocks['compact_bytes']} bytes ({blocks['size_ratio']}x), "
+                  f"scan {blocks['raw_scan_s']} s -> {blocks['block_scan_s']} s", flush=True)
+            print(f"HTTP benchmark on {rows} rows", flush=True)
+            report["http"].extend(bench_http(
+                working_copy(seed_path, workdir), rows, args.concurrency,
+                args.requests, args.report_requests, args.llm_delay, workdir
+            ))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(RESULT_DIR, exist_ok=True)
+    output = args.output or os.path.join(
+        RESULT_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{version}.json"
+    )
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
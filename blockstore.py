@@ -0,0 +1,545 @@
+"""原始資料的壓縮區塊：較舊的本機樣本每 BLOCK_SECONDS 一塊打包成一個 BLOB
+
+sensor_data 每筆約 100 bytes（id、19 字元時間字串、三個 8 bytes 浮點數加上三個索引），
+但讀值其實是 DHT11 的整數與一位小數的光度。區塊內各欄分開編碼：
+
+    id        與前一筆的差（通常是 1）
+    ts        差的差（固定採樣間隔時幾乎都是 0）
+    讀值      依感測器精度量化成整數（×1 / ×10 / ×100，無損才採用）後取差
+              缺值另存一份位元遮罩；無法無損量化的欄位保留 float64
+
+差值以 zigzag + varint 寫成位元組串，整塊再 zlib 壓縮。時間字串由 ts 還原，
+不另外儲存。讀取一律經過 iter_range() / read_range() / rows_by_id()，
+呼叫端不必知道資料還在 sensor_data 或已經壓成區塊。
+
+    python blockstore.py compact --before 2024-04-01   # 手動壓縮
+    python blockstore.py stats
+"""
+import argparse
+import struct
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+import rollup
+
+VERSION = 1
+
+# 區塊內的讀值欄位；id / ts 另外編碼
+VALUE_COLUMNS = ("temperature", "humidity", "light")
+# 依序嘗試的量化倍數（10 ** e），都無法無損時存原始 float64
+SCALE_EXPONENTS = (0, 1, 2)
+RAW_FLOAT = 255
+ALL_NULL = 254
+
+BLOCKS_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS sensor_blocks (
+        device_id TEXT NOT NULL,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        min_id INTEGER NOT NULL,
+        max_id INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (device_id, start_ts)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_sensor_blocks_end ON sensor_blocks (end_ts)",
+    "CREATE INDEX IF NOT EXISTS ix_sensor_blocks_ids ON sensor_blocks (device_id, max_id)",
+]
+
+RAW_SQL = (
+    "SELECT COALESCE(source_id, id), ts, temperature, humidity, light FROM sensor_data "
+    "WHERE device_id = ? AND ts >= ? AND ts < ? ORDER BY ts, id"
+)
+
+# history 分頁用的單筆資料，欄位與 SensorData 相同
+Sample = namedtuple("Sample", "id timestamp temperature humidity light")
+
+
+def create_tables(conn):
+    for sql in BLOCKS_SQL:
+        conn.execute(sql)
+    conn.commit()
+
+
+# ---- 編碼 ----
+
+def _zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def _unzigzag(values):
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def _varint_encode(values):
+    """uint64 陣列 → LEB128 位元組；以 NumPy 一次處理一個位元組位置"""
+    v = values.astype(np.uint64)
+    lengths = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += v >= np.uint64(1 << (7 * k))
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+    for k in range(int(lengths.max(initial=0))):
+        sel = lengths > k
+        byte = ((v[sel] >> np.uint64(7 * k)) & np.uint64(0x7f)).astype(np.uint8)
+        out[starts[sel] + k] = byte | (lengths[sel] > k + 1).astype(np.uint8) << 7
+    return out.tobytes()
+
+
+def _varint_decode(buf, offset, count):
+    """從 buf[offset:] 讀 count 個 varint，回傳 (uint64 陣列, 新的 offset)"""
+    if count == 0:
+        return np.empty(0, dtype=np.uint64), offset
+    data = np.frombuffer(buf, dtype=np.uint8, offset=offset)
+    ends = np.flatnonzero(data < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError("truncated block")
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    lengths = ends - starts + 1
+    out = np.zeros(count, dtype=np.uint64)
+    for k in range(int(lengths.max())):
+        sel = lengths > k
+        out[sel] |= (data[starts[sel] + k] & 0x7f).astype(np.uint64) << np.uint64(7 * k)
+    return out, offset + int(ends[-1]) + 1
+
+
+def _encode_ints(values, order):
+    """取 order 次差後 zigzag + varint"""
+    d = np.asarray(values, dtype=np.int64)
+    for _ in range(order):
+        d = np.diff(d, prepend=np.int64(0))
+    return _varint_encode(_zigzag(d))
+
+
+def _decode_ints(buf, offset, count, order):
+    d, offset = _varint_decode(buf, offset, count)
+    d = _unzigzag(d)
+    for _ in range(order):
+        d = np.cumsum(d)
+    return d, offset
+
+
+def _quantize(values):
+    """找能無損還原的最小倍數，回傳 (指數, 整數陣列)；都不行回傳 (RAW_FLOAT, None)"""
+    for e in SCALE_EXPONENTS:
+        scale = 10 ** e
+        q = np.round(values * scale)
+        if np.all(np.abs(q) < 2 ** 52) and np.array_equal(q / scale, values):
+            return e, q.astype(np.int64)
+    return RAW_FLOAT, None
+
+
+def encode_block(ids, ts, columns):
+    """ids / ts 為整數陣列，columns 為 {欄位: float 陣列（NaN 為缺值）}，回傳壓縮後的 bytes"""
+    n = len(ts)
+    parts = [struct.pack("<BI", VERSION, n), _encode_ints(ids, 1), _encode_ints(ts, 2)]
+    for name in VALUE_COLUMNS:
+        values = np.asarray(columns[name], dtype=np.float64)
+        missing = np.isnan(values)
+        present = values[~missing]
+        if len(present) == 0:
+            parts.append(struct.pack("<BB", ALL_NULL, 0))
+            continue
+        mode, q = _quantize(present)
+        parts.append(struct.pack("<BB", mode, int(missing.any())))
+        if missing.any():
+            parts.append(np.packbits(missing).tobytes())
+        if mode == RAW_FLOAT:
+            parts.append(present.astype('<f8').tobytes())
+        else:
+            parts.append(_encode_ints(q, 1))
+    return zlib.compress(b"".join(parts), 6)
+
+
+def decode_block(data):
+    """解開 encode_block() 的結果：{'id', 'ts', 'temperature', 'humidity', 'light'} → NumPy 陣列"""
+    buf = zlib.decompress(data)
+    version, n = struct.unpack_from("<BI", buf, 0)
+    if version != VERSION:
+        raise ValueError(f"unsupported block version: {version}")
+    offset = 5
+    out = {}
+    out["id"], offset = _decode_ints(buf, offset, n, 1)
+    out["ts"], offset = _decode_ints(buf, offset, n, 2)
+    for name in VALUE_COLUMNS:
+        mode, has_missing = struct.unpack_from("<BB", buf, offset)
+        offset += 2
+        values = np.full(n, np.nan)
+        if mode == ALL_NULL:
+            out[name] = values
+            continue
+        present = np.ones(n, dtype=bool)
+        if has_missing:
+            nbytes = (n + 7) // 8
+            present = ~np.unpackbits(np.frombuffer(buf, dtype=np.uint8, count=nbytes, offset=offset))[:n].astype(bool)
+            offset += nbytes
+        count = int(present.sum())
+        if mode == RAW_FLOAT:
+            values[present] = np.frombuffer(buf, dtype='<f8', count=count, offset=offset)
+            offset += count * 8
+        else:
+            q, offset = _decode_ints(buf, offset, count, 1)
+            values[present] = q / 10 ** mode
+        out[name] = values
+    return out
+
+
+# ---- 欄位陣列的小工具 ----
+
+COLUMNS = ("id", "ts") + VALUE_COLUMNS
+
+
+def _empty():
+    return {"id": np.empty(0, dtype=np.int64), "ts": np.empty(0, dtype=np.int64),
+            **{name: np.empty(0) for name in VALUE_COLUMNS}}
+
+
+def _from_rows(rows):
+    if not rows:
+        return _empty()
+    # None（缺值）轉成 NaN；id 與 epoch 秒都遠小於 2**53
+    block = np.array(rows, dtype=np.float64)
+    out = {"id": block[:, 0].astype(np.int64), "ts": block[:, 1].astype(np.int64)}
+    for i, name in enumerate(VALUE_COLUMNS):
+        out[name] = block[:, i + 2]
+    return out
+
+
+def _concat(parts):
+    parts = [p for p in parts if len(p["ts"])]
+    if not parts:
+        return _empty()
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([p[name] for p in parts]) for name in COLUMNS}
+
+
+def _take(cols, index):
+    return {name: cols[name][index] for name in COLUMNS}
+
+
+def _sorted(cols):
+    order = np.lexsort((cols["id"], cols["ts"]))
+    return _take(cols, order)
+
+
+def labels(ts):
+    """epoch 秒 → 本地時間字串（與寫入時 timestamp 欄位的格式相同）"""
+    return [datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') for t in np.asarray(ts).tolist()]
+
+
+# ---- 讀取 ----
+
+def iter_range(conn, device_id, start, end, chunk_rows=65536):
+    """依 (ts, id) 順序逐段回傳 [start, end] 區間的資料（區塊與 sensor_data 合併），每段最多 chunk_rows 筆"""
+    hi = end + 1
+    pending = []
+    size = 0
+
+    def raw(lo, up):
+        cursor = conn.execute(RAW_SQL, (device_id, lo, up))
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield _from_rows(rows)
+
+    def windows():
+        pos = start
+        cursor = conn.execute(
+            "SELECT start_ts, end_ts, data FROM sensor_blocks "
+            "WHERE device_id = ? AND end_ts > ? AND start_ts < ? ORDER BY start_ts",
+            (device_id, start, hi)
+        )
+        for b_start, b_end, data in cursor:
+            if pos < b_start:
+                yield from raw(pos, b_start)
+            cols = decode_block(data)
+            keep = (cols["ts"] >= start) & (cols["ts"] < hi)
+            # 壓縮之後才匯入、落在同一個時段的原始資料
+            late = _from_rows(conn.execute(RAW_SQL, (device_id, max(pos, b_start), min(b_end, hi))).fetchall())
+            yield _sorted(_concat([_take(cols, keep), late]))
+            pos = max(pos, b_end)
+        if pos < hi:
+            yield from raw(pos, hi)
+
+    # 重新切成固定大小，讓呼叫端（例如匯出）每段的大小可預期
+    for part in windows():
+        pending.append(part)
+        size += len(part["ts"])
+        while size >= chunk_rows:
+            merged = _concat(pending)
+            yield _take(merged, slice(0, chunk_rows))
+            rest = _take(merged, slice(chunk_rows, None))
+            pending, size = [rest], len(rest["ts"])
+    if size:
+        yield _concat(pending)
+
+
+def read_range(conn, device_id, start, end, limit=None, newest=False):
+    """[start, end] 區間依時間排序的欄位陣列，最多 limit 筆（newest 時保留最新的 limit 筆）；
+    device_id 為 None 時包含所有裝置"""
+    if device_id is None:
+        return _read_all_devices(conn, start, end, limit, newest)
+    if newest and limit is not None:
+        # 區塊與原始資料只能依時間往後合併：逐段讀完，只留最後 limit 筆
+        tail = _empty()
+        for part in iter_range(conn, device_id, start, end, min(limit, 65536)):
+            tail = _take(_concat([tail, part]), slice(-limit, None))
+        return tail
+    parts = []
+    total = 0
+    for part in iter_range(conn, device_id, start, end, min(limit or 65536, 65536)):
+        parts.append(part)
+        total += len(part["ts"])
+        if limit is not None and total >= limit:
+            break
+    cols = _concat(parts)
+    return cols if limit is None else _take(cols, slice(0, limit))
+
+
+def _read_all_devices(conn, start, end, limit, newest=False):
+    order = " DESC" if newest else ""
+    sql = ("SELECT COALESCE(source_id, id), ts, temperature, humidity, light FROM sensor_data "
+           f"WHERE ts >= ? AND ts <= ? ORDER BY ts{order}")
+    params = (start, end)
+    if limit is not None:
+        sql += " LIMIT ?"
+        params += (limit,)
+    parts = [_from_rows(conn.execute(sql, params).fetchall())]
+    for (data,) in conn.execute(
+        "SELECT data FROM sensor_blocks WHERE end_ts > ? AND start_ts <= ? "
+        f"ORDER BY {'end_ts DESC' if newest else 'start_ts'}", (start, end)
+    ):
+        cols = decode_block(data)
+        parts.append(_take(cols, (cols["ts"] >= start) & (cols["ts"] <= end)))
+        if limit is not None and sum(len(p["ts"]) for p in parts[1:]) >= limit:
+            break
+    cols = _sorted(_concat(parts))
+    if limit is None:
+        return cols
+    return _take(cols, slice(-limit, None) if newest else slice(0, limit))
+
+
+def rows_by_id(conn, device_id, bound, limit, descending=True, kth=None):
+    """區塊中 id 小於（descending）或大於 bound 的資料，依 id 排序最多 limit 筆，回傳 Sample 串列
+
+    kth 為呼叫端（例如 sensor_data 的查詢）已有的第 limit 筆 id；id 範圍完全落在它之外的區塊不必讀。
+    """
+    if descending:
+        sql = ("SELECT max_id, data FROM sensor_blocks WHERE device_id = ? AND min_id < ? "
+               "ORDER BY max_id DESC")
+    else:
+        sql = ("SELECT min_id, data FROM sensor_blocks WHERE device_id = ? AND max_id > ? "
+               "ORDER BY min_id")
+    parts = []
+    for edge, data in conn.execute(sql, (device_id, bound)):
+        # 區塊依 id 範圍排序：已有 limit 筆且這一塊不可能更接近 bound 時就停止
+        if kth is not None and (edge < kth if descending else edge > kth):
+            break
+        cols = decode_block(data)
+        parts.append(_take(cols, cols["id"] < bound if descending else cols["id"] > bound))
+        ids = np.sort(np.concatenate([p["id"] for p in parts]))
+        if len(ids) >= limit:
+            found = ids[-limit] if descending else ids[limit - 1]
+            kth = found if kth is None else (max(kth, found) if descending else min(kth, found))
+    cols = _concat(parts)
+    order = np.argsort(cols["id"])
+    if descending:
+        order = order[::-1]
+    cols = _take(cols, order[:limit])
+    return [
+        Sample(*row) for row in zip(
+            cols["id"].tolist(), labels(cols["ts"]),
+            *(nullable(cols[name]) for name in VALUE_COLUMNS)
+        )
+    ]
+
+
+def nullable(values):
+    """浮點陣列 → list，NaN 轉回 None"""
+    return [None if v != v else v for v in values.tolist()]
+
+
+def bucket_sums(conn, device_id, start, end, resolution):
+    """區塊中 [start, end] 的資料依 resolution 分桶：{bucket: [筆數, 溫度和, 溫度筆數, ...]}"""
+    sums = {}
+    for (data,) in conn.execute(
+        "SELECT data FROM sensor_blocks WHERE device_id = ? AND end_ts > ? AND start_ts <= ? ORDER BY start_ts",
+        (device_id, start, end)
+    ):
+        cols = decode_block(data)
+        cols = _take(cols, (cols["ts"] >= start) & (cols["ts"] <= end))
+        if not len(cols["ts"]):
+            continue
+        buckets = rollup.bucket_of(cols["ts"], resolution)
+        keys, inverse = np.unique(buckets, return_inverse=True)
+        stacked = [np.bincount(inverse, minlength=len(keys))]
+        for name in VALUE_COLUMNS:
+            present = ~np.isnan(cols[name])
+            stacked.append(np.bincount(inverse, weights=np.where(present, cols[name], 0.0), minlength=len(keys)))
+            stacked.append(np.bincount(inverse, weights=present, minlength=len(keys)))
+        for key, values in zip(keys.tolist(), zip(*(s.tolist() for s in stacked))):
+            acc = sums.setdefault(key, [0] * len(values))
+            for i, v in enumerate(values):
+                acc[i] += v
+    return sums
+
+
+def rollup_rows(conn, start, end, resolution, device_id=None):
+    """區塊中 [start, end) 的資料彙總成 sensor_rollup 的列（給 rollup.rebuild 用）"""
+    sql = "SELECT data FROM sensor_blocks WHERE end_ts > ? AND start_ts < ?"
+    params = (start, end)
+    if device_id is not None:
+        sql += " AND device_id = ?"
+        params += (device_id,)
+    groups = {}
+    for (data,) in conn.execute(sql, params):
+        cols = decode_block(data)
+        cols = _sorted(_take(cols, (cols["ts"] >= start) & (cols["ts"] < end)))
+        if not len(cols["ts"]):
+            continue
+        buckets = rollup.bucket_of(cols["ts"], resolution)
+        edges = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+        counts = np.diff(np.append(edges, len(buckets)))
+        stats = []
+        for name in VALUE_COLUMNS:
+            v = cols[name]
+            present = np.add.reduceat(~np.isnan(v), edges)
+            with np.errstate(invalid='ignore'):
+                stats.append(np.where(present, np.fmin.reduceat(v, edges), np.nan))
+                stats.append(np.where(present, np.fmax.reduceat(v, edges), np.nan))
+            stats.append(np.where(present, np.add.reduceat(np.nan_to_num(v), edges), np.nan))
+        for i, bucket in enumerate(buckets[edges].tolist()):
+            row = [int(counts[i])] + [None if s[i] != s[i] else float(s[i]) for s in stats]
+            acc = groups.get(bucket)
+            groups[bucket] = row if acc is None else _merge_rollup(acc, row)
+    return [(resolution, bucket) + tuple(row) for bucket, row in groups.items()]
+
+
+def _merge_rollup(a, b):
+    out = [a[0] + b[0]]
+    for i in range(1, len(a), 3):
+        lo = [v for v in (a[i], b[i]) if v is not None]
+        hi = [v for v in (a[i + 1], b[i + 1]) if v is not None]
+        total = [v for v in (a[i + 2], b[i + 2]) if v is not None]
+        out += [min(lo) if lo else None, max(hi) if hi else None, sum(total) if total else None]
+    return out
+
+
+def contains_ts(conn, device_id, ts, start, end):
+    """ts 中已經有樣本在 [start, end] 區塊裡的位置（布林陣列），匯入時以 (device_id, ts) 避免重複"""
+    ts = np.asarray(ts, dtype=np.int64)
+    found = np.zeros(len(ts), dtype=bool)
+    for (data,) in conn.execute(
+        "SELECT data FROM sensor_blocks WHERE device_id = ? AND end_ts > ? AND start_ts <= ?",
+        (device_id, start, end)
+    ):
+        found |= np.isin(ts, decode_block(data)["ts"])
+    return found
+
+
+def stats(conn):
+    blocks, samples, size = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(count), 0), COALESCE(SUM(LENGTH(data)), 0) FROM sensor_blocks"
+    ).fetchone()
+    return {"blocks": blocks, "samples": samples, "bytes": size,
+            "bytes_per_sample": round(size / samples, 2) if samples else None}
+
+
+# ---- 壓縮 ----
+
+def compact(conn, device_id, before_ts, block_seconds=3600, max_id=None, stop=None):
+    """把 before_ts 之前、完整時段內的本機原始資料壓成區塊並刪除原始列，回傳 (筆數, 區塊數)
+
+    device_id 只能是本機（其他裝置的資料以 source_id 去重，必須留在 sensor_data）。已有區塊的時段（例如壓縮後才匯入舊資料）會與新資料合併。max_id 限制只處理
+    id 不超過它的資料（邊緣節點還沒推送的資料要留在 sensor_data）。每個時段一個短交易。
+
+    id 最大的那一列一律留在 sensor_data：id 是沒有 AUTOINCREMENT 的 INTEGER PRIMARY KEY，
+    表清空後 SQLite 會從 1 重新配號，與區塊中的 id 及收集端已見過的 source_id 重複。
+    """
+    top = conn.execute("SELECT MAX(id) FROM sensor_data").fetchone()[0]
+    if top is None:
+        return 0, 0
+    max_id = top - 1 if max_id is None else min(max_id, top - 1)
+    id_filter = " AND id <= ?"
+    id_args = (max_id,)
+    limit = rollup.bucket_of(before_ts, block_seconds)
+    rows_done = 0
+    blocks_done = 0
+    lo = None
+    while stop is None or not stop():
+        first = conn.execute(
+            "SELECT MIN(ts) FROM sensor_data WHERE device_id = ? AND ts < ?"
+            + ("" if lo is None else " AND ts >= ?") + id_filter,
+            (device_id, limit) + (() if lo is None else (lo,)) + id_args
+        ).fetchone()[0]
+        if first is None:
+            break
+        lo = rollup.bucket_of(first, block_seconds)
+        hi = lo + block_seconds
+        where = "device_id = ? AND ts >= ? AND ts < ?" + id_filter
+        params = (device_id, lo, hi) + id_args
+        with conn:
+            # 先取得寫入鎖再讀，讀取與改寫之間不會有其他行程插入同一時段
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                f"SELECT id, ts, temperature, humidity, light FROM sensor_data WHERE {where}", params
+            ).fetchall()
+            if rows:
+                _merge_block(conn, device_id, lo, hi, _from_rows(rows))
+                conn.execute(f"DELETE FROM sensor_data WHERE {where}", params)
+        if rows:
+            rows_done += len(rows)
+            blocks_done += 1
+        lo = hi
+    return rows_done, blocks_done
+
+
+def _merge_block(conn, device_id, lo, hi, cols):
+    """與同一時段既有的區塊合併（同 id 只留一筆）後寫回"""
+    existing = conn.execute(
+        "SELECT data FROM sensor_blocks WHERE device_id = ? AND start_ts = ?", (device_id, lo)
+    ).fetchone()
+    if existing:
+        cols = _concat([decode_block(existing[0]), cols])
+    _, first_of_id = np.unique(cols["id"], return_index=True)
+    cols = _sorted(_take(cols, first_of_id))
+    conn.execute(
+        "INSERT OR REPLACE INTO sensor_blocks (device_id, start_ts, end_ts, count, min_id, max_id, data) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (device_id, lo, hi, len(cols["ts"]), int(cols["id"].min()), int(cols["id"].max()),
+         encode_block(cols["id"], cols["ts"], cols))
+    )
+
+
+if __name__ == '__main__':
+    import json
+    import storage
+    from config import DB_PATH, DEVICE_ID, BLOCK_SECONDS, COMPACT_AFTER
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    comp = sub.add_parser('compact', help='壓縮較舊的原始資料')
+    comp.add_argument('--before', default=None, help='預設為 COMPACT_AFTER 秒之前')
+    comp.add_argument('--device', default=DEVICE_ID)
+    sub.add_parser('stats', help='區塊數量與大小')
+    args = parser.parse_args()
+
+    conn = storage.connect(args.db)
+    started = time.perf_counter()
+    if args.command == 'compact':
+        before = rollup.parse_time_arg(args.before) if args.before else int(time.time() - COMPACT_AFTER)
+        rows, blocks = compact(conn, args.device, before, BLOCK_SECONDS)
+        print(f"Compacted {rows} rows into {blocks} blocks in {time.perf_counter() - started:.2f}s")
+    else:
+        print(json.dumps(stats(conn), indent=2))
+    conn.close()
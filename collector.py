@@ -0,0 +1,216 @@
+"""多節點收集：批次格式、收集端寫入與跨裝置查詢
+
+本機測試可以啟動一個替身收集端：
+
+    python collector.py --port 5001 --db /tmp/collector.db
+    ENV_MONITOR_COLLECTOR_URL=http://127.0.0.1:5001/ingest python app.py
+"""
+import argparse
+import gzip
+import json
+import logging
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rollup
+import storage
+
+logger = logging.getLogger(__name__)
+
+# 批次以欄為單位編碼，欄位名稱只出現一次
+FIELDS = ("source_id", "ts", "timestamp", "temperature", "humidity", "light")
+
+DEVICES_SQL = """
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    first_seen INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL,
+    last_ts INTEGER,
+    rows INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+INSERT_SQL = (
+    "INSERT OR IGNORE INTO sensor_data (device_id, source_id, ts, timestamp, temperature, humidity, light) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+UPSERT_DEVICE_SQL = """
+INSERT INTO devices (device_id, first_seen, last_seen, last_ts, rows) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (device_id) DO UPDATE SET
+    last_seen = excluded.last_seen,
+    last_ts = MAX(COALESCE(last_ts, 0), excluded.last_ts),
+    rows = rows + excluded.rows
+"""
+
+
+class IngestError(ValueError):
+    pass
+
+
+def create_tables(conn):
+    conn.execute(DEVICES_SQL)
+    conn.commit()
+
+
+def encode_batch(device_id, rows):
+    """rows 為 (source_id, ts, timestamp, temperature, humidity, light)，回傳 gzip 壓縮的 JSON"""
+    payload = {"device_id": device_id}
+    for i, name in enumerate(FIELDS):
+        payload[name] = [row[i] for row in rows]
+    return gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_batch(body, encoding=None, max_bytes=8 * 1024 * 1024):
+    """解壓並驗證一批資料，回傳 (device_id, rows)"""
+    if encoding == 'gzip':
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(body, max_bytes)
+        except zlib.error as e:
+            raise IngestError(f"bad gzip payload: {e}")
+        if inflater.unconsumed_tail:
+            raise IngestError("payload too large")
+    elif encoding not in (None, '', 'identity'):
+        raise IngestError(f"unsupported encoding: {encoding}")
+    try:
+        payload = json.loads(body)
+        device_id = str(payload["device_id"])
+        columns = [payload[name] for name in FIELDS]
+    except (ValueError, KeyError, TypeError) as e:
+        raise IngestError(f"bad batch: {e}")
+    if not device_id or len({len(c) for c in columns}) != 1:
+        raise IngestError("bad batch: empty device id or ragged columns")
+    return device_id, list(zip(*columns))
+
+
+def ingest(conn, device_id, rows):
+    """在單一交易內批次寫入；重送的資料依 (device_id, source_id) 忽略，回傳實際新增筆數"""
+    now = int(time.time())
+    with conn:
+        # rowcount 不含觸發器的異動，被忽略的重複資料也不計
+        inserted = max(0, conn.executemany(INSERT_SQL, [(device_id,) + tuple(row) for row in rows]).rowcount)
+        last_ts = max((row[1] for row in rows), default=None)
+        conn.execute(UPSERT_DEVICE_SQL, (device_id, now, now, last_ts, inserted))
+    return inserted
+
+
+def list_devices(conn):
+    cursor = conn.execute("SELECT device_id, first_seen, last_seen, last_ts, rows FROM devices ORDER BY device_id")
+    return [
+        {"device_id": d, "first_seen": first, "last_seen": last, "last_ts": last_ts, "rows": count}
+        for d, first, last, last_ts, count in cursor
+    ]
+
+
+def fleet_series(conn, start, end, max_points, devices, resolutions=rollup.DEFAULT_RESOLUTIONS):
+    """各裝置在 [start, end] 的分桶平均，走 (device_id, ts) 索引；已壓縮的時段由區塊補上"""
+    import blockstore  # 需要 NumPy，用到時才載入
+    res = rollup.finest_resolution(start, end, max_points, resolutions) or 2
+    offset = rollup.TZ_OFFSET
+    result = {"resolution": res, "devices": {}}
+    for device_id in devices:
+        cursor = conn.execute(
+            "SELECT (ts + ?) / ? * ? - ?, COUNT(*), "
+            "SUM(temperature), COUNT(temperature), SUM(humidity), COUNT(humidity), SUM(light), COUNT(light) "
+            "FROM sensor_data WHERE device_id = ? AND ts >= ? AND ts <= ? "
+            "GROUP BY (ts + ?) / ?",
+            (offset, res, res, offset, device_id, start, end, offset, res)
+        )
+        sums = blockstore.bucket_sums(conn, device_id, start, end, res)
+        for bucket, *values in cursor:
+            acc = sums.setdefault(bucket, [0] * len(values))
+            for i, v in enumerate(values):
+                acc[i] += v or 0
+        series = {"ts": [], "count": []}
+        for ch in rollup.CHANNELS:
+            series[ch] = []
+        for bucket in sorted(sums):
+            count, *values = sums[bucket]
+            series["ts"].append(bucket)
+            series["count"].append(int(count))
+            for i, ch in enumerate(rollup.CHANNELS):
+                total, n = values[i * 2:i * 2 + 2]
+                series[ch].append(round(total / n, 2) if n else None)
+        result["devices"][device_id] = series
+    return result
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    """替身收集端：只提供 POST /ingest 與 GET /devices"""
+    db_path = None
+    token = ""
+    max_bytes = 8 * 1024 * 1024
+    lock = threading.Lock()
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/devices':
+            self.send_error(404)
+            return
+        conn = storage.connect(self.db_path, readonly=True)
+        try:
+            self._reply(200, {"devices": list_devices(conn)})
+        finally:
+            conn.close()
+
+    def do_POST(self):
+        if self.path != '/ingest':
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.token and self.headers.get('X-Ingest-Token') != self.token:
+            self._reply(403, {"error": "bad ingest token"})
+            return
+        try:
+            device_id, rows = decode_batch(body, self.headers.get('Content-Encoding'), self.max_bytes)
+        except IngestError as e:
+            self._reply(400, {"error": str(e)})
+            return
+        with self.lock:
+            conn = storage.connect(self.db_path)
+            try:
+                inserted = ingest(conn, device_id, rows)
+            finally:
+                conn.close()
+        self._reply(200, {"accepted": inserted, "duplicates": len(rows) - inserted})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_collector(db_path, port=0, token="", host='127.0.0.1'):
+    """在背景執行緒啟動替身收集端，回傳 (server, ingest_url)"""
+    import schema
+    schema.migrate(db_path)
+    handler = type('Handler', (CollectorHandler,), {'db_path': db_path, 'token': token})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/ingest"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--db', default='collector.db')
+    parser.add_argument('--token', default='')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server, url = start_collector(args.db, args.port, args.token, args.host)
+    print(f"Collector listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,6 +1,11 @@
+import json
+import logging
 import os
+import socket
+import sqlite3
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'data.db')
+# 可用環境變數 ENV_MONITOR_DB 指定其他資料庫（例如基準測試）
+DB_PATH = os.environ.get("ENV_MONITOR_DB", os.path.join(BASE_DIR, 'data.db'))
 SQLALCHEMY_DATABASE_URI = f"sqlite:///{DB_PATH}"
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
@@ -8,3 +13,205 @@ DHT_PIN = 4
 LED_PIN = 18
 BUZZER_PIN = 19
 DEFAULT_THRESHOLDS = {"temperature": 35.0, "humidity": 80.0, "light": 30.0}
+
+# Write-behind 寫入緩衝：累積到筆數或秒數上限才批次寫入 SQLite
+WRITE_BUFFER_MAX_ROWS = 30
+WRITE_BUFFER_MAX_AGE = 10.0
+WRITE_BUFFER_QUEUE_SIZE = 1000
+
+# 歷史表格分頁（keyset，依 id）
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 500
+
+# /data 回傳的最近樣本數（記憶體環狀緩衝大小）
+DATA_WINDOW = 50
+
+# /stream (SSE) 每個連線的訊息佇列大小與心跳秒數
+STREAM_CLIENT_QUEUE_SIZE = 100
+STREAM_HEARTBEAT = 15.0
+
+# /data?from=&to= 單次最多回傳筆數
+DATA_RANGE_MAX_ROWS = 5000
+
+# 彙總表解析度（秒）；新增解析度需另外回填舊資料
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+# /series 預設點數
+SERIES_DEFAULT_POINTS = 500
+
+# 資料保留：本機原始資料保留天數（已被彙總表涵蓋才會刪除；其他裝置的資料不刪），各解析度彙總保留天數（None 為永久）
+RAW_RETENTION_DAYS = 7
+ROLLUP_RETENTION_DAYS = {60: 90, 3600: 730, 86400: None}
+RETENTION_INTERVAL = 3600.0
+CHECKPOINT_INTERVAL = 300.0
+RETENTION_BATCH_SIZE = 500
+RETENTION_BATCH_PAUSE = 0.2
+VACUUM_PAGES_PER_RUN = 1000
+# 壓縮區塊（blockstore.py）：本機原始資料超過 COMPACT_AFTER 秒後，每 BLOCK_SECONDS 打包成一個區塊
+COMPACT_ENABLED = os.environ.get("ENV_MONITOR_COMPACT", "1") == "1"
+COMPACT_AFTER = 86400
+BLOCK_SECONDS = 3600
+
+# 採樣週期（秒）：DHT11 最快約 1 秒一次，光感 10 Hz
+DHT_INTERVAL = 2.0
+LIGHT_INTERVAL = 0.1
+# 讀取失敗時的最長退避秒數
+SAMPLE_BACKOFF_MAX = 30.0
+# 合併樣本時，其他通道最後一筆讀數可接受的最大延遲
+SAMPLE_MERGE_MAX_AGE = 5.0
+
+# 感測器後端：'rpi' 實機，'sim' 模擬（可用環境變數 ENV_MONITOR_BACKEND 覆寫）
+SENSOR_BACKEND = os.environ.get("ENV_MONITOR_BACKEND", "rpi")
+# 模擬後端：亂數種子、雜訊標準差、讀取失敗率、突波機率、採樣加速倍數
+SIM_SEED = 42
+SIM_NOISE = 0.5
+SIM_FAULT_RATE = 0.05
+SIM_SPIKE_RATE = 0.001
+SIM_SPEEDUP = float(os.environ.get("ENV_MONITOR_SIM_SPEEDUP", "1"))
+
+# AI 報告（OpenAI 相容 API）；基準測試時可指向本機的替身服務
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "金鑰")
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/openai/")
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gemini-2.0-flash")
+
+# AI 報告工作：同時呼叫 LLM 的數量、快取筆數與有效秒數、完成後保留工作的秒數
+REPORT_WORKERS = 2
+REPORT_CACHE_SIZE = 32
+REPORT_CACHE_TTL = 600.0
+REPORT_JOB_TTL = 3600.0
+
+# AI 報告預設分析區間（'hour' / 'day' / 'week' / 'month' 或秒數）與摘要時最多使用的資料點數
+REPORT_DEFAULT_WINDOW = "day"
+REPORT_MAX_POINTS = 2000
+# 串流報告可寫入快取的最大字數
+REPORT_MAX_CHARS = 20000
+
+# 警報規則：方向、遲滯寬度與每分鐘最大變化量（None 表示不檢查變化率）
+ALARM_RULES = {
+    "temperature": {"direction": ">", "hysteresis": 0.5, "max_rate": 2.0},
+    "humidity": {"direction": ">", "hysteresis": 2.0, "max_rate": 10.0},
+    "light": {"direction": "<", "hysteresis": 5.0, "max_rate": None},
+}
+# 超出門檻需持續多少秒才觸發、回到正常需持續多少秒才解除
+ALARM_MIN_DURATION = 4.0
+ALARM_CLEAR_DURATION = 10.0
+# 變化率的計算區間（秒）、警報佇列大小與 LED 閃爍間隔（秒）
+ALARM_RATE_WINDOW = 60.0
+ALARM_QUEUE_SIZE = 100
+ALARM_LED_BLINK = 0.5
+
+# 多節點收集：本機裝置代號；設定 ENV_MONITOR_COLLECTOR_URL（例如 http://192.168.0.100:5000/ingest）即推送到收集端
+def _recorded_device_id(db_path):
+    """資料庫已記錄的本機裝置代號（settings 表，schema v8 起）；更舊的資料庫取最新一筆本機資料的 device_id"""
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return None
+    try:
+        try:
+            row = conn.execute("SELECT value FROM settings WHERE name = 'device_id'").fetchone()
+            if row:
+                return json.loads(row[0])
+        except sqlite3.Error:
+            pass
+        try:
+            row = conn.execute(
+                "SELECT device_id FROM sensor_data WHERE source_id IS NULL AND device_id IS NOT NULL "
+                "ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error:
+            return None
+    finally:
+        conn.close()
+
+
+# 第一次建立資料庫時以 ENV_MONITOR_DEVICE_ID（預設主機名稱）決定，之後沿用資料庫中記錄的值：
+# 主機改名或之後才設定環境變數，既有的本機資料仍屬於同一個裝置
+_CONFIGURED_DEVICE_ID = os.environ.get("ENV_MONITOR_DEVICE_ID", socket.gethostname())
+DEVICE_ID = _recorded_device_id(DB_PATH) or _CONFIGURED_DEVICE_ID
+if "ENV_MONITOR_DEVICE_ID" in os.environ and DEVICE_ID != _CONFIGURED_DEVICE_ID:
+    logging.getLogger(__name__).warning(
+        "ENV_MONITOR_DEVICE_ID=%s ignored: %s already records device id %s",
+        _CONFIGURED_DEVICE_ID, DB_PATH, DEVICE_ID
+    )
+COLLECTOR_URL = os.environ.get("ENV_MONITOR_COLLECTOR_URL", "")
+# 收集端：ENV_MONITOR_COLLECTOR=1 開啟 /ingest；INGEST_TOKEN 不為空時需在 X-Ingest-Token 帶相同值
+COLLECTOR_MODE = os.environ.get("ENV_MONITOR_COLLECTOR", "0") == "1"
+INGEST_TOKEN = os.environ.get("ENV_MONITOR_INGEST_TOKEN", "")
+INGEST_MAX_BYTES = 8 * 1024 * 1024
+# 邊緣節點推送週期（秒）、每批筆數、失敗退避上限（秒）與離線暫存
+PUSH_INTERVAL = 10.0
+PUSH_BATCH_SIZE = 500
+PUSH_BACKOFF_MAX = 300.0
+SPOOL_DIR = os.path.join(BASE_DIR, 'spool')
+SPOOL_MAX_BYTES = 50 * 1024 * 1024
+
+# 欄式匯出每段筆數與 /import 上傳大小上限
+EXPORT_CHUNK_ROWS = 65536
+IMPORT_MAX_BYTES = 512 * 1024 * 1024
+
+# 執行模式：all = 單一行程（開發用）；sampler = 只負責採樣與 GPIO；web = gunicorn worker（見 wsgi.py）
+SERVER_ROLE = os.environ.get("ENV_MONITOR_ROLE", "all")
+WEB_HOST = os.environ.get("ENV_MONITOR_HOST", "0.0.0.0")
+WEB_PORT = int(os.environ.get("ENV_MONITOR_PORT", "5000"))
+WEB_WORKERS = int(os.environ.get("ENV_MONITOR_WORKERS", str(os.cpu_count() or 1)))
+WEB_THREADS = int(os.environ.get("ENV_MONITOR_THREADS", "8"))
+# 每個行程同時開著的串流（/stream、報告串流）上限；每條占住一個 worker 執行緒，預設留一半給其他路由
+STREAM_MAX_CLIENTS = int(os.environ.get("ENV_MONITOR_STREAM_CLIENTS", str(max(1, WEB_THREADS // 2))))
+WEB_DEBUG = os.environ.get("ENV_MONITOR_DEBUG", "0") == "1"
+# sampler 行程寫出的最近樣本快照與統計，web worker 讀取
+RUNTIME_DIR = os.environ.get("ENV_MONITOR_RUN_DIR", os.path.join(BASE_DIR, 'run'))
+LIVE_SNAPSHOT_PATH = os.path.join(RUNTIME_DIR, 'live.json')
+STATS_PATH = os.path.join(RUNTIME_DIR, 'stats.json')
+# web worker 檢查快照（秒）、sampler 檢查 settings 表（秒）與寫出統計的週期
+SNAPSHOT_POLL_INTERVAL = 0.5
+SETTINGS_POLL_INTERVAL = 1.0
+STATS_INTERVAL = 5.0
+
+# SQLite 調校（見 storage.py）：WAL 讓讀取與寫入互不阻塞
+SQLITE_JOURNAL_MODE = os.environ.get("ENV_MONITOR_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = "NORMAL"
+SQLITE_BUSY_TIMEOUT = 30.0  # 秒
+SQLITE_CACHE_KB = 8192
+SQLITE_MMAP_BYTES = 64 * 1024 * 1024
+# 每個行程的唯讀連線數上限（也是 SQLAlchemy 連線池大小）
+SQLITE_READ_POOL_SIZE = 8
+
+# 異常偵測（anomaly.py）：EWMA 係數、|z| 門檻與暖機筆數
+ANOMALY_ALPHA = 0.05
+ANOMALY_Z_THRESHOLD = 4.0
+ANOMALY_WARMUP = 30
+# 各通道的標準差下限（DHT11 為整數讀值）與判定卡住的連續不變筆數（None 不判斷；暗處光度長時間為 0）
+ANOMALY_CHANNELS = {
+    "temperature": {"min_std": 0.5, "stuck_samples": 5400},
+    "humidity": {"min_std": 1.0, "stuck_samples": 5400},
+    "light": {"min_std": 2.0, "stuck_samples": None},
+}
+# 異常是否走警報流程（蜂鳴器、alarm_events）與最後一次異常後多少秒解除
+ANOMALY_ALARMS = True
+ANOMALY_CLEAR_DURATION = 30.0
+
+# 記錄（logs.py）：層級、格式（text / json）與佇列大小；輸出在背景執行緒進行
+LOG_LEVEL = os.environ.get("ENV_MONITOR_LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("ENV_MONITOR_LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = 10000
+# 會大量重複的 logger：同一訊息每隔幾秒最多輸出一筆（每筆樣本、感測器讀取失敗）
+LOG_RATE_LIMITS = {
+    "samples": 60.0,
+    "dht_sensor": 30.0,
+    "light_sensor": 30.0,
+    "sampler": 30.0,
+}
+
+# HTTP 回應壓縮（gzip；有安裝 brotli 套件時優先用 br）：小於 COMPRESS_MIN_BYTES 的回應不壓縮
+COMPRESS_ENABLED = os.environ.get("ENV_MONITOR_COMPRESS", "1") == "1"
+COMPRESS_MIN_BYTES = 512
+COMPRESS_LEVEL = 6  # gzip 1–9
+BROTLI_QUALITY = 5  # brotli 0–11
+COMPRESS_TYPES = ("text/html", "text/css", "text/plain", "application/json", "application/javascript", "text/javascript")
+# 同一份內容（以 ETag 區分）壓縮一次，之後直接回傳快取的結果
+COMPRESS_CACHE_SIZE = 32
+# static/vendor 下的檔名含版本號，瀏覽器可長期快取（秒）
+STATIC_MAX_AGE = 365 * 86400
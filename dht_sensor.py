@@ -1,12 +1,23 @@
 import dht11, logging
 from config import DHT_PIN
+from drivers import TempHumidityDriver
 
-instance = dht11.DHT11(pin=DHT_PIN)
+# DHT11 時常讀取失敗，重複的警告由 logs.RateLimit 限流（見 config.LOG_RATE_LIMITS）
+logger = logging.getLogger(__name__)
 
-def read_dht_data():
+
+def read_dht_data(instance):
     result = instance.read()
     if result.is_valid():
         return result.temperature, result.humidity
     else:
-        logging.warning("DHT11 讀取失敗")
+        logger.warning("DHT11 讀取失敗 (error code %s)", result.error_code)
         return None, None
+
+
+class DHT11Driver(TempHumidityDriver):
+    def __init__(self, pin=DHT_PIN):
+        self.instance = dht11.DHT11(pin=pin)
+
+    def read(self):
+        return read_dht_data(self.instance)
@@ -0,0 +1,59 @@
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Drivers = namedtuple("Drivers", ["dht", "light", "actuator"])
+
+
+class TempHumidityDriver:
+    """溫濕度感測器：read() 回傳 (temperature, humidity)，失敗時回傳 (None, None)"""
+
+    def read(self):
+        raise NotImplementedError
+
+
+class LightDriver:
+    """光感測器：read() 回傳照度，失敗時回傳 None"""
+
+    def read(self):
+        raise NotImplementedError
+
+
+class ActuatorDriver:
+    """蜂鳴器與 LED"""
+
+    def buzzer_on(self):
+        raise NotImplementedError
+
+    def buzzer_off(self):
+        raise NotImplementedError
+
+    def led(self, on):
+        raise NotImplementedError
+
+    def cleanup(self):
+        pass
+
+
+def load_drivers(backend):
+    """依設定載入硬體驅動：'rpi' 為實際感測器，'sim' 為模擬（可在一般 Linux 上執行）"""
+    if backend == "rpi":
+        # 只有實機模式才匯入 RPi.GPIO / dht11 / apds9930
+        import alarm
+        import dht_sensor
+        import light_sensor
+        drivers = Drivers(dht_sensor.DHT11Driver(), light_sensor.APDS9930Driver(), alarm.GPIOActuator())
+    elif backend == "sim":
+        import sim_sensors
+        from config import SIM_SEED, SIM_NOISE, SIM_FAULT_RATE, SIM_SPIKE_RATE, SIM_SPEEDUP
+        options = dict(noise=SIM_NOISE, fault_rate=SIM_FAULT_RATE, spike_rate=SIM_SPIKE_RATE, speedup=SIM_SPEEDUP)
+        drivers = Drivers(
+            sim_sensors.SimulatedDHT(seed=SIM_SEED, **options),
+            sim_sensors.SimulatedLight(seed=SIM_SEED + 1, **options),
+            sim_sensors.SimulatedActuator()
+        )
+    else:
+        raise ValueError(f"Unknown sensor backend: {backend}")
+    logger.info("Loaded '%s' sensor backend", backend)
+    return drivers
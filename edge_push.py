@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import random
+import threading
+import urllib.error
+import urllib.request
+
+import collector
+import storage
+
+logger = logging.getLogger(__name__)
+
+SELECT_SQL = (
+    "SELECT id, ts, timestamp, temperature, humidity, light FROM sensor_data "
+    "WHERE id > ? AND device_id = ? ORDER BY id LIMIT ?"
+)
+
+
+class EdgePusher:
+    """邊緣節點推送：本機新資料先壓縮成批次檔暫存到磁碟，再依序送到收集端
+
+    離線時批次檔留在 spool 目錄，恢復連線後照順序重送；收集端以
+    (device_id, source_id) 去重，重送同一批不會產生重複資料。
+    """
+
+    def __init__(self, db_path, device_id, url, spool_dir, interval=10.0, batch_size=500,
+                 spool_max_bytes=50 * 1024 * 1024, token="", backoff_max=300.0, timeout=10.0):
+        self.db_path = db_path
+        self.device_id = device_id
+        self.url = url
+        self.spool_dir = spool_dir
+        self.interval = interval
+        self.batch_size = batch_size
+        self.spool_max_bytes = spool_max_bytes
+        self.token = token
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._cursor_path = os.path.join(spool_dir, 'cursor')
+        self._stop = threading.Event()
+        self._thread = None
+        self.failures = 0  # 連續失敗次數
+        self.batches_sent = 0
+        self.rows_sent = 0
+        self.duplicates = 0
+        self.last_error = None
+
+    def start(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="edge-push", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def stats(self):
+        files = self._spooled()
+        return {
+            "url": self.url,
+            "cursor": self._load_cursor(),
+            "spooled_batches": len(files),
+            "spooled_bytes": sum(os.path.getsize(os.path.join(self.spool_dir, f)) for f in files),
+            "batches_sent": self.batches_sent,
+            "rows_sent": self.rows_sent,
+            "duplicates": self.duplicates,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+    def cursor(self):
+        """已切成批次檔的最後一個 id；之前的資料可以壓縮（見 blockstore.compact）"""
+        return self._load_cursor()
+
+    def _spooled(self):
+        try:
+            return sorted(f for f in os.listdir(self.spool_dir) if f.endswith('.json.gz'))
+        except FileNotFoundError:
+            return []
+
+    def _load_cursor(self):
+        try:
+            with open(self._cursor_path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_atomic(self, path, data):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def spool_new(self):
+        """把游標之後的本機資料切成批次檔；回傳新增的批次數"""
+        cursor = self._load_cursor()
+        used = sum(os.path.getsize(os.path.join(self.spool_dir, f)) for f in self._spooled())
+        created = 0
+        conn = storage.connect(self.db_path, readonly=True)
+        try:
+            while not self._stop.is_set():
+                rows = conn.execute(SELECT_SQL, (cursor, self.device_id, self.batch_size)).fetchall()
+                if not rows:
+                    break
+                if used >= self.spool_max_bytes:
+                    # 暫存已滿：資料仍在本機資料庫，等送出後再繼續切批次
+                    logger.warning("Spool directory full (%d bytes), waiting for collector", used)
+                    break
+                data = collector.encode_batch(self.device_id, rows)
+                name = f"{rows[0][0]:012d}-{rows[-1][0]:012d}.json.gz"
+                self._write_atomic(os.path.join(self.spool_dir, name), data)
+                # 先寫批次檔再前進游標；中途當機最多重送一批，收集端會去重
+                cursor = rows[-1][0]
+                self._write_atomic(self._cursor_path, str(cursor).encode())
+                used += len(data)
+                created += 1
+        finally:
+            conn.close()
+        return created
+
+    def send_spooled(self):
+        """依序送出暫存的批次，遇到失敗就停下；回傳是否全部送出"""
+        for name in self._spooled():
+            if self._stop.is_set():
+                return False
+            path = os.path.join(self.spool_dir, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            request = urllib.request.Request(self.url, data=data, method='POST', headers={
+                'Content-Type': 'application/json',
+                'Content-Encoding': 'gzip',
+                'X-Ingest-Token': self.token,
+            })
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    result = json.loads(response.read() or b'{}')
+            except urllib.error.HTTPError as e:
+                if e.code == 400:
+                    # 收集端無法解析的批次重送也不會成功，移到一旁保留
+                    logger.error("Collector rejected batch %s: %s", name, e.read()[:200])
+                    os.replace(path, path + '.rejected')
+                    continue
+                self._fail(e)
+                return False
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                self._fail(e)
+                return False
+            os.remove(path)
+            self.failures = 0
+            self.last_error = None
+            self.batches_sent += 1
+            self.rows_sent += result.get("accepted", 0)
+            self.duplicates += result.get("duplicates", 0)
+        return True
+
+    def _fail(self, error):
+        self.failures += 1
+        self.last_error = str(error)
+        if self.failures == 1 or self.failures % 10 == 0:
+            logger.warning("Push to collector failed (%d in a row): %s", self.failures, error)
+
+    def _delay(self):
+        if self.failures == 0:
+            return self.interval
+        delay = min(self.backoff_max, self.interval * (2 ** min(self.failures, 16)))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.spool_new()
+                self.send_spooled()
+            except Exception as e:
+                logger.error("Edge push cycle failed: %s", e)
+            self._stop.wait(self._delay())
@@ -0,0 +1,99 @@
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event, data, event_id=None):
+    """編碼成 Server-Sent Events 的訊息格式"""
+    if not isinstance(data, (str, bytes)):
+        data = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.splitlines())
+    return ("\n".join(lines) + "\n\n").encode('utf-8')
+
+
+class StreamLimit:
+    """同時開著的串流回應（/stream、報告串流）數量上限
+
+    gthread worker 的每個長連線都占住一個執行緒直到斷線；超過上限的請求由呼叫端回 503，
+    留下其餘執行緒給一般路由。計數只在本行程內，gunicorn 的總上限為 worker 數乘以 limit。
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+class EventBroadcaster:
+    """把新樣本與警報狀態推送給所有 /stream 連線
+
+    每個連線有自己的有界佇列；客戶端太慢時丟棄最舊的訊息，
+    發佈端（採樣執行緒）永遠不會被卡住。
+    """
+
+    def __init__(self, max_queue=100, heartbeat=15.0):
+        self.max_queue = max_queue
+        self.heartbeat = heartbeat
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def client_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event, data, event_id=None):
+        if not self._subscribers:
+            return
+        message = format_sse(event, data, event_id)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            while True:
+                try:
+                    q.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def listen(self, initial=None):
+        """產生器：先送出 initial（若有），之後持續輸出新事件，閒置時送心跳"""
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(q)
+        logger.debug("SSE client connected (%d total)", len(self._subscribers))
+        try:
+            if initial is not None:
+                yield initial
+            while True:
+                try:
+                    yield q.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # 註解行當作心跳，讓代理伺服器與瀏覽器保持連線
+                    yield b": ping\n\n"
+        finally:
+            with self._lock:
+                self._subscribers.discard(q)
+            logger.debug("SSE client disconnected (%d total)", len(self._subscribers))
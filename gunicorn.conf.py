@@ -0,0 +1,39 @@
+"""gunicorn 設定：主行程先套用資料庫遷移並啟動唯一的 sampler 行程，再 fork 多個 web worker
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import os
+import subprocess
+import sys
+
+from config import DB_PATH, WEB_HOST, WEB_PORT, WEB_WORKERS, WEB_THREADS, RUNTIME_DIR
+
+bind = f"{WEB_HOST}:{WEB_PORT}"
+workers = WEB_WORKERS
+# /stream 是長連線，用執行緒型 worker 讓每個 worker 可同時服務多個客戶端；
+# 每條串流占住一個執行緒，app.py 以 STREAM_MAX_CLIENTS 限制數量，其餘執行緒留給一般路由
+worker_class = "gthread"
+threads = WEB_THREADS
+timeout = 120
+
+_sampler = None
+
+
+def on_starting(server):
+    global _sampler
+    import schema
+    schema.migrate(DB_PATH)
+    os.makedirs(RUNTIME_DIR, exist_ok=True)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, ENV_MONITOR_ROLE="sampler")
+    _sampler = subprocess.Popen([sys.executable, os.path.join(here, "app.py"), "--role", "sampler"], env=env, cwd=here)
+    server.log.info("Started sampler process %s", _sampler.pid)
+
+
+def on_exit(server):
+    if _sampler is not None and _sampler.poll() is None:
+        _sampler.terminate()
+        try:
+            _sampler.wait(15)
+        except subprocess.TimeoutExpired:
+            _sampler.kill()
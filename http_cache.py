@@ -0,0 +1,133 @@
+"""HTTP 快取與壓縮：ETag / Last-Modified 條件請求回 304，JSON 與 HTML 依 Accept-Encoding 壓縮
+
+輪詢 /data 的客戶端在沒有新樣本時只收到 304，不重送內容；首頁與 /history 在資料沒變時
+也不重新渲染或查詢。ETag 以最新樣本的 id（即時資料則為環狀緩衝的版本）組成。
+
+壓縮在 after_request 進行：有 ETag 的回應（即時資料、static 檔案）同一份內容只壓縮一次，
+之後的請求直接回傳快取的結果。brotli 為選用套件，沒有安裝時只用 gzip。
+"""
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request, Response
+
+try:
+    import brotli
+except ImportError:  # 選用：pip install brotli
+    brotli = None
+
+
+def latest_sample(conn):
+    """資料庫中最新樣本的 (id, ts)，含已壓成區塊的資料；MAX(id) 只讀主鍵 B-tree 最右邊的頁"""
+    row_id = conn.execute("SELECT MAX(id) FROM sensor_data").fetchone()[0]
+    ts = None
+    if row_id is not None:
+        ts = conn.execute("SELECT ts FROM sensor_data WHERE id = ?", (row_id,)).fetchone()[0]
+    block_id, block_ts = conn.execute("SELECT MAX(max_id), MAX(end_ts) FROM sensor_blocks").fetchone()
+    if block_id is not None and (row_id is None or block_id > row_id):
+        row_id, ts = block_id, block_ts
+    return row_id or 0, ts
+
+
+def not_modified(etag, last_modified=None):
+    """客戶端的副本仍有效時回傳 304 回應，否則 None；有 If-None-Match 時不看 If-Modified-Since"""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        fresh = int(last_modified) <= request.if_modified_since.timestamp()
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    return tag(Response(status=304), etag, last_modified)
+
+
+def tag(response, etag, last_modified=None):
+    """附上驗證資訊；no-cache 讓瀏覽器可以保存副本，但每次使用前都要重新驗證"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = int(last_modified)
+    response.cache_control.no_cache = True
+    return response
+
+
+class Compressor:
+    """after_request hook：壓縮可壓縮的回應，並以 (網址, ETag, 編碼) 快取壓縮結果"""
+
+    def __init__(self, types, min_bytes=512, level=6, brotli_quality=5, cache_size=32):
+        self.types = frozenset(types)
+        self.min_bytes = min_bytes
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encoding_for(self, accept):
+        if brotli is not None and accept["br"]:
+            return "br"
+        if accept["gzip"]:
+            return "gzip"
+        return None
+
+    def compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def _cached(self, key):
+        with self._lock:
+            body = self._cache.get(key)
+            if body is not None:
+                self._cache.move_to_end(key)
+            return body
+
+    def _store(self, key, body):
+        with self._lock:
+            self._cache[key] = body
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def __call__(self, response):
+        if response.mimetype not in self.types:
+            return response
+        response.vary.add("Accept-Encoding")
+        if response.status_code != 200 or "Content-Encoding" in response.headers:
+            return response
+        if response.cache_control.no_transform:
+            return response
+        # 產生器串流（SSE、匯出）不壓縮；static 檔案是 direct passthrough，讀進來壓縮一次後快取
+        if response.is_streamed and not response.direct_passthrough:
+            return response
+        length = response.content_length
+        if length is not None and length < self.min_bytes:
+            return response
+        encoding = self.encoding_for(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        etag, _ = response.get_etag()
+        # ETag 只在同一個網址內有意義（例如不同查詢區間的 /data 可能共用最新樣本 id）
+        key = (request.full_path, etag, encoding) if etag else None
+        body = self._cached(key) if key else None
+        if body is None:
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < self.min_bytes:
+                return response
+            body = self.compress(data, encoding)
+            if key:
+                self._store(key, body)
+        else:
+            response.direct_passthrough = False
+            response.close()
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        # 壓縮後的位元組範圍與原檔不同
+        response.headers.pop("Accept-Ranges", None)
+        if etag:
+            # 與 nginx 相同：內容編碼不同，改成弱驗證的 ETag
+            response.set_etag(etag, weak=True)
+        return response
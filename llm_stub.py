@@ -0,0 +1,96 @@
+"""本機的 OpenAI 相容替身服務，供基準測試與開發時取代 Gemini API
+
+    python llm_stub.py --port 8900 --delay 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1/ python app.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "【模擬報告】溫度、濕度與光度皆在正常範圍內，未發現明顯異常。"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    reply = REPLY
+    calls = 0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        type(self).calls += 1
+        if request.get("stream"):
+            self._stream(request)
+            return
+        time.sleep(self.delay)
+        body = json.dumps({
+            "id": f"stub-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.reply},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, request):
+        """以 OpenAI 的 SSE 格式分段送出回覆，delay 平均分配在各段之間"""
+        pieces = [self.reply[i:i + 4] for i in range(0, len(self.reply), 4)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for i, piece in enumerate(pieces):
+            time.sleep(self.delay / len(pieces))
+            chunk = {
+                "id": f"stub-{self.calls}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece},
+                    "finish_reason": "stop" if i == len(pieces) - 1 else None
+                }]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(port=0, delay=0.0, reply=REPLY):
+    """在背景執行緒啟動替身服務，回傳 (server, base_url)"""
+    handler = type('Handler', (StubHandler,), {'delay': delay, 'reply': reply, 'calls': 0})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--delay', type=float, default=0.5, help='每次回應前等待的秒數')
+    args = parser.parse_args()
+    server, url = start_stub(args.port, args.delay)
+    print(f"LLM stub listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
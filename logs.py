@@ -0,0 +1,127 @@
+"""非同步的記錄輸出：呼叫端只把 LogRecord 放進佇列，格式化與寫檔在背景的 QueueListener 執行緒
+
+採樣與請求執行緒不碰 stdout / journal 的 I/O；訊息以 %s 參數傳入，真的要輸出時才格式化。
+佇列滿時丟棄新的記錄（計入 log_records_dropped_total）而不是卡住呼叫端。
+
+RateLimit 過濾器掛在會大量重複的 logger 上（每筆樣本、DHT11 讀取失敗等）：同一個訊息樣板
+在 interval 秒內只輸出第一筆，之後輸出時附上期間被略過的筆數。要分開計算的訊息（例如不同
+感測器的讀取錯誤）使用各自的樣板。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+import metrics
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+DROPPED = metrics.counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+SUPPRESSED = metrics.counter("log_records_suppressed_total", "Repeated log records skipped by rate limiting", ["logger"])
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+class RateLimit(logging.Filter):
+    """同一個 (logger, 訊息樣板) 每 interval 秒最多一筆；在呼叫端執行，只做一次字典查詢"""
+
+    def __init__(self, interval=60.0):
+        super().__init__()
+        self.interval = interval
+        self._last = {}
+        self._skipped = {}
+
+    def filter(self, record):
+        # 以未格式化的樣板為鍵：不在呼叫端格式化，參數不同（例如每筆樣本的數值）也算同一則
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < self.interval:
+            self._skipped[key] = self._skipped.get(key, 0) + 1
+            SUPPRESSED.labels(record.name).inc()
+            return False
+        self._last[key] = now
+        skipped = self._skipped.pop(key, 0)
+        if skipped:
+            record.suppressed = skipped
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """不在呼叫端格式化（交給 listener），佇列滿時丟棄"""
+
+    def prepare(self, record):
+        # 同一行程內的佇列不需要 pickle，保留 args 延後格式化
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} (+{suppressed} similar suppressed)" if suppressed else text
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆一行 JSON；extra={'fields': {...}} 的內容併入輸出"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _start(output_handler, queue_size):
+    global _listener
+    _handler.queue = queue.Queue(maxsize=queue_size)
+    _listener = logging.handlers.QueueListener(_handler.queue, output_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def setup(level="INFO", fmt="text", queue_size=10000, rate_limits=None, stream=None):
+    """設定 root logger 走佇列；rate_limits 為 {logger 名稱: 秒數}。可重複呼叫，只生效一次"""
+    global _handler
+    with _lock:
+        if _handler is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+        _handler = DroppingQueueHandler(None)
+        _start(output, queue_size)
+
+        root = logging.getLogger()
+        root.handlers[:] = [_handler]
+        root.setLevel(level)
+        for name, interval in (rate_limits or {}).items():
+            logging.getLogger(name).addFilter(RateLimit(interval))
+
+        # fork（gunicorn worker）之後背景執行緒不存在，子行程重新啟動一個 listener
+        os.register_at_fork(after_in_child=lambda: _start(output, queue_size))
+        # 結束時把佇列中剩下的記錄寫完
+        atexit.register(lambda: _listener.stop())
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+JOBS_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS report_jobs (
+        id TEXT PRIMARY KEY,
+        key TEXT NOT NULL,
+        status TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        created REAL NOT NULL,
+        finished REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_report_jobs_key ON report_jobs (key, created)",
+]
+
+JOB_COLUMNS = "id, key, status, result, error, created, finished"
+
+
+def create_tables(conn):
+    for sql in JOBS_SQL:
+        conn.execute(sql)
+    conn.commit()
+
+
+class ReportJob:
+    def __init__(self, key, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.key = key
+        self.status = "pending"  # pending / running / done / error
+        self.result = None
+        self.error = None
+        self.cached = False
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        data = {"job_id": self.id, "status": self.status, "cached": self.cached}
+        if self.status == "done":
+            data["message"] = self.result
+        elif self.status == "error":
+            data["error"] = self.error
+        return data
+
+    @classmethod
+    def from_row(cls, row):
+        job_id, key, status, result, error, created, finished = row
+        job = cls(key, job_id)
+        job.status, job.result, job.error, job.created, job.finished = status, result, error, created, finished
+        return job
+
+
+class ReportJobs:
+    """AI 報告工作佇列
+
+    POST 立即拿到 job id，報告在背景執行緒產生。結果以「資料視窗 + 提示詞」的雜湊快取；
+    相同請求直接回傳快取，同時進行中的重複請求共用同一個工作（只呼叫一次 LLM）。
+    指定 db_path 時工作狀態也寫入 SQLite，多個 web worker 行程可以互相查詢與共用結果。
+    """
+
+    def __init__(self, generate, workers=2, cache_size=32, cache_ttl=600.0, job_ttl=3600.0, db_path=None):
+        self.generate = generate  # generate(messages, model) -> str
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.job_ttl = job_ttl
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+        self._jobs = {}
+        self._inflight = {}
+        self._cache = OrderedDict()  # key -> (result, created)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(messages, model):
+        payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def submit(self, messages, model):
+        key = self.key_for(messages, model)
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            cached = self._cache.get(key)
+            if cached is not None and now - cached[1] <= self.cache_ttl:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                job = ReportJob(key)
+                job.status, job.result, job.cached, job.finished = "done", cached[0], True, now
+                self._jobs[job.id] = job
+                return job
+            job = self._inflight.get(key)
+            if job is not None:
+                # 相同內容的報告正在產生，共用同一個工作
+                self.hits += 1
+                return job
+
+        # 查 SQLite 不拿鎖；拿回鎖之後重新檢查，期間本行程可能已有相同的工作
+        shared = self._find_shared(key, now)
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is not None:
+                self.hits += 1
+                return job
+            if shared is not None:
+                # 其他行程已產生或正在產生
+                self.hits += 1
+                if shared.status == "done":
+                    shared.cached = True
+                    self._store(key, shared.result, shared.finished)
+                return shared
+            self.misses += 1
+            job = ReportJob(key)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+        self._save(job)
+        self._executor.submit(self._run, job, messages, model)
+        return job
+
+    def cached(self, key):
+        """回傳仍有效的快取結果，沒有則為 None"""
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and time.time() - cached[1] <= self.cache_ttl:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+        shared = self._find_shared(key, time.time())
+        if shared is None or shared.status != "done":
+            return None
+        with self._lock:
+            self._store(key, shared.result, shared.finished)
+            self.hits += 1
+        return shared.result
+
+    def store(self, key, result):
+        job = ReportJob(key)
+        job.status, job.result, job.finished = "done", result, time.time()
+        with self._lock:
+            self._store(key, result, job.finished)
+        self._save(job)
+
+    def _store(self, key, result, now):
+        self._cache[key] = (result, now)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.db_path:
+            row = self._query(f"SELECT {JOB_COLUMNS} FROM report_jobs WHERE id = ?", (job_id,))
+            job = ReportJob.from_row(row) if row else None
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {
+                "jobs": len(self._jobs),
+                "inflight": len(self._inflight),
+                "cached": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job, messages, model):
+        job.status = "running"
+        self._save(job)
+        start = time.perf_counter()
+        try:
+            result = self.generate(messages, model)
+        except Exception as e:
+            logger.error("Report job %s failed: %s", job.id, e)
+            with self._lock:
+                job.status, job.error, job.finished = "error", str(e), time.time()
+                self._inflight.pop(job.key, None)
+            self._save(job)
+            return
+        logger.info("Report job %s finished in %.1f s", job.id, time.perf_counter() - start)
+        with self._lock:
+            job.status, job.result, job.finished = "done", result, time.time()
+            self._inflight.pop(job.key, None)
+            self._store(job.key, result, job.finished)
+        self._save(job)
+
+    def _query(self, sql, params):
+        try:
+            with storage.read_connection(self.db_path) as conn:
+                return conn.execute(sql, params).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Report job lookup failed: %s", e)
+            return None
+
+    def _save(self, job):
+        if not self.db_path:
+            return
+        try:
+            with storage.write_transaction(self.db_path) as conn:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO report_jobs ({JOB_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, job.key, job.status, job.result, job.error, job.created, job.finished)
+                )
+        except sqlite3.Error as e:
+            logger.error("Failed to persist report job %s: %s", job.id, e)
+
+    def _find_shared(self, key, now):
+        """找其他行程的同內容工作：快取期限內完成的，或仍在產生中的"""
+        if not self.db_path:
+            return None
+        row = self._query(
+            f"SELECT {JOB_COLUMNS} FROM report_jobs WHERE key = ? AND created >= ? "
+            "AND (status IN ('pending', 'running') OR (status = 'done' AND finished >= ?)) "
+            "ORDER BY created DESC LIMIT 1",
+            (key, now - self.cache_ttl, now - self.cache_ttl)
+        )
+        return ReportJob.from_row(row) if row else None
+
+    def _prune(self, now):
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished is not None and now - job.finished > self.job_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if self.db_path and now - getattr(self, '_pruned', 0) > 60:
+            self._pruned = now
+            try:
+                with storage.write_transaction(self.db_path) as conn:
+                    conn.execute("DELETE FROM report_jobs WHERE created < ?", (now - self.job_ttl,))
+            except sqlite3.Error as e:
+                logger.error("Failed to prune report jobs: %s", e)
@@ -0,0 +1,261 @@
+import logging
+import threading
+import time
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+STATS_SQL = [
+    "CREATE TABLE IF NOT EXISTS table_stats (name TEXT PRIMARY KEY, row_count INTEGER NOT NULL)",
+    """
+    CREATE TRIGGER IF NOT EXISTS sensor_data_count_insert AFTER INSERT ON sensor_data
+    BEGIN
+        UPDATE table_stats SET row_count = row_count + 1 WHERE name = 'sensor_data';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS sensor_data_count_delete AFTER DELETE ON sensor_data
+    BEGIN
+        UPDATE table_stats SET row_count = row_count - 1 WHERE name = 'sensor_data';
+    END
+    """,
+]
+
+
+def create_stats(conn):
+    """建立筆數統計表與觸發器，之後不必再 COUNT(*) 全表掃描"""
+    conn.execute(STATS_SQL[0])
+    conn.execute(
+        "INSERT OR REPLACE INTO table_stats (name, row_count) "
+        "SELECT 'sensor_data', COUNT(*) FROM sensor_data"
+    )
+    for sql in STATS_SQL[1:]:
+        conn.execute(sql)
+    conn.commit()
+
+
+def enable_incremental_vacuum(conn, vacuum=False):
+    """auto_vacuum 改為 INCREMENTAL，回傳是否已生效
+
+    空的資料庫立即生效；既有資料庫需要一次完整 VACUUM（重寫整個檔案、期間鎖住寫入，
+    大型資料庫在 SD 卡上要好幾分鐘），因此啟動時不做，只在 vacuum=True（維護指令
+    python retention.py vacuum）時執行。
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return True
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.commit()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return True
+    if not vacuum:
+        logger.warning(
+            "Database is not in incremental auto_vacuum mode; freed pages are reused but the file will not shrink. "
+            "Run 'python retention.py vacuum' during a maintenance window to convert it"
+        )
+        return False
+    logger.info("Converting database to incremental auto_vacuum (full VACUUM, this can take minutes)")
+    start = time.perf_counter()
+    conn.execute("VACUUM")
+    logger.info("VACUUM finished in %.1f s", time.perf_counter() - start)
+    return True
+
+
+def row_count(conn, table='sensor_data'):
+    row = conn.execute("SELECT row_count FROM table_stats WHERE name = ?", (table,)).fetchone()
+    return row[0] if row else None
+
+
+class RetentionWorker:
+    """背景清理：原始資料被彙總表涵蓋且超過保留天數後分批刪除，定期 incremental VACUUM 與 WAL checkpoint
+
+    只清理本機（device_id）的原始資料與區塊：刪除界線來自本機的彙總表，收集端收到的其他裝置
+    資料沒有彙總也不會壓縮，刪掉就沒了，因此一律保留。
+
+    設定 compact_after 時，本機超過該秒數的原始資料也在這裡壓成區塊（見 blockstore.py）；
+    compact_limit() 回傳可壓縮的最大 id（邊緣節點尚未推送的資料不壓縮）。
+    """
+
+    def __init__(self, db_path, raw_days=7, rollup_days=None, finest_resolution=60,
+                 interval=3600.0, checkpoint_interval=300.0,
+                 batch_size=500, batch_pause=0.2, vacuum_pages=1000,
+                 device_id=None, compact_after=None, block_seconds=3600, compact_limit=None):
+        self.db_path = db_path
+        self.raw_days = raw_days
+        self.rollup_days = dict(rollup_days or {})
+        self.finest_resolution = finest_resolution
+        self.interval = interval
+        self.checkpoint_interval = checkpoint_interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.vacuum_pages = vacuum_pages
+        self.device_id = device_id
+        self.compact_after = compact_after
+        self.block_seconds = block_seconds
+        self.compact_limit = compact_limit
+        self._stop = threading.Event()
+        self._thread = None
+        self.raw_deleted = 0
+        self.rollup_deleted = 0
+        self.blocks_deleted = 0
+        self.compacted_rows = 0
+        self.compacted_blocks = 0
+        self.last_run = None
+        self.last_run_ms = 0.0
+        self.last_checkpoint = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "raw_deleted": self.raw_deleted,
+            "rollup_deleted": self.rollup_deleted,
+            "blocks_deleted": self.blocks_deleted,
+            "compacted_rows": self.compacted_rows,
+            "compacted_blocks": self.compacted_blocks,
+            "last_run": self.last_run,
+            "last_run_ms": round(self.last_run_ms, 3),
+            "last_checkpoint": self.last_checkpoint,
+        }
+
+    def _run(self):
+        next_retention = time.monotonic()
+        next_checkpoint = time.monotonic() + self.checkpoint_interval
+        while not self._stop.is_set():
+            now = time.monotonic()
+            # 失敗也排到下一輪，不原地重試；任何例外都不能讓執行緒結束（保留、checkpoint、壓縮都靠它）
+            if now >= next_retention:
+                try:
+                    self.run_once()
+                except Exception:
+                    logger.exception("Retention task failed")
+                next_retention = time.monotonic() + self.interval
+            if now >= next_checkpoint:
+                try:
+                    self.checkpoint()
+                except Exception:
+                    logger.exception("WAL checkpoint failed")
+                next_checkpoint = time.monotonic() + self.checkpoint_interval
+            self._stop.wait(max(0.0, min(next_retention, next_checkpoint) - time.monotonic()))
+
+    def _delete_batches(self, conn, sql, params):
+        """每批一個短交易，批次之間暫停，讓寫入執行緒可以插隊"""
+        total = 0
+        while not self._stop.is_set():
+            with conn:
+                deleted = conn.execute(sql, params + (self.batch_size,)).rowcount
+            total += deleted
+            if deleted < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+        return total
+
+    def raw_cutoff(self, conn, now=None):
+        """原始資料的刪除界線：超過保留天數，且不晚於最新一個已彙總的分鐘桶"""
+        now = int(now if now is not None else time.time())
+        cutoff = now - int(self.raw_days * 86400)
+        latest = conn.execute(
+            "SELECT MAX(bucket) FROM sensor_rollup WHERE resolution = ?", (self.finest_resolution,)
+        ).fetchone()[0]
+        if latest is None:
+            return None
+        return min(cutoff, latest)
+
+    def run_once(self):
+        start = time.perf_counter()
+        conn = storage.connect(self.db_path)
+        try:
+            cutoff = self.raw_cutoff(conn) if self.raw_days is not None and self.device_id else None
+            if cutoff is not None:
+                deleted = self._delete_batches(
+                    conn,
+                    # 留下 id 最大的一列，表清空後 SQLite 才不會重新從 1 配號（見 blockstore.compact）
+                    "DELETE FROM sensor_data WHERE id IN "
+                    "(SELECT id FROM sensor_data WHERE device_id = ? AND ts < ? "
+                    "AND id < (SELECT MAX(id) FROM sensor_data) ORDER BY ts LIMIT ?)",
+                    (self.device_id, cutoff)
+                )
+                self.raw_deleted += deleted
+                if deleted:
+                    logger.info("Retention removed %d raw rows older than %d", deleted, cutoff)
+                deleted = self._delete_batches(
+                    conn,
+                    "DELETE FROM sensor_blocks WHERE rowid IN "
+                    "(SELECT rowid FROM sensor_blocks WHERE device_id = ? AND end_ts <= ? ORDER BY end_ts LIMIT ?)",
+                    (self.device_id, cutoff)
+                )
+                self.blocks_deleted += deleted
+                if deleted:
+                    logger.info("Retention removed %d compacted blocks older than %d", deleted, cutoff)
+
+            if self.compact_after is not None:
+                self.compact(conn)
+
+            now = int(time.time())
+            for res, days in self.rollup_days.items():
+                if days is None:
+                    continue
+                deleted = self._delete_batches(
+                    conn,
+                    "DELETE FROM sensor_rollup WHERE resolution = ? AND bucket IN "
+                    "(SELECT bucket FROM sensor_rollup WHERE resolution = ? AND bucket < ? "
+                    "ORDER BY bucket LIMIT ?)",
+                    (res, res, now - int(days * 86400))
+                )
+                self.rollup_deleted += deleted
+                if deleted:
+                    logger.info("Retention removed %d rollup rows at %ds resolution", deleted, res)
+
+            # 只回收部分空頁，避免一次鎖住資料庫太久
+            conn.execute(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})").fetchall()
+        finally:
+            conn.close()
+        self.last_run = int(time.time())
+        self.last_run_ms = (time.perf_counter() - start) * 1000
+
+    def compact(self, conn):
+        import blockstore  # 需要 NumPy，只在真的壓縮時載入
+        max_id = self.compact_limit() if self.compact_limit else None
+        rows, blocks = blockstore.compact(
+            conn, self.device_id, int(time.time() - self.compact_after), self.block_seconds,
+            max_id=max_id, stop=self._stop.is_set
+        )
+        self.compacted_rows += rows
+        self.compacted_blocks += blocks
+        if rows:
+            logger.info("Compacted %d raw rows into %d blocks", rows, blocks)
+
+    def checkpoint(self):
+        conn = storage.connect(self.db_path)
+        try:
+            # PASSIVE 不會等待讀取者，非 WAL 模式下則是無作用
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        finally:
+            conn.close()
+        self.last_checkpoint = int(time.time())
+
+
+if __name__ == '__main__':
+    import argparse
+    from config import DB_PATH
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="資料保留的維護指令（請先停止服務）")
+    parser.add_argument('--db', default=DB_PATH)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('vacuum', help='完整 VACUUM 並改為 incremental auto_vacuum（一次性轉換）')
+    args = parser.parse_args()
+
+    conn = storage.connect(args.db)
+    try:
+        enable_incremental_vacuum(conn, vacuum=True)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+from array import array
+
+
+class SampleRing:
+    """固定大小的環狀緩衝，保存每個通道最近 N 筆讀數
+
+    /data 直接從這裡序列化；JSON 只在有新樣本或狀態改變時才重建一次，
+    其餘請求都回傳同一份已編碼好的 bytes。
+    """
+
+    def __init__(self, capacity, **status):
+        self.capacity = capacity
+        self._labels = [None] * capacity
+        self._temps = array('d', [0.0]) * capacity
+        self._hums = array('d', [0.0]) * capacity
+        self._lights = array('d', [0.0]) * capacity
+        self._anomalies = [None] * capacity  # 每筆的異常偵測結果 {channel: kind} 或 None
+        self._start = 0
+        self._count = 0
+        self._status = dict(status)
+        self._payload = None
+        self._lock = threading.Lock()
+        self._version = 0  # 樣本或狀態改變時遞增，用來判斷快取是否過期
+        self._modified = time.time()
+        # ETag 的前綴：重新啟動後 seq 從 0 開始，加上行程與啟動時間避免與舊的 ETag 相同
+        self._epoch = f"{os.getpid():x}{int(self._modified):x}"
+        self.seq = 0  # 每加入一筆樣本就遞增
+
+    def __len__(self):
+        return self._count
+
+    def push(self, timestamp, temperature, humidity, light, anomalies=None):
+        with self._lock:
+            if self._count < self.capacity:
+                idx = (self._start + self._count) % self.capacity
+                self._count += 1
+            else:
+                # 已滿：覆蓋最舊的一筆
+                idx = self._start
+                self._start = (self._start + 1) % self.capacity
+            self._labels[idx] = timestamp
+            self._temps[idx] = temperature
+            self._hums[idx] = humidity
+            self._lights[idx] = light
+            self._anomalies[idx] = anomalies or None
+            self.seq += 1
+            self._version += 1
+            self._modified = time.time()
+            self._payload = None
+
+    def set_status(self, **status):
+        """更新附帶在 /data 的狀態（蜂鳴器、警報旗標），有變化才讓快取失效並回傳 True"""
+        with self._lock:
+            changed = {k: v for k, v in status.items() if self._status.get(k) != v}
+            if changed:
+                self._status.update(changed)
+                self._version += 1
+                self._modified = time.time()
+                self._payload = None
+            return bool(changed)
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def _ordered(self, column):
+        # 依時間由舊到新排列
+        end = self._start + self._count
+        if end <= self.capacity:
+            return list(column[self._start:end])
+        return list(column[self._start:]) + list(column[:end - self.capacity])
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        data = {
+            "labels": self._ordered(self._labels),
+            "temps": self._ordered(self._temps),
+            "hums": self._ordered(self._hums),
+            "lights": self._ordered(self._lights),
+            "anomalies": self._ordered(self._anomalies),
+            "seq": self.seq,
+        }
+        data.update(self._status)
+        return data
+
+    def payload(self):
+        """回傳預先編碼好的 JSON bytes"""
+        return self.tagged()[0]
+
+    def tagged(self):
+        """(JSON bytes, ETag, 最後修改時間)；ETag 與時間對應的正是這份 bytes 的版本"""
+        with self._lock:
+            payload, version, modified, seq = self._payload, self._version, self._modified, self.seq
+            if payload is None:
+                data = self._snapshot()
+        if payload is None:
+            payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            with self._lock:
+                # 編碼期間若有新樣本進來就不要覆蓋成舊的內容
+                if self._version == version:
+                    self._payload = payload
+        # 最新樣本的序號加上版本（警報狀態改變時樣本不變，版本仍會遞增）
+        return payload, f"{self._epoch}-{seq}.{version}", modified
@@ -0,0 +1,197 @@
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 預設解析度（秒）：1 分鐘 / 1 小時 / 1 天
+DEFAULT_RESOLUTIONS = (60, 3600, 86400)
+
+# 以本地時區對齊，讓日統計從本地午夜開始
+TZ_OFFSET = time.localtime().tm_gmtoff
+
+CHANNELS = ('temperature', 'humidity', 'light')
+
+# sensor_rollup 只彙總本機的資料（由寫入緩衝的 hook 增量更新）；收集端收到的其他裝置資料
+# 不進彙總表，跨裝置查詢見 collector.fleet_series
+
+CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS sensor_rollup (
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    temperature_min REAL, temperature_max REAL, temperature_sum REAL,
+    humidity_min REAL, humidity_max REAL, humidity_sum REAL,
+    light_min REAL, light_max REAL, light_sum REAL,
+    PRIMARY KEY (resolution, bucket)
+) WITHOUT ROWID
+"""
+
+UPSERT_SQL = """
+INSERT INTO sensor_rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    temperature_min = MIN(temperature_min, excluded.temperature_min),
+    temperature_max = MAX(temperature_max, excluded.temperature_max),
+    temperature_sum = temperature_sum + excluded.temperature_sum,
+    humidity_min = MIN(humidity_min, excluded.humidity_min),
+    humidity_max = MAX(humidity_max, excluded.humidity_max),
+    humidity_sum = humidity_sum + excluded.humidity_sum,
+    light_min = MIN(light_min, excluded.light_min),
+    light_max = MAX(light_max, excluded.light_max),
+    light_sum = light_sum + excluded.light_sum
+"""
+
+
+def bucket_of(ts, resolution):
+    return (ts + TZ_OFFSET) // resolution * resolution - TZ_OFFSET
+
+
+def parse_time_arg(value):
+    """接受 epoch 秒或 'YYYY-MM-DD HH:MM:SS' / ISO 格式的本地時間（API 參數與命令列共用）"""
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+def create_tables(conn, resolutions=DEFAULT_RESOLUTIONS):
+    """建立彙總表並由既有的原始資料回填"""
+    conn.execute(CREATE_SQL)
+    for res in resolutions:
+        conn.execute(
+            f"""
+            INSERT OR IGNORE INTO sensor_rollup
+            SELECT ?, (ts + ?) / ? * ? - ?, COUNT(*),
+                   MIN(temperature), MAX(temperature), SUM(temperature),
+                   MIN(humidity), MAX(humidity), SUM(humidity),
+                   MIN(light), MAX(light), SUM(light)
+            FROM sensor_data WHERE ts IS NOT NULL
+            GROUP BY (ts + ?) / ?
+            """,
+            (res, TZ_OFFSET, res, res, TZ_OFFSET, TZ_OFFSET, res)
+        )
+        conn.commit()
+        logger.info("Rollup table for %ds resolution backfilled", res)
+
+
+def rebuild(conn, start, end, device_id, resolutions=DEFAULT_RESOLUTIONS):
+    """以本機 device_id 的資料重新計算涵蓋 [start, end] 的彙總桶（例如批次匯入舊資料之後）"""
+    has_blocks = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sensor_blocks'"
+    ).fetchone() is not None
+    if has_blocks:
+        import blockstore
+    for res in resolutions:
+        lo = bucket_of(start, res)
+        hi = bucket_of(end, res) + res
+        conn.execute(
+            "DELETE FROM sensor_rollup WHERE resolution = ? AND bucket >= ? AND bucket < ?",
+            (res, lo, hi)
+        )
+        conn.execute(
+            """
+            INSERT INTO sensor_rollup
+            SELECT ?, (ts + ?) / ? * ? - ?, COUNT(*),
+                   MIN(temperature), MAX(temperature), SUM(temperature),
+                   MIN(humidity), MAX(humidity), SUM(humidity),
+                   MIN(light), MAX(light), SUM(light)
+            FROM sensor_data WHERE ts >= ? AND ts < ? AND device_id = ?
+            GROUP BY (ts + ?) / ?
+            """,
+            (res, TZ_OFFSET, res, res, TZ_OFFSET, lo, hi, device_id, TZ_OFFSET, res)
+        )
+        if has_blocks:
+            # 已壓縮的時段：區塊的彙總再併入
+            conn.executemany(UPSERT_SQL, blockstore.rollup_rows(conn, lo, hi, res, device_id))
+
+
+def aggregate(rows, resolutions=DEFAULT_RESOLUTIONS):
+    """把一批 (timestamp, temperature, humidity, light, ts) 先在記憶體彙總"""
+    groups = {}
+    for _, temperature, humidity, light, ts in rows:
+        values = (temperature, humidity, light)
+        for res in resolutions:
+            key = (res, bucket_of(ts, res))
+            acc = groups.get(key)
+            if acc is None:
+                acc = groups[key] = [0]
+                for v in values:
+                    acc.extend((v, v, 0.0))
+            acc[0] += 1
+            for i, v in enumerate(values):
+                base = 1 + i * 3
+                if v < acc[base]:
+                    acc[base] = v
+                if v > acc[base + 1]:
+                    acc[base + 1] = v
+                acc[base + 2] += v
+    return [key + tuple(acc) for key, acc in groups.items()]
+
+
+def apply(conn, rows, resolutions=DEFAULT_RESOLUTIONS):
+    """在寫入原始資料的同一個交易裡增量更新彙總表"""
+    conn.executemany(UPSERT_SQL, aggregate(rows, resolutions))
+
+
+def finest_resolution(start, end, max_points, resolutions=DEFAULT_RESOLUTIONS, raw_interval=2):
+    """選點數不超過 max_points 的最細解析度（None 為原始資料）"""
+    span = max(0, end - start)
+    if span // raw_interval <= max_points:
+        return None
+    for res in sorted(resolutions):
+        if span // res <= max_points:
+            return res
+    return max(resolutions)
+
+
+def query_series(conn, start, end, max_points, device_id, resolutions=DEFAULT_RESOLUTIONS, raw_limit=5000):
+    """回傳本機 [start, end] 區間內每個通道的 min/max/mean/count"""
+    res = finest_resolution(start, end, max_points, resolutions)
+    return query_resolution(conn, start, end, res, device_id, raw_limit)
+
+
+def query_resolution(conn, start, end, res, device_id, raw_limit=5000):
+    """以指定解析度查詢；res 為 None 時讀 device_id 的原始資料，與彙總表同樣只含本機
+
+    原始資料超過 raw_limit 筆時只回傳最新的 raw_limit 筆，並設 truncated。
+    """
+    series = {"resolution": res or 0, "ts": [], "count": [], "truncated": False}
+    for ch in CHANNELS:
+        series[ch] = {"min": [], "max": [], "mean": []}
+
+    if res is None:
+        # 原始資料可能已壓成區塊；blockstore 需要 NumPy，用到時才載入
+        import blockstore
+        cols = blockstore.read_range(conn, device_id, start, end, raw_limit + 1, newest=True)
+        if len(cols["ts"]) > raw_limit:
+            cols = {name: values[1:] for name, values in cols.items()}
+            series["truncated"] = True
+        series["ts"] = cols["ts"].tolist()
+        series["count"] = [1] * len(series["ts"])
+        for ch in CHANNELS:
+            values = blockstore.nullable(cols[ch])
+            series[ch]["min"] = values
+            series[ch]["max"] = values
+            series[ch]["mean"] = values
+        return series
+
+    cursor = conn.execute(
+        "SELECT bucket, count, "
+        "temperature_min, temperature_max, temperature_sum, "
+        "humidity_min, humidity_max, humidity_sum, "
+        "light_min, light_max, light_sum "
+        "FROM sensor_rollup WHERE resolution = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket",
+        (res, bucket_of(start, res), end)
+    )
+    for bucket, count, *values in cursor:
+        series["ts"].append(bucket)
+        series["count"].append(count)
+        for i, ch in enumerate(CHANNELS):
+            lo, hi, total = values[i * 3:i * 3 + 3]
+            series[ch]["min"].append(lo)
+            series[ch]["max"].append(hi)
+            series[ch]["mean"].append(round(total / count, 2) if count else None)
+    return series
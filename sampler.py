@@ -0,0 +1,130 @@
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+READ_SECONDS = metrics.histogram("sensor_read_seconds", "Time spent in one driver read", ["sensor"])
+READS = metrics.counter("sensor_reads_total", "Driver reads by result (ok / error)", ["sensor", "result"])
+
+
+class SensorTask:
+    """單一感測器的採樣工作：依自己的週期在獨立執行緒讀取，失敗時指數退避加上抖動"""
+
+    def __init__(self, name, read_fn, interval, backoff_max=30.0, jitter=0.5):
+        self.name = name
+        self.read_fn = read_fn
+        self.interval = interval
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.failures = 0  # 連續失敗次數
+        self.reads = 0
+        self.errors = 0
+        self._latency = READ_SECONDS.labels(name)
+        self._ok = READS.labels(name, "ok")
+        self._error = READS.labels(name, "error")
+        # 每個感測器一個樣板，RateLimit 依樣板限流，一個感測器的錯誤不會蓋掉另一個
+        self._error_msg = name.replace("%", "%%") + " read raised: %s"
+
+    def read(self):
+        """回傳讀值；失敗（例外或 None）時回傳 None"""
+        start = time.perf_counter()
+        try:
+            value = self.read_fn()
+        except Exception as e:
+            logger.error(self._error_msg, e)
+            value = None
+        self._latency.observe(time.perf_counter() - start)
+        if value is None or (isinstance(value, tuple) and None in value):
+            self.failures += 1
+            self.errors += 1
+            self._error.inc()
+            return None
+        self.failures = 0
+        self.reads += 1
+        self._ok.inc()
+        return value
+
+    def next_delay(self, elapsed):
+        if self.failures == 0:
+            return max(0.0, self.interval - elapsed)
+        delay = min(self.backoff_max, self.interval * (2 ** min(self.failures, 16)))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class Sampler:
+    """多感測器採樣排程，依時間戳合併成完整樣本
+
+    primary（DHT11）每讀到一筆就輸出一筆合併樣本；其他通道取這段期間內
+    讀數的平均值，太久沒有更新則使用最後一筆（超過 max_age 則捨棄該樣本）。
+    """
+
+    def __init__(self, tasks, primary, max_age=5.0, max_queue=100):
+        self.tasks = {task.name: task for task in tasks}
+        self.primary = primary
+        self.max_age = max_age
+        self.samples = queue.Queue(maxsize=max_queue)
+        self._pending = {name: deque() for name in self.tasks if name != primary}
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for task in self.tasks.values():
+            t = threading.Thread(target=self._run_task, args=(task,), name=f"sampler-{task.name}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def close(self, timeout=2.0):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    def get(self, timeout=None):
+        """取得下一筆合併樣本 (ts, {name: value})"""
+        return self.samples.get(timeout=timeout)
+
+    def stats(self):
+        return {
+            name: {"reads": task.reads, "errors": task.errors, "failures": task.failures}
+            for name, task in self.tasks.items()
+        }
+
+    def _run_task(self, task):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            value = task.read()
+            if value is not None:
+                self._on_reading(task.name, time.time(), value)
+            self._stop.wait(task.next_delay(time.monotonic() - start))
+
+    def _on_reading(self, name, ts, value):
+        with self._lock:
+            if name != self.primary:
+                self._pending[name].append((ts, value))
+                self._latest[name] = (ts, value)
+                return
+
+            merged = {name: value}
+            for other, pending in self._pending.items():
+                window = [v for t, v in pending if t <= ts]
+                while pending and pending[0][0] <= ts:
+                    pending.popleft()
+                if window:
+                    merged[other] = sum(window) / len(window)
+                elif other in self._latest and ts - self._latest[other][0] <= self.max_age:
+                    merged[other] = self._latest[other][1]
+                else:
+                    logger.warning("No recent %s reading, dropping sample", other)
+                    return
+
+        try:
+            self.samples.put_nowait((ts, merged))
+        except queue.Full:
+            logger.warning("Sample queue full, dropping sample")
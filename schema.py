@@ -0,0 +1,182 @@
+import logging
+
+import alarm_log
+import collector
+import report_jobs
+import retention
+import rollup
+import shared_state
+import storage
+from config import ROLLUP_RESOLUTIONS, DEVICE_ID
+
+logger = logging.getLogger(__name__)
+
+# 依 SQLite 型別親和性比對，VARCHAR(20) 與 TEXT 視為相同
+EXPECTED_COLUMNS = {
+    'id': 'INTEGER',
+    'timestamp': 'TEXT',
+    'temperature': 'REAL',
+    'humidity': 'REAL',
+    'light': 'REAL',
+    'ts': 'INTEGER',
+    'device_id': 'TEXT',
+    'source_id': 'INTEGER',
+}
+
+BACKFILL_BATCH = 5000
+
+# 最初版本的資料表；之後的欄位都由遷移補上
+BASE_DDL = """
+CREATE TABLE IF NOT EXISTS sensor_data (
+    id INTEGER PRIMARY KEY,
+    timestamp VARCHAR(20),
+    temperature FLOAT,
+    humidity FLOAT,
+    light FLOAT
+)
+"""
+
+
+def type_affinity(declared):
+    declared = (declared or '').upper()
+    if 'INT' in declared:
+        return 'INTEGER'
+    if 'CHAR' in declared or 'CLOB' in declared or 'TEXT' in declared:
+        return 'TEXT'
+    if 'REAL' in declared or 'FLOA' in declared or 'DOUB' in declared:
+        return 'REAL'
+    if not declared or 'BLOB' in declared:
+        return 'BLOB'
+    return 'NUMERIC'
+
+
+def table_columns(conn, table):
+    return {row[1]: type_affinity(row[2]) for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_epoch_column(conn):
+    """v1：新增整數 epoch 欄位 ts 並建立索引，由舊的 timestamp 字串回填"""
+    if 'ts' not in table_columns(conn, 'sensor_data'):
+        conn.execute("ALTER TABLE sensor_data ADD COLUMN ts INTEGER")
+        conn.commit()
+
+    # timestamp 是本地時間字串，'utc' 修飾把它轉成 UTC epoch
+    lo, hi = conn.execute("SELECT MIN(id), MAX(id) FROM sensor_data").fetchone()
+    if lo is not None:
+        filled = 0
+        for start in range(lo - 1, hi, BACKFILL_BATCH):
+            cur = conn.execute(
+                "UPDATE sensor_data SET ts = CAST(strftime('%s', timestamp, 'utc') AS INTEGER) "
+                "WHERE id > ? AND id <= ? AND ts IS NULL",
+                (start, start + BACKFILL_BATCH)
+            )
+            conn.commit()
+            filled += cur.rowcount
+        logger.info("Backfilled ts for %d sensor_data rows", filled)
+
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_sensor_data_ts ON sensor_data (ts)")
+    conn.commit()
+
+
+def _create_rollups(conn):
+    """v2：1 分 / 1 時 / 1 天彙總表，由既有資料回填"""
+    rollup.create_tables(conn, ROLLUP_RESOLUTIONS)
+
+
+def _create_stats(conn):
+    """v3：筆數統計表（觸發器維護）；既有的大型資料庫不在這裡 VACUUM（見 retention.enable_incremental_vacuum）"""
+    retention.create_stats(conn)
+    retention.enable_incremental_vacuum(conn)
+
+
+def _create_alarm_events(conn):
+    """v4：警報事件表（每次觸發／解除各寫一次）"""
+    alarm_log.create_tables(conn)
+
+
+def _add_device_columns(conn):
+    """v5：多節點收集用的 device_id / source_id 欄位、唯一索引與裝置表"""
+    columns = table_columns(conn, 'sensor_data')
+    if 'device_id' not in columns:
+        conn.execute("ALTER TABLE sensor_data ADD COLUMN device_id TEXT")
+    if 'source_id' not in columns:
+        conn.execute("ALTER TABLE sensor_data ADD COLUMN source_id INTEGER")
+    conn.commit()
+
+    # 既有資料都屬於本機
+    lo, hi = conn.execute("SELECT MIN(id), MAX(id) FROM sensor_data").fetchone()
+    if lo is not None:
+        for start in range(lo - 1, hi, BACKFILL_BATCH):
+            conn.execute(
+                "UPDATE sensor_data SET device_id = ? WHERE id > ? AND id <= ? AND device_id IS NULL",
+                (DEVICE_ID, start, start + BACKFILL_BATCH)
+            )
+            conn.commit()
+
+    # 邊緣節點重送同一批資料時以 (device_id, source_id) 去重；本機資料 source_id 為 NULL 不受影響
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_sensor_data_source ON sensor_data (device_id, source_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_sensor_data_device_ts ON sensor_data (device_id, ts)")
+    collector.create_tables(conn)
+
+
+def _create_shared_tables(conn):
+    """v6：多行程共用的設定表與 AI 報告工作表"""
+    shared_state.create_tables(conn)
+    report_jobs.create_tables(conn)
+
+
+def _create_blocks(conn):
+    """v7：原始資料的壓縮區塊表"""
+    import blockstore  # 需要 NumPy，只在遷移時載入
+    blockstore.create_tables(conn)
+
+
+def _record_device_id(conn):
+    """v8：把本機裝置代號記在 settings 表，之後啟動都沿用（見 config.DEVICE_ID）"""
+    row = conn.execute(
+        "SELECT device_id FROM sensor_data WHERE source_id IS NULL AND device_id IS NOT NULL "
+        "ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    shared_state.save_json_setting(conn, "device_id", row[0] if row else DEVICE_ID)
+
+
+# 依序執行；PRAGMA user_version 記錄已套用到第幾個
+MIGRATIONS = [
+    _add_epoch_column,
+    _create_rollups,
+    _create_stats,
+    _create_alarm_events,
+    _add_device_columns,
+    _create_shared_tables,
+    _create_blocks,
+    _record_device_id,
+]
+
+
+def migrate(db_path):
+    """把 data.db 升級到最新結構（就地進行，可重複執行）"""
+    conn = storage.connect(db_path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            # 新的資料庫：auto_vacuum 要在切換 WAL 與建表之前設定，之後就不必 VACUUM
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        storage.set_journal_mode(conn)
+        if version == 0:
+            # 空資料庫（例如收集端）先建立最初版本的資料表
+            conn.execute(BASE_DDL)
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info("Applying schema migration %d: %s", number, step.__name__)
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def verify_sensor_table(conn):
+    """回傳 (是否相容, 實際欄位)"""
+    actual = table_columns(conn, 'sensor_data')
+    compatible = all(actual.get(name) == affinity for name, affinity in EXPECTED_COLUMNS.items())
+    return compatible, actual
@@ -1,10 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
+db = SQLAlchemy()  # 由 app.create_app() 以 db.init_app(app) 綁定
 
+# Database model (must match existing sensor_data table)
 class SensorData(db.Model):
     __tablename__ = 'sensor_data'
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.String(20))
+    ts = db.Column(db.Integer, index=True)  # epoch 秒，時間區間查詢用
     temperature = db.Column(db.Float)
     humidity = db.Column(db.Float)
     light = db.Column(db.Float)
+    device_id = db.Column(db.String(64))  # 資料來源裝置（多節點收集）
+    source_id = db.Column(db.Integer)  # 來源裝置上的 id，收集端去重用；本機資料為 NULL
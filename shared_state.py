@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_SQL = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+def create_tables(conn):
+    conn.execute(SETTINGS_SQL)
+    conn.commit()
+
+
+def write_atomic(path, data):
+    """先寫暫存檔再改名，讀取端不會看到寫到一半的內容"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write_json(path, obj):
+    write_atomic(path, json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+class SnapshotReader:
+    """讀取採樣行程寫出的快照檔；檔案沒變就回傳快取的 bytes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+        self._payload = b'{}'
+        self._data = {}
+        self._etag = "empty"
+        self._modified = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            try:
+                with open(self.path, 'rb') as f:
+                    payload = f.read()
+                data = json.loads(payload)
+            except (OSError, ValueError) as e:
+                logger.warning("Failed to read snapshot %s: %s", self.path, e)
+                return
+            self._payload, self._data, self._stamp = payload, data, stamp
+            # 所有 web worker 讀同一個檔案，ETag 由檔案的 inode（每次改名寫入都不同）、修改時間與大小組成，各 worker 一致
+            self._etag, self._modified = "-".join(f"{v:x}" for v in (st.st_ino, st.st_mtime_ns, st.st_size)), st.st_mtime
+
+    def payload(self):
+        self._refresh()
+        return self._payload
+
+    def data(self):
+        self._refresh()
+        return self._data
+
+    def tagged(self):
+        """(bytes, ETag, 最後修改時間)，三者屬於同一個版本"""
+        self._refresh()
+        with self._lock:
+            return self._payload, self._etag, self._modified
+
+
+class SnapshotRelay:
+    """Web 行程：輪詢快照檔，把新樣本與警報狀態轉成本行程的 SSE 事件"""
+
+    STATUS_KEYS = ("buzzer", "tem", "hum", "lig", "temperature_anomaly", "humidity_anomaly", "light_anomaly")
+
+    def __init__(self, reader, events, interval=0.5):
+        self.reader = reader
+        self.events = events
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="snapshot-relay", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    def _run(self):
+        data = self.reader.data()
+        seq = data.get("seq", 0)
+        status = {k: data.get(k) for k in self.STATUS_KEYS}
+        while not self._stop.wait(self.interval):
+            data = self.reader.data()
+            new_seq = data.get("seq", 0)
+            if new_seq > seq:
+                labels = data.get("labels", [])
+                anomalies = data.get("anomalies") or [None] * len(labels)
+                count = min(new_seq - seq, len(labels))
+                for i in range(len(labels) - count, len(labels)):
+                    self.events.publish("sample", {
+                        "timestamp": labels[i],
+                        "temperature": data["temps"][i],
+                        "humidity": data["hums"][i],
+                        "light": data["lights"][i],
+                        "anomalies": anomalies[i]
+                    }, event_id=new_seq - (len(labels) - 1 - i))
+            seq = new_seq
+            new_status = {k: data.get(k) for k in self.STATUS_KEYS}
+            if new_status != status:
+                status = new_status
+                self.events.publish("alarm", status)
+
+
+def load_json_setting(conn, name, default=None):
+    row = conn.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+def save_json_setting(conn, name, value):
+    """不自行 commit：由呼叫端的交易（storage.write_transaction、遷移）一併提交"""
+    conn.execute(
+        "INSERT OR REPLACE INTO settings (name, value, updated) VALUES (?, ?, ?)",
+        (name, json.dumps(value), time.time())
+    )
+
+
+class SettingsWatcher:
+    """採樣行程：定期檢查 settings 表，有更新時呼叫 on_change(name, value)"""
+
+    def __init__(self, db_path, names, on_change, interval=1.0):
+        self.db_path = db_path
+        self.names = list(names)
+        self.on_change = on_change
+        self.interval = interval
+        self._seen = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.poll(notify=False)
+        self._thread = threading.Thread(target=self._run, name="settings-watcher", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    def poll(self, notify=True):
+        marks = ",".join("?" * len(self.names))
+        with storage.read_connection(self.db_path) as conn:
+            rows = conn.execute(
+                f"SELECT name, value, updated FROM settings WHERE name IN ({marks})", self.names
+            ).fetchall()
+        for name, value, updated in rows:
+            if self._seen.get(name) != updated:
+                self._seen[name] = updated
+                if notify:
+                    self.on_change(name, json.loads(value))
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error("Settings poll failed: %s", e)
+            if self._stop.wait(self.interval):
+                break
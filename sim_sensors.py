@@ -0,0 +1,82 @@
+import logging
+import math
+import random
+import threading
+
+from drivers import ActuatorDriver, LightDriver, TempHumidityDriver
+
+logger = logging.getLogger(__name__)
+
+# 模擬一天的週期（以讀取次數計，實機 2 秒一筆約 43200 筆）
+DAY_SAMPLES = 43200
+
+
+class _SimulatedSensor:
+    """以固定種子產生可重現的讀數序列；可設定雜訊、讀取失敗率與突波"""
+
+    def __init__(self, seed=0, noise=0.5, fault_rate=0.0, spike_rate=0.0, speedup=1.0):
+        self.rng = random.Random(seed)
+        self.noise = noise
+        self.fault_rate = fault_rate
+        self.spike_rate = spike_rate
+        self.speedup = speedup
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _phase(self):
+        # speedup 越大，模擬時間跑得越快
+        return 2 * math.pi * ((self.count * self.speedup) % DAY_SAMPLES) / DAY_SAMPLES
+
+    def _next(self):
+        """回傳 (是否失敗, 相位, 突波, 雜訊)"""
+        with self._lock:
+            self.count += 1
+            phase = self._phase()
+            if self.rng.random() < self.fault_rate:
+                return True, phase, 0.0, 0.0
+            spike = self.rng.choice((-1, 1)) * 10 if self.rng.random() < self.spike_rate else 0.0
+            return False, phase, spike, self.rng.gauss(0, self.noise)
+
+
+class SimulatedDHT(_SimulatedSensor, TempHumidityDriver):
+    def read(self):
+        failed, phase, spike, noise = self._next()
+        if failed:
+            return None, None
+        # DHT11 只有整數精度
+        temperature = round(26 + 4 * math.sin(phase) + noise + spike)
+        humidity = round(min(95, max(20, 65 - 10 * math.sin(phase) - noise + spike * 2)))
+        return temperature, humidity
+
+
+class SimulatedLight(_SimulatedSensor, LightDriver):
+    def read(self):
+        failed, phase, spike, noise = self._next()
+        if failed:
+            return None
+        daylight = max(0.0, math.sin(phase)) * 400
+        return round(max(0.0, 5 + daylight + noise * 10 + spike * 20), 1)
+
+
+class SimulatedActuator(ActuatorDriver):
+    """只記錄狀態，不碰 GPIO"""
+
+    def __init__(self):
+        self.buzzer = False
+        self.led_on = False
+        self.transitions = 0
+
+    def buzzer_on(self):
+        if not self.buzzer:
+            self.transitions += 1
+        self.buzzer = True
+        logger.debug("[sim] buzzer on")
+
+    def buzzer_off(self):
+        if self.buzzer:
+            self.transitions += 1
+        self.buzzer = False
+        logger.debug("[sim] buzzer off")
+
+    def led(self, on):
+        self.led_on = bool(on)
@@ -0,0 +1,161 @@
+"""SQLite 連線設定：WAL、pragma、唯讀連線池與單一寫入路徑
+
+WAL 模式下讀取者看到的是交易開始時的快照，不會擋住寫入，寫入也不會擋住讀取。
+同一個行程內的寫入都經過 write_transaction()（一條連線 + 一把鎖），排隊寫入而不是
+各自開連線互相等 busy timeout；讀取走 read_connection() 的連線池，重複使用連線
+省去每次開檔與解析 schema 的成本。
+"""
+import contextlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from config import SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT
+from config import SQLITE_CACHE_KB, SQLITE_MMAP_BYTES, SQLITE_READ_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def configure(conn):
+    """每條連線各自的設定（journal_mode 是資料庫層級，見 set_journal_mode）"""
+    conn.execute(f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT * 1000)}")
+    # WAL 下 NORMAL 只在斷電時可能遺失最後幾筆交易，不會損毀資料庫
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = {-int(SQLITE_CACHE_KB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(SQLITE_MMAP_BYTES)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def connect(db_path, readonly=False, check_same_thread=True):
+    conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=check_same_thread)
+    configure(conn)
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def set_journal_mode(conn, mode=SQLITE_JOURNAL_MODE):
+    """切換 journal 模式（WAL 會記錄在資料庫檔案中，之後的連線都沿用）"""
+    current = conn.execute(f"PRAGMA journal_mode = {mode}").fetchone()[0]
+    if current.upper() != mode.upper():
+        logger.warning("Could not switch journal_mode to %s (still %s)", mode, current)
+    return current
+
+
+class ReaderPool:
+    """唯讀連線池；連線用完放回，最多 size 條，用滿時等待其他請求歸還"""
+
+    def __init__(self, db_path, size=SQLITE_READ_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # gunicorn fork 之後不沿用父行程的連線
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self.waits = 0
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                self.waits += 1
+                create = False
+        if create:
+            try:
+                return connect(self.db_path, readonly=True, check_same_thread=False)
+            except sqlite3.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=SQLITE_BUSY_TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError("reader pool exhausted")
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._pid == os.getpid():
+                self._idle.put(conn)
+
+    def stats(self):
+        return {"size": self.size, "open": self._created, "idle": self._idle.qsize(), "waits": self.waits}
+
+
+class Writer:
+    """本行程唯一的寫入連線；transaction() 之間以鎖排隊"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+        self.transactions = 0
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                self._conn = connect(self.db_path, check_same_thread=False)
+                self._pid = os.getpid()
+            with self._conn:
+                yield self._conn
+            self.transactions += 1
+
+
+_readers = {}
+_writers = {}
+_registry_lock = threading.Lock()
+
+
+def readers(db_path):
+    with _registry_lock:
+        pool = _readers.get(db_path)
+        if pool is None:
+            pool = _readers[db_path] = ReaderPool(db_path)
+        return pool
+
+
+def writer(db_path):
+    with _registry_lock:
+        w = _writers.get(db_path)
+        if w is None:
+            w = _writers[db_path] = Writer(db_path)
+        return w
+
+
+def read_connection(db_path):
+    """with storage.read_connection(DB_PATH) as conn: ..."""
+    return readers(db_path).connection()
+
+
+def write_transaction(db_path):
+    """with storage.write_transaction(DB_PATH) as conn: ...（離開時 commit，例外時 rollback）"""
+    return writer(db_path).transaction()
+
+
+def stats(db_path):
+    return {
+        "readers": readers(db_path).stats(),
+        "write_transactions": writer(db_path).transactions,
+    }
@@ -0,0 +1,185 @@
+import time
+from datetime import datetime
+
+import numpy as np
+
+import rollup
+
+CHANNELS = {
+    # 通道: (顯示名稱, 單位, 警報方向)
+    "temperature": ("溫度", "°C", ">"),
+    "humidity": ("濕度", "%", ">"),
+    "light": ("光度", "lux", "<"),
+}
+
+MAX_CHANGE_POINTS = 3
+MAX_INTERVALS = 5
+MAX_ANOMALIES = 5
+ANOMALY_Z = 4.0
+
+
+def load_window(conn, start, end, device_id, max_points=2000, resolutions=rollup.DEFAULT_RESOLUTIONS):
+    """從彙總表（或短區間的本機原始資料）取出 NumPy 陣列，點數不超過 max_points"""
+    res = rollup.finest_resolution(start, end, max_points, resolutions)
+    series = rollup.query_resolution(conn, start, end, res, device_id, raw_limit=max_points)
+    data = {
+        "resolution": series["resolution"],
+        "ts": np.asarray(series["ts"], dtype=np.int64),
+        "count": np.asarray(series["count"], dtype=np.int64),
+    }
+    for ch in CHANNELS:
+        for stat in ("min", "max", "mean"):
+            data[f"{ch}_{stat}"] = np.asarray(series[ch][stat], dtype=np.float64)
+    return data
+
+
+def _fmt_time(ts):
+    return datetime.fromtimestamp(int(ts)).strftime('%m-%d %H:%M')
+
+
+def slope_per_hour(ts, values):
+    if len(values) < 2 or ts[-1] == ts[0]:
+        return 0.0
+    hours = (ts - ts[0]) / 3600.0
+    return float(np.polyfit(hours, values, 1)[0])
+
+
+def change_points(values, max_points=MAX_CHANGE_POINTS, min_size=5):
+    """二分切割找平均值的轉折點；用累積和一次算出所有切點的分數"""
+    found = []
+    segments = [(0, len(values))]
+    noise = float(np.std(np.diff(values))) / np.sqrt(2) if len(values) > 2 else 0.0
+    threshold = max(noise * 4.0, 1e-9)
+    while segments and len(found) < max_points:
+        best = None
+        for lo, hi in segments:
+            seg = values[lo:hi]
+            n = len(seg)
+            if n < 2 * min_size:
+                continue
+            csum = np.cumsum(seg)
+            idx = np.arange(min_size, n - min_size + 1)
+            left = csum[idx - 1] / idx
+            right = (csum[-1] - csum[idx - 1]) / (n - idx)
+            score = np.abs(left - right) * np.sqrt(idx * (n - idx) / n)
+            i = int(np.argmax(score))
+            if best is None or score[i] > best[0]:
+                best = (float(score[i]), lo, hi, lo + int(idx[i]), float(left[i]), float(right[i]))
+        if best is None or best[0] < threshold * np.sqrt(min_size):
+            break
+        _, lo, hi, split, before, after = best
+        found.append((split, before, after))
+        segments.remove((lo, hi))
+        segments.extend([(lo, split), (split, hi)])
+    return sorted(found)
+
+
+def exceedance_intervals(ts, values, threshold, direction, resolution):
+    """連續超過門檻的時間區段 (開始, 結束, 極值)"""
+    mask = values > threshold if direction == ">" else values < threshold
+    if not mask.any():
+        return []
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    step = resolution or 2
+    intervals = []
+    for s, e in zip(starts, ends):
+        seg = values[s:e + 1]
+        peak = seg.max() if direction == ">" else seg.min()
+        intervals.append((int(ts[s]), int(ts[e]) + step, float(peak)))
+    # 只保留持續最久的幾段
+    intervals.sort(key=lambda iv: iv[1] - iv[0], reverse=True)
+    return sorted(intervals[:MAX_INTERVALS])
+
+
+def anomalies(ts, values, z=ANOMALY_Z):
+    """以中位數與 MAD 計算穩健 z 分數"""
+    if len(values) < 10:
+        return 0, []
+    median = np.median(values)
+    mad = np.median(np.abs(values - median)) * 1.4826
+    if mad == 0:
+        return 0, []
+    scores = np.abs(values - median) / mad
+    flagged = np.flatnonzero(scores > z)
+    top = flagged[np.argsort(scores[flagged])[::-1][:MAX_ANOMALIES]]
+    return len(flagged), [(int(ts[i]), float(values[i])) for i in sorted(top)]
+
+
+def summarize_window(data, thresholds):
+    """把一段時間的資料壓縮成固定大小的摘要（dict）"""
+    ts = data["ts"]
+    digest = {"points": int(len(ts)), "resolution": data["resolution"], "channels": {}}
+    if len(ts) == 0:
+        return digest
+    digest["start"] = int(ts[0])
+    digest["end"] = int(ts[-1])
+    digest["samples"] = int(data["count"].sum())
+    for ch, (_, _, direction) in CHANNELS.items():
+        mean = data[f"{ch}_mean"]
+        ok = ~np.isnan(mean)
+        if not ok.any():
+            continue
+        t, mean = ts[ok], mean[ok]
+        lo, hi = data[f"{ch}_min"][ok], data[f"{ch}_max"][ok]
+        extreme = hi if direction == ">" else lo
+        n_anomalies, top = anomalies(t, mean)
+        digest["channels"][ch] = {
+            "min": float(lo.min()),
+            "max": float(hi.max()),
+            "mean": float(np.average(mean, weights=data["count"][ok])),
+            "std": float(mean.std()),
+            "first": float(mean[0]),
+            "last": float(mean[-1]),
+            "slope_per_hour": slope_per_hour(t, mean),
+            "change_points": [(int(t[i]), b, a) for i, b, a in change_points(mean)],
+            "exceedances": exceedance_intervals(t, extreme, thresholds[ch], direction, data["resolution"]),
+            "anomaly_count": n_anomalies,
+            "anomalies": top,
+        }
+    return digest
+
+
+def format_digest(digest, thresholds):
+    """轉成給 LLM 的精簡文字，長度與資料量無關"""
+    if not digest["points"]:
+        return "此區間沒有感測資料。"
+    res = digest["resolution"]
+    lines = [
+        f"期間 {_fmt_time(digest['start'])} ~ {_fmt_time(digest['end'])}，"
+        f"共 {digest['samples']} 筆讀數（{'原始資料' if not res else f'每 {res // 60} 分鐘彙總'}）。"
+    ]
+    for ch, stats in digest["channels"].items():
+        name, unit, direction = CHANNELS[ch]
+        lines.append(
+            f"{name}：平均 {stats['mean']:.1f}{unit}，範圍 {stats['min']:.1f}~{stats['max']:.1f}，"
+            f"標準差 {stats['std']:.2f}，由 {stats['first']:.1f} 變為 {stats['last']:.1f}，"
+            f"趨勢 {stats['slope_per_hour']:+.2f}{unit}/小時。"
+        )
+        for t, before, after in stats["change_points"]:
+            lines.append(f"  - {_fmt_time(t)} 起平均值由 {before:.1f} 變為 {after:.1f}")
+        for start, end, peak in stats["exceedances"]:
+            lines.append(
+                f"  - {_fmt_time(start)}~{_fmt_time(end)} {'高於' if direction == '>' else '低於'}"
+                f"警報值 {thresholds[ch]:g}{unit}，極值 {peak:.1f}"
+            )
+        if stats["anomaly_count"]:
+            points = "、".join(f"{_fmt_time(t)}={v:.1f}" for t, v in stats["anomalies"])
+            lines.append(f"  - 異常點 {stats['anomaly_count']} 個，例如 {points}")
+    return "\n".join(lines)
+
+
+def build_context(conn, start, end, thresholds, device_id, max_points=2000, resolutions=rollup.DEFAULT_RESOLUTIONS):
+    data = load_window(conn, start, end, device_id, max_points=max_points, resolutions=resolutions)
+    return format_digest(summarize_window(data, thresholds), thresholds)
+
+
+def window_bounds(window, now=None):
+    """'hour' / 'day' / 'week' 或秒數 -> (start, end)"""
+    presets = {"hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+    seconds = presets.get(window)
+    if seconds is None:
+        seconds = int(window)
+    end = int(now if now is not None else time.time())
+    return end - seconds, end
@@ -0,0 +1,165 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+import storage
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.histogram("db_flush_seconds", "Write buffer flush transaction time (insert + rollup hooks)")
+ROWS_WRITTEN = metrics.counter("db_rows_written_total", "Sensor rows committed by the write buffer")
+FLUSH_FAILURES = metrics.counter("db_flush_failures_total", "Write buffer flushes that failed and will be retried")
+HOOK_FAILURES = metrics.counter("db_flush_hook_failures_total", "Flush hooks (e.g. rollup updates) that raised; rows were still written")
+DROPPED = metrics.counter("write_buffer_dropped_total", "Readings dropped because the write buffer queue was full")
+
+INSERT_SQL = (
+    "INSERT INTO sensor_data (timestamp, temperature, humidity, light, ts, device_id) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+_STOP = object()
+
+
+class WriteBuffer:
+    """Write-behind 緩衝：讀數先進佇列，累積到筆數或時間上限後以單一交易批次寫入"""
+
+    def __init__(self, db_path, max_rows=30, max_age=10.0, max_queue=1000, hooks=(), device_id=None):
+        self.db_path = db_path
+        self.device_id = device_id
+        # hooks(conn, rows) 在同一個交易內執行，例如更新彙總表
+        self.hooks = list(hooks)
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.flush_count = 0
+        self.flush_failures = 0
+        self.rows_written = 0
+        self.dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+        self._thread.start()
+
+    def put(self, row):
+        """加入一筆 (timestamp, temperature, humidity, light, ts)，佇列滿時丟棄最舊的資料而不阻塞採樣"""
+        while True:
+            try:
+                self._queue.put_nowait(row)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    with self._stats_lock:
+                        self.dropped += 1
+                    DROPPED.inc()
+                except queue.Empty:
+                    pass
+
+    def close(self, timeout=10.0):
+        """停止寫入執行緒並把剩餘資料全部寫入"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        logger.info("Write buffer closed: %s", self.stats())
+
+    def queued(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queued": self._queue.qsize(),
+                "flushes": self.flush_count,
+                "flush_failures": self.flush_failures,
+                "rows_written": self.rows_written,
+                "dropped": self.dropped,
+                "last_flush_ms": round(self.last_flush_ms, 3),
+                "avg_flush_ms": round(self.total_flush_ms / self.flush_count, 3) if self.flush_count else 0.0,
+                "max_flush_ms": round(self.max_flush_ms, 3),
+            }
+
+    def _run(self):
+        batch = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stopping = True
+                # 關閉前把佇列裡剩下的讀數一起帶走
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            elif item is not None:
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_age
+                batch.append(item)
+
+            if batch and (stopping or len(batch) >= self.max_rows or time.monotonic() >= deadline):
+                if self._flush(batch):
+                    batch = []
+                    deadline = None
+                else:
+                    # 寫入失敗時保留資料稍後重試，但不讓暫存無限制成長
+                    del batch[:-self.max_queue]
+                    deadline = time.monotonic() + self.max_age
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            # 與本行程其他寫入（警報事件、設定）共用同一條寫入連線
+            with storage.write_transaction(self.db_path) as conn:
+                conn.executemany(INSERT_SQL, [row + (self.device_id,) for row in batch])
+                for hook in self.hooks:
+                    self._run_hook(hook, conn, batch)
+        except Exception as e:
+            # 任何例外都不能讓寫入執行緒結束，否則佇列滿了之後樣本會無聲無息地被丟棄
+            with self._stats_lock:
+                self.flush_failures += 1
+            FLUSH_FAILURES.inc()
+            if isinstance(e, sqlite3.Error):
+                logger.error("Failed to flush %d buffered rows: %s", len(batch), e)
+            else:
+                logger.exception("Failed to flush %d buffered rows", len(batch))
+            return False
+        elapsed = (time.perf_counter() - start) * 1000
+        FLUSH_SECONDS.observe(elapsed / 1000)
+        ROWS_WRITTEN.inc(len(batch))
+        with self._stats_lock:
+            self.flush_count += 1
+            self.rows_written += len(batch)
+            self.last_flush_ms = elapsed
+            self.total_flush_ms += elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        logger.debug("Flushed %d rows in %.1f ms", len(batch), elapsed)
+        return True
+
+    def _run_hook(self, hook, conn, batch):
+        """hook 失敗時只回復它自己的變更並記錄，原始資料照常寫入（彙總表可事後以 rollup.rebuild 重建）"""
+        conn.execute("SAVEPOINT flush_hook")
+        try:
+            hook(conn, batch)
+        except Exception:
+            conn.execute("ROLLBACK TO flush_hook")
+            HOOK_FAILURES.inc()
+            logger.exception("Flush hook %r failed for %d rows", hook, len(batch))
+        conn.execute("RELEASE flush_hook")
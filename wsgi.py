@@ -0,0 +1,7 @@
+"""gunicorn 進入點：web worker 只處理 HTTP，採樣與 GPIO 由 gunicorn.conf.py 啟動的 sampler 行程負責
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import create_app
+
+app = application = create_app("web")